@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Index of the pregenerated images that replies attach: the neighborhood maps,
+# the parcel composites and the tract maps and graphs. Each directory is
+# scanned once, in one pass, into an in-memory manifest keyed by neighborhood
+# slug, Land_Parcel_ID or tract ID, so checking whether an image exists
+# doesn't touch the disk. Directories are rescanned when they change, at most
+# every so often. Run on its own, this lists every parcel whose thread would
+# reference a missing image, so that they can be made before launch.
+#
+# usage: ./assets.py [-i PARCELS] [-o missing_assets.csv] [--no-cache]
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+import pandas
+
+# Return the key an image is indexed under: its file name without the
+# extension, as an integer if it is one (a Land_Parcel_ID or tract ID)
+def asset_key(file_name):
+    stem = os.path.splitext(file_name)[0]
+    try:
+        return int(stem)
+    except ValueError:
+        return stem
+
+class AssetManifest(object):
+
+    # directories: kind of image -> directory holding those images
+    # rescan_seconds: minimum seconds between checks for changed directories,
+    #   or None to never rescan
+    def __init__(self, directories, rescan_seconds = None, clock = time.time):
+        self.directories = directories
+        self.rescan_seconds = rescan_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        # kind -> {key: path}
+        self.assets = {}
+        # normalised paths of every image
+        self.paths = set()
+        # kind -> directory mtime when it was last scanned
+        self.scanned_mtimes = {}
+        self.checked = None
+
+    def scan_directory(self, kind):
+        directory = self.directories[kind]
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            entries = [
+                entry for entry in os.scandir(directory)
+                if (entry.is_file())
+            ]
+        except FileNotFoundError:
+            (mtime, entries) = (None, [])
+
+        for path in self.assets.get(kind, {}).values():
+            self.paths.discard(os.path.normpath(path))
+        self.assets[kind] = {
+            asset_key(entry.name): os.path.join(directory, entry.name)
+            for entry in entries
+        }
+        self.paths.update(os.path.normpath(path) for path in self.assets[kind].values())
+        self.scanned_mtimes[kind] = mtime
+
+    # Scan every directory
+    def scan(self):
+        with self.lock:
+            for kind in self.directories:
+                self.scan_directory(kind)
+            self.checked = self.clock()
+        return self
+
+    # Rescan the directories that changed since they were last scanned,
+    # returning the kinds of images that were rescanned
+    def rescan(self):
+        rescanned = []
+        with self.lock:
+            for kind in self.directories:
+                try:
+                    mtime = os.stat(self.directories[kind]).st_mtime_ns
+                except FileNotFoundError:
+                    mtime = None
+                if ((kind not in self.scanned_mtimes) or (self.scanned_mtimes[kind] != mtime)):
+                    self.scan_directory(kind)
+                    rescanned.append(kind)
+            self.checked = self.clock()
+        return rescanned
+
+    # Scan on first use, and rescan if it has been rescan_seconds since the
+    # directories were last checked
+    def refresh(self):
+        if (self.checked is None):
+            self.scan()
+        elif ((self.rescan_seconds is not None) and (self.clock() - self.checked >= self.rescan_seconds)):
+            self.rescan()
+
+    # Return the path of the image of a kind with a key, or None if there is
+    # no such image
+    def lookup(self, kind, key):
+        self.refresh()
+        return self.assets[kind].get(key)
+
+    # Return the keys of every image of a kind
+    def keys(self, kind):
+        self.refresh()
+        return set(self.assets[kind])
+
+    # Return True if there is an image at path. Paths outside of the indexed
+    # directories are checked on disk.
+    def exists(self, path):
+        self.refresh()
+        path = os.path.normpath(path)
+        if (path in self.paths):
+            return True
+        directory = os.path.dirname(path)
+        for indexed in self.directories.values():
+            if (os.path.normpath(indexed) == directory):
+                return False
+        return os.path.isfile(path)
+
+# Return a DataFrame with a row for every parcel whose thread would reference
+# a missing image, with the row's index and Land_Parcel_ID and a column per
+# kind of image that is True where that image is missing. Only parcels that
+# would be tweeted are checked.
+def validate(parcels, manifest):
+    import bot
+
+    parcels = parcels[parcels["ST_NUM"].notnull()]
+    slugs = parcels["neighborhood"].astype(str).map(bot.neighborhood_slug)
+    tract_ids = pandas.to_numeric(parcels["CT_ID_10"], errors = "coerce")
+    missing = pandas.DataFrame({
+        "Land_Parcel_ID": parcels["Land_Parcel_ID"],
+        "neighborhood_map": ~slugs.isin(manifest.keys("neighborhood_map")),
+    }, index = parcels.index)
+    for kind in ("tract_rent_map", "tract_eth_het_map", "tract_age_graph"):
+        missing[kind] = ~tract_ids.isin(manifest.keys(kind))
+    problems = missing.drop(columns = ["Land_Parcel_ID"]).any(axis = 1)
+    return missing[problems]
+
+if (__name__ == "__main__"):
+    import bot
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--parcels", default = bot.INPUT_PARCELS)
+    parser.add_argument("-o", "--output", default = None,
+                        help = "CSV file to write the parcels with missing images to (default: standard output)")
+    parser.add_argument("--no-cache", dest = "no_cache", action = "store_true", default = False)
+    args = parser.parse_args()
+
+    if (args.no_cache):
+        parcels = bot.read_parcels_for_cache(args.parcels)
+    else:
+        (parcels, _) = bot.load_cached_parcels(args.parcels, bot.CACHE_DIR)
+
+    missing = validate(parcels, bot.ASSETS.scan())
+    missing.to_csv(args.output if (args.output is not None) else sys.stdout, index_label = "index")
+    for kind in missing.columns.drop("Land_Parcel_ID"):
+        print("%s: %d parcels missing" % (kind, missing[kind].sum()), file = sys.stderr)
+    # parcel composites are optional, so they are only counted
+    composites = bot.ASSETS.keys("parcel_composite")
+    print("parcel composites: %d of %d parcels have one" % (
+        parcels["Land_Parcel_ID"].isin(composites).sum(), len(parcels)
+    ), file = sys.stderr)
+    raise SystemExit(1 if (len(missing) > 0) else 0)
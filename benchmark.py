@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# Micro-benchmarks for the tweet generators and their helpers, run against a
+# seeded synthetic dataset (see synthetic.py) with stand-ins for Google Street
+# View and Twitter, so no real data or API keys are needed. For each function
+# this reports the number of parcels handled per second, the peak memory
+# allocated per parcel and the memory still held afterwards, so regressions in
+# the hot path show up before a data release.
+#
+# usage: ./benchmark.py [-n PARCELS] [--seed SEED] [--repeat REPEAT] [-k FILTER]
+
+import argparse
+import contextlib
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+import bot
+import image_cache
+import synthetic
+
+# Time func over every item, repeat times, returning the best number of
+# seconds per call
+def time_per_call(func, items, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = (time.perf_counter() - started) / len(items)
+        best = elapsed if (best is None) else min(best, elapsed)
+    return best
+
+# Run func over every item once with tracemalloc running, returning the total
+# peak memory allocated during the calls (above what was allocated before each
+# call) and the total memory still allocated after all of the calls
+def allocations(func, items):
+    gc.collect()
+    tracemalloc.start()
+    (started_bytes, _) = tracemalloc.get_traced_memory()
+    peak_bytes = 0
+    for item in items:
+        (before, _) = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func(item)
+        (_, peak) = tracemalloc.get_traced_memory()
+        peak_bytes += peak - before
+    (retained_bytes, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (peak_bytes, retained_bytes - started_bytes)
+
+# Return a list of (name, function, items, rows) benchmarks for a set of
+# parcel records, where each function is called with each item in turn and
+# rows is the number of parcels the items cover, which the results are
+# reported per
+def benchmarks(records, frame, twitter):
+    rows = [row for (_, row) in records]
+    tweetable = [row for row in rows if (not bot.skip_row(row))]
+    chunks = [frame.iloc[start:start + 1000] for start in range(0, len(frame), 1000)]
+    prepared = [bot.prepare_thread(row, "stub") for row in tweetable[:200]]
+
+    # post a prepared thread the way the main loop's tweet() does
+    def post_thread(thread):
+        media_ids = [twitter.media_upload(path).media_id for path in thread["main"]["images"]]
+        status = twitter.update_status("%s (1/2)" % thread["main"]["message"], media_ids = media_ids)
+        twitter.update_status(
+            "@bariexplorer %s (2/2)" % thread["reply"]["message"],
+            in_reply_to_status_id = status.id
+        )
+
+    per_row = [
+        ("skip_row", bot.skip_row, rows),
+        ("capitalize_all_words", bot.capitalize_all_words, [row["ST_NAME"] for row in tweetable]),
+        ("neighbourhood_to_hashtag", bot.neighbourhood_to_hashtag, [row["neighborhood"] for row in rows]),
+        ("render_parcel_tweet", bot.render_parcel_tweet, tweetable),
+        ("generate_parcel_tweet", lambda row: bot.generate_parcel_tweet(row, "stub"), tweetable),
+        ("generate_neighborhood_tweet", bot.generate_neighborhood_tweet, tweetable),
+        ("generate_tract_housing_characteristics_tweet", bot.generate_tract_housing_characteristics_tweet, tweetable),
+        ("generate_tract_ethnic_heterogeneity_tweet", bot.generate_tract_ethnic_heterogeneity_tweet, tweetable),
+        ("generate_tract_education_age_tweet", bot.generate_tract_education_age_tweet, tweetable),
+        ("prepare_thread", lambda row: bot.prepare_thread(row, "stub"), tweetable),
+        ("post_thread (stub Twitter)", post_thread, prepared),
+    ]
+    return [
+        (name, func, items, len(items)) for (name, func, items) in per_row
+    ] + [
+        ("render_parcel_tweets (batches of 1000)", bot.render_parcel_tweets, chunks, len(frame)),
+        ("PhraseTable.build", lambda df: bot.PhraseTable().build(df), [frame], len(frame)),
+        ("refresh_transit_columns", bot.DATA.refresh_transit_columns, [frame], len(frame)),
+    ]
+
+def run(n_parcels = 20000, seed = 0, repeat = 3, name_filter = None):
+    with tempfile.TemporaryDirectory(prefix = "bariexplorer_bench_") as directory:
+        paths = synthetic.write(directory, n_parcels = n_parcels, seed = seed)
+        bot.DATA = synthetic.data_context(paths).preload()
+        bot.STREETVIEW_CACHE = image_cache.StreetViewCache(
+            os.path.join(directory, "streetview"), 1024 ** 3,
+            synthetic.StubStreetViewBackend()
+        )
+        twitter = synthetic.StubTwitterAPI()
+
+        # generate_parcel_tweet writes to DEFAULT_IMAGE_PATH, relative to the
+        # working directory
+        previous_dir = os.getcwd()
+        os.chdir(directory)
+        try:
+            (frame, _) = bot.load_cached_parcels(
+                paths["parcels"], os.path.join(directory, "cache")
+            )
+            records = list(bot.parcel_records(frame))
+
+            results = []
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                for (name, func, items, n_rows) in benchmarks(records, frame, twitter):
+                    if ((name_filter is not None) and (name_filter not in name)):
+                        continue
+                    seconds = time_per_call(func, items, repeat) * len(items) / n_rows
+                    (peak_bytes, retained_bytes) = allocations(func, items)
+                    results.append((
+                        name, 1 / seconds, peak_bytes / n_rows, retained_bytes / n_rows
+                    ))
+        finally:
+            os.chdir(previous_dir)
+
+    print("%-46s %14s %16s %16s" % (
+        "function", "rows/second", "peak bytes/row", "kept bytes/row"
+    ))
+    for (name, throughput, peak_bytes, retained_bytes) in results:
+        print("%-46s %14.0f %16.1f %16.1f" % (name, throughput, peak_bytes, retained_bytes))
+    return results
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--parcels", type = int, default = 20000)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("-k", dest = "name_filter", default = None,
+                        help = "only run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    run(args.parcels, args.seed, args.repeat, args.name_filter)
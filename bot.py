@@ -1,43 +1,117 @@
 #!/usr/bin/env python3
 
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import collections
-import google_streetview.api
+import io
 import locale
 import os
 import random
+import shutil
+import threading
+import traceback
+import numpy
 import pandas
-import time
 
-try:
-    locale.setlocale(locale.LC_ALL, "en_US")
-except:
-    locale.setlocale(locale.LC_ALL, "en_US.utf8")
+import assets
+import columnar_cache
+import image_cache
+import journal
+import percentiles
+import transit
+
+# Set the locale used to format numbers in tweets. This is done on first use
+# rather than on import, so that importing the bot has no side effects.
+_LOCALE_SET = False
+def set_locale():
+    global _LOCALE_SET
+    if (not _LOCALE_SET):
+        try:
+            locale.setlocale(locale.LC_ALL, "en_US")
+        except:
+            locale.setlocale(locale.LC_ALL, "en_US.utf8")
+        _LOCALE_SET = True
 
 # Time to wait between crash and reboot of the bot
 REBOOT_TIME = 60
 
-# Tweepy API config
-TWEEPY_RETRY_CONFIG = {
-    "retry_count": 5,
-    "retry_delay": 5,
-    "retry_errors": set([
-        503, # over capacity
-    ])
+# Calls allowed to each rate-limited Twitter endpoint, as (calls, seconds);
+# posting waits for quota rather than being rejected. Calls rejected with a 429
+# or 503 anyway are retried up to POSTING_MAX_RETRIES times, backing off
+# exponentially from POSTING_BACKOFF[0] seconds up to POSTING_BACKOFF[1]. This
+# is the only retry of Twitter calls: tweepy itself is left not to retry, so
+# that every attempt is counted against the rate limits.
+TWITTER_RATE_LIMITS = {
+    "update_status": (300, 3 * 60 * 60), # 300 tweets every 3 hours
 }
+POSTING_MAX_RETRIES = 5
+POSTING_BACKOFF = (5, 15 * 60)
+
+# Times to try posting a parcel's thread before moving on to the next parcel
+THREAD_ATTEMPTS = 3
 
 # Directory to save Google Street View images and metadata files to
 IMAGES_DIR = "."
 DEFAULT_IMAGE_PATH = "%s/gsv_0.jpg" % IMAGES_DIR
 
+# Cache of Google Street View images (see image_cache.py), capped at
+# STREETVIEW_CACHE_BYTES, and the size of the images to request. Every bot on
+# a host, including each of several --shards workers, can share the directory.
+STREETVIEW_CACHE_DIR = "./streetview_cache/"
+STREETVIEW_CACHE_BYTES = 1024 * 1024 * 1024 # 1 GB
+STREETVIEW_IMAGE_SIZE = "1200x675"
+
 # The CSV file to retrieve data from
 INPUT_PARCELS = "./parcels_shuffled_2020_03_02.csv"
 INPUT_NEIGHBORHOODS = "./neighborhoods.csv"
 INPUT_TRACTS = "./tracts.csv"
 INPUT_BLOCKGROUPS = "./blockgroups.csv"
 
-TRACT_ATTRIBUTES = pandas.read_csv(INPUT_TRACTS)
-NEIGHBORHOOD_ATTRIBUTES = pandas.read_csv(INPUT_NEIGHBORHOODS)
-BLOCKGROUP_ATTRIBUTES = pandas.read_csv(INPUT_BLOCKGROUPS)
+# Bus and subway stops (see transit.py). If this file exists, each parcel's
+# nearest stop, the median walking distance to a stop in each block group and
+# the number of lines serving each neighbourhood are recomputed from it at
+# load time, instead of being taken from the files above.
+INPUT_STOPS = "./stops.csv"
+
+# Directory to store the binary cache of the CSV files in (see
+# columnar_cache.py); None to always parse the CSV files
+CACHE_DIR = "./cache/"
+
+# Column of the cached parcels holding the byte offset of the following row
+NEXT_OFFSET_COLUMN = "_next_offset"
+
+# Data types to load the parcels CSV file with, instead of letting pandas infer
+# them. Text columns, which repeat a few dozen or a few thousand distinct values
+# across every parcel, are categoricals; ST_NUM is text because it holds
+# ranges such as "12-14". Integer columns with missing values use nullable
+# integer types, since pandas would otherwise widen them to float64, and years
+# fit in 16 bits. Columns not listed here are inferred as before.
+PARCEL_SCHEMA = {
+    "Land_Parcel_ID": "int64",
+    "ST_NUM": "category",
+    "ST_NAME": "category",
+    "ST_NAME_SUF": "category",
+    "LU": "category",
+    "R_BLDG_STYL": "category",
+    "YR_BUILT": "UInt16",
+    "neighborhood": "category",
+    "section": "category",
+    "AV_TOTAL": "int64",
+    "ISSUED_DATE": "UInt16",
+    "permittypedescr": "category",
+    "CT_ID_10": "Int64",
+    "BG_ID_10": "Int64",
+    "STOP_TYPE": "category",
+    "STOP_NAME": "category",
+}
+
+# Attribute files are indexed by these columns; every parcel row carries the
+# same columns, which are used to look up its tract, block group and
+# neighbourhood
+TRACT_KEY = "CT_ID_10"
+BLOCKGROUP_KEY = "BG_ID_10"
+NEIGHBORHOOD_KEY = "Name"
 
 # Pregenerated images
 NEIGHBORHOOD_IMAGES = "./neighborhood_maps/"
@@ -46,12 +120,67 @@ TRACT_AGE_GRAPHS = "./tract_age_graphs/"
 TRACT_ETH_HET_MAPS = "./tract_eth_het_maps/"
 TRACT_RENT_MAPS = "./tract_rent_maps/"
 
+# Seconds between checks for changes to the pregenerated image directories
+ASSET_RESCAN_SECONDS = 10 * 60 # 10 minutes
+
 # The JSON file where credentials are stored
 CREDENTIALS_FILE = "credentials.json"
 
-# File to persist the bot's current place in the input CSV file
+# File to persist the bot's current place in the input CSV file: the index of
+# the last row processed and the byte offset of the row after it
 STATUS_FILE = "last_idx.txt"
 
+# Append-only journal of each stage of posting each thread (see journal.py),
+# which the bot's place in the input CSV file is taken from in preference to
+# STATUS_FILE, compacted every JOURNAL_COMPACT_EVERY records
+JOURNAL_FILE = "posting_journal.jsonl"
+JOURNAL_COMPACT_EVERY = 1000
+
+# With --shards, several bots share out the parcels in shards of SHARD_ROWS
+# rows, each leased for SHARD_LEASE_SECONDS at a time (see shards.py). A bot
+# with no shard left to lease checks every SHARD_POLL_SECONDS for one whose
+# lease has expired.
+SHARD_ROWS = 1000
+SHARD_LEASE_SECONDS = 10 * 60 # 10 minutes
+SHARD_POLL_SECONDS = 5 * 60 # 5 minutes
+
+# Number of parcel rows to parse at a time when streaming the input CSV file
+PARCEL_CHUNK_SIZE = 1000
+
+# Media IDs returned by Twitter's upload endpoint expire after 24 hours; the
+# ID of each uploaded image is reused for images with the same contents for a
+# little less than that. MEDIA_UPLOAD_WORKERS images are uploaded at once.
+MEDIA_ID_TTL = 23 * 60 * 60 # 23 hours
+MEDIA_UPLOAD_WORKERS = 4
+
+# Per-stage timings of each posting cycle are appended to METRICS_LOG as JSON
+# lines, and the running totals are written to METRICS_PROM in the Prometheus
+# text format, for node_exporter's textfile collector to pick up. With
+# --shards, each bot writes to its own files, named after it (see --worker),
+# and labels its series with worker="<name>" so that the collector can tell
+# them apart. The Prometheus file is removed when the bot stops.
+METRICS_LOG = "./metrics.jsonl"
+METRICS_PROM = "./bariexplorer.prom"
+
+# Seconds after which a stage of a posting cycle counts as slow; slow stages
+# are pointed out in the Slack crash report
+SLOW_STAGE_SECONDS = {
+    "read_parcel": 5,
+    "render_parcel_tweet": 1,
+    "pull_picture": 10,
+    "reply_generator": 1,
+    "media_upload": 30,
+    "update_status": 10,
+}
+
+# Crash reports are sent to Slack in the background (see crash_reports.py).
+# Repeats of a crash with the same stack trace within CRASH_QUIET_SECONDS, and
+# crashes beyond CRASH_UPLOADS_PER_HOUR, are grouped into a digest sent
+# CRASH_DIGEST_SECONDS after the first of them.
+CRASH_DIGEST_SECONDS = 60 * 60 # 1 hour
+CRASH_QUIET_SECONDS = 24 * 60 * 60 # 1 day
+CRASH_UPLOADS_PER_HOUR = 6
+
 # Miscellaneous constants
 VOWELS = "AEIOUaeiou"
 DIGITS = "1234567890"
@@ -163,12 +292,582 @@ NEIGHBOURHOOD_PREPEND_THE = {
     "Leather District"
 }
 
+# Normalize a key value so that the same tract or block group ID compares equal
+# whether it was parsed as an int (attribute files) or as a float (parcel file,
+# where missing values force the column to float). Returns None for missing
+# keys.
+def normalize_key(value):
+    if (pandas.isnull(value)):
+        return None
+    if (isinstance(value, float) and value.is_integer()):
+        return int(value)
+    if (hasattr(value, "item")): # numpy scalar
+        return normalize_key(value.item())
+    return value
+
+# Hash index over one of the attribute files, built once, so that each reply
+# is a dict lookup instead of a boolean mask over the whole DataFrame. Each row
+# is stored as a namedtuple whose fields are the columns of the file.
+class AttributeStore(object):
+
+    def __init__(self, df, key_column, name = None):
+        self.key_column = key_column
+        self.name = name if (name is not None) else key_column
+        self.record_type = collections.namedtuple(
+            "AttributeRecord", df.columns, rename = True
+        )
+        self.records = {}
+        self.duplicate_keys = set()
+        self.n_null_keys = 0
+
+        key_position = list(df.columns).index(key_column)
+        for values in df.itertuples(index = False, name = None):
+            key = normalize_key(values[key_position])
+            if (key is None):
+                self.n_null_keys += 1
+            elif (key in self.records):
+                # keep the first record, like the .iloc[0] lookups did
+                self.duplicate_keys.add(key)
+            else:
+                self.records[key] = self.record_type._make(values)
+
+        for problem in self.problems():
+            print("%s: %s" % (self.name, problem))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        return normalize_key(key) in self.records
+
+    def __getitem__(self, key):
+        try:
+            return self.records[normalize_key(key)]
+        except KeyError:
+            raise KeyError("%s has no record with %s = %r" % (
+                self.name, self.key_column, key
+            )) from None
+
+    def get(self, key, default = None):
+        return self.records.get(normalize_key(key), default)
+
+    # Return the keys out of the given iterable that have no record
+    def missing(self, keys):
+        return sorted(
+            set(normalize_key(key) for key in keys) - set(self.records) - {None},
+            key = str
+        )
+
+    # Return a list of human-readable descriptions of problems with the keys,
+    # optionally checking that each of expected_keys has a record
+    def problems(self, expected_keys = None):
+        problems = []
+        if (self.n_null_keys > 0):
+            problems.append("%d rows with no %s" % (self.n_null_keys, self.key_column))
+        if (len(self.duplicate_keys) > 0):
+            problems.append("duplicate %s (first row kept): %s" % (
+                self.key_column,
+                ", ".join(str(key) for key in sorted(self.duplicate_keys, key = str))
+            ))
+        if (expected_keys is not None):
+            missing = self.missing(expected_keys)
+            if (len(missing) > 0):
+                problems.append("missing %s: %s" % (
+                    self.key_column, ", ".join(str(key) for key in missing)
+                ))
+        return problems
+
+# The attribute files, loaded the first time each one is accessed rather than
+# on import, through the binary cache in cache_dir if it is set. Each dataset
+# is available both as a DataFrame (e.g. tract_attributes) and as an
+# AttributeStore (e.g. tract_store); load_times holds the number of seconds it
+# took to load each dataset. If there is a stops file, the transit columns of
+# the datasets are recomputed from it as they are loaded. Citywide percentile
+# ranks of any column of a dataset are available through percentile (see
+# percentiles.py).
+class DataContext(object):
+
+    # dataset name -> (path attribute, key column)
+    DATASETS = {
+        "tract": ("tracts_path", TRACT_KEY),
+        "neighborhood": ("neighborhoods_path", NEIGHBORHOOD_KEY),
+        "blockgroup": ("blockgroups_path", BLOCKGROUP_KEY),
+    }
+
+    # dataset name -> the transit.TransitIndex method recomputing its transit
+    # columns from the parcels
+    TRANSIT_DATASETS = {
+        "neighborhood": "neighborhood_lines",
+        "blockgroup": "blockgroup_medians",
+    }
+
+    # Columns of the parcels needed to recompute the transit columns
+    LOCATION_COLUMNS = ["x", "y", BLOCKGROUP_KEY, "neighborhood"]
+
+    def __init__(self, tracts_path = INPUT_TRACTS,
+                 neighborhoods_path = INPUT_NEIGHBORHOODS,
+                 blockgroups_path = INPUT_BLOCKGROUPS, cache_dir = CACHE_DIR,
+                 parcels_path = INPUT_PARCELS, stops_path = INPUT_STOPS):
+        self.tracts_path = tracts_path
+        self.neighborhoods_path = neighborhoods_path
+        self.blockgroups_path = blockgroups_path
+        self.cache_dir = cache_dir
+        self.parcels_path = parcels_path
+        self.stops_path = stops_path
+        self.frames = {}
+        self.stores = {}
+        self.load_times = collections.OrderedDict()
+        # dataset name -> the signatures of the files it was loaded from
+        self.versions = {}
+        self.transit_index = None
+        self.transit_loaded = False
+        self.parcel_locations = None
+
+    def frame(self, name):
+        if (name not in self.frames):
+            started = time.perf_counter()
+            path = getattr(self, self.DATASETS[name][0])
+            self.versions[name] = self.file_signatures(name)
+            if (self.cache_dir is None):
+                frame = pandas.read_csv(path)
+            else:
+                frame = columnar_cache.load(path, self.cache_dir)
+            if ((name in self.TRANSIT_DATASETS) and (self.transit() is not None)):
+                frame = self.refresh_transit_attributes(name, frame)
+            self.frames[name] = frame
+            self.load_times[name] = time.perf_counter() - started
+        return self.frames[name]
+
+    # Return the (path, size, modification time) of each file that a dataset
+    # is loaded from
+    def file_signatures(self, name):
+        paths = [getattr(self, self.DATASETS[name][0])]
+        if ((name in self.TRANSIT_DATASETS) and (self.stops_path is not None)
+                and (os.path.isfile(self.stops_path))):
+            paths += [self.stops_path, self.parcels_path]
+        signatures = []
+        for path in paths:
+            stat = os.stat(path)
+            signatures.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+        return tuple(signatures)
+
+    # Return the percentiles.PercentileTable for a dataset, shared with any
+    # other DataContext that loaded the same version of it
+    def percentiles(self, name):
+        frame = self.frame(name)
+        key_column = self.DATASETS[name][1]
+        return percentiles.table(name, self.versions[name], lambda: percentiles.PercentileTable(
+            frame, [normalize_key(key) for key in frame[key_column]]
+        ))
+
+    # Return the citywide percentile rank, from 0 to 1, of a column's value in
+    # the record of a dataset with a key
+    def percentile(self, name, column, key):
+        return self.percentiles(name).rank(column, normalize_key(key))
+
+    # Return the transit.TransitIndex over the stops file, or None if there
+    # is no stops file
+    def transit(self):
+        if (not self.transit_loaded):
+            self.transit_loaded = True
+            if ((self.stops_path is not None) and (os.path.isfile(self.stops_path))):
+                started = time.perf_counter()
+                self.transit_index = transit.TransitIndex(transit.read_stops(self.stops_path))
+                self.load_times["stops"] = time.perf_counter() - started
+        return self.transit_index
+
+    # Return a copy of a dataset with its transit columns recomputed from the
+    # locations of every parcel, which are taken from the binary cache of the
+    # parcels if cache_dir is set
+    def refresh_transit_attributes(self, name, frame):
+        if (self.parcel_locations is None):
+            if (self.cache_dir is not None):
+                (parcels, _) = load_cached_parcels(self.parcels_path, self.cache_dir)
+                self.parcel_locations = parcels[self.LOCATION_COLUMNS]
+            else:
+                self.parcel_locations = pandas.read_csv(
+                    self.parcels_path, usecols = self.LOCATION_COLUMNS,
+                    dtype = {column: PARCEL_SCHEMA[column] for column in self.LOCATION_COLUMNS
+                             if (column in PARCEL_SCHEMA)}
+                )
+        recomputed = getattr(self.transit(), self.TRANSIT_DATASETS[name])(self.parcel_locations)
+        if (recomputed is None):
+            return frame
+        return transit.update_attributes(frame, recomputed, self.DATASETS[name][1])
+
+    # Return parcels with their nearest stop columns recomputed, or as they
+    # are if there is no stops file
+    def refresh_transit_columns(self, parcels):
+        if (self.transit() is None):
+            return parcels
+        return self.transit().refresh_parcels(parcels)
+
+    # True if a parcel's nearest stop columns were recomputed from the stops
+    # file, which is only done for parcels with a location
+    def transit_recomputed(self, row):
+        return ((self.transit() is not None)
+                and (not pandas.isnull(row["x"])) and (not pandas.isnull(row["y"])))
+
+    def store(self, name):
+        if (name not in self.stores):
+            (path_attribute, key_column) = self.DATASETS[name]
+            self.stores[name] = AttributeStore(
+                self.frame(name), key_column, getattr(self, path_attribute)
+            )
+        return self.stores[name]
+
+    # Load every dataset now instead of on first access
+    def preload(self):
+        for name in self.DATASETS:
+            self.store(name)
+        return self
+
+    @property
+    def tract_attributes(self):
+        return self.frame("tract")
+
+    @property
+    def neighborhood_attributes(self):
+        return self.frame("neighborhood")
+
+    @property
+    def blockgroup_attributes(self):
+        return self.frame("blockgroup")
+
+    @property
+    def tract_store(self):
+        return self.store("tract")
+
+    @property
+    def neighborhood_store(self):
+        return self.store("neighborhood")
+
+    @property
+    def blockgroup_store(self):
+        return self.store("blockgroup")
+
+DATA = DataContext()
+
+# The module-level names that the attribute files used to be loaded into are
+# still available as bot.TRACT_ATTRIBUTES etc., but are resolved through DATA
+_LAZY_GLOBALS = {
+    "TRACT_ATTRIBUTES": "tract_attributes",
+    "NEIGHBORHOOD_ATTRIBUTES": "neighborhood_attributes",
+    "BLOCKGROUP_ATTRIBUTES": "blockgroup_attributes",
+    "TRACT_STORE": "tract_store",
+    "NEIGHBORHOOD_STORE": "neighborhood_store",
+    "BLOCKGROUP_STORE": "blockgroup_store",
+}
+
+def __getattr__(name):
+    if (name in _LAZY_GLOBALS):
+        return getattr(DATA, _LAZY_GLOBALS[name])
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+# Check that every tract, block group and neighbourhood referenced by the
+# parcels has a record; returns a list of problems, empty if there are none
+def check_attribute_keys(parcels):
+    problems = []
+    for (store, column) in [
+        (DATA.tract_store, TRACT_KEY),
+        (DATA.blockgroup_store, BLOCKGROUP_KEY),
+        (DATA.neighborhood_store, "neighborhood"),
+    ]:
+        missing = store.missing(parcels[column])
+        if (len(missing) > 0):
+            problems.append("%s: missing %s: %s" % (
+                store.name, store.key_column, ", ".join(str(key) for key in missing)
+            ))
+    return problems
+
+# Columns of the parcels CSV file that the tweet generators use
+PARCEL_FIELDS = (
+    "Land_Parcel_ID",
+    "ST_NUM",
+    "ST_NAME",
+    "ST_NAME_SUF",
+    "LU",
+    "R_BLDG_STYL",
+    "YR_BUILT",
+    "neighborhood",
+    "section",
+    "AV_TOTAL",
+    "ISSUED_DATE",
+    "permittypedescr",
+    "x",
+    "y",
+    "CT_ID_10",
+    "BG_ID_10",
+    "STOP_TYPE",
+    "STOP_NAME",
+    "NEAREST_TRANSIT_SECONDS",
+)
+
+# One row of the parcels CSV file, holding only the columns in PARCEL_FIELDS.
+# This is a plain tuple underneath, so it is much cheaper to build than the
+# pandas Series that iterrows() produces and each value keeps its own type
+# instead of being coerced to a common dtype. Values can be read as attributes
+# (record.ST_NUM) or by column name like a Series (record["ST_NUM"]), so the
+# tweet generators accept either.
+class ParcelRecord(collections.namedtuple("ParcelRecord", PARCEL_FIELDS)):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if (isinstance(key, str)):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    # Return an iterator of ParcelRecords for the rows of a DataFrame
+    @classmethod
+    def from_frame(cls, df):
+        return map(cls._make, df.loc[:, list(PARCEL_FIELDS)].itertuples(
+            index = False, name = None
+        ))
+
+    # Return an iterator of ParcelRecords from a dict mapping each of
+    # PARCEL_FIELDS to a sequence of values, e.g. NumPy arrays
+    @classmethod
+    def from_columns(cls, columns):
+        return map(cls._make, zip(*[columns[field] for field in PARCEL_FIELDS]))
+
+# Return an iterator of (index, ParcelRecord) tuples for the rows of a
+# DataFrame, to use in place of df.iterrows()
+def parcel_records(df):
+    return zip(df.index, ParcelRecord.from_frame(df))
+
+# Read one record from a CSV file opened in binary mode. A record usually is a
+# single line, but continues onto the next line while a quoted field is open.
+# Returns b"" at the end of the file.
+def read_csv_record(f):
+    record = f.readline()
+    while (record.count(b'"') % 2 == 1):
+        line = f.readline()
+        if (not line):
+            break
+        record += line
+    return record
+
+# Stream the parcels CSV file in chunks of at most chunk_size rows, starting at
+# the given byte offset (or the first row after the header) and numbering the
+# rows from start_index. Yields (chunk, offsets) pairs, where chunk is a
+# DataFrame indexed by row number and offsets[i] is the byte offset of the row
+# following chunk row i, so that at most one chunk is in memory at a time.
+def stream_parcel_chunks(path = INPUT_PARCELS, offset = None, start_index = 0,
+                         chunk_size = PARCEL_CHUNK_SIZE):
+    with open(path, "rb") as f:
+        header = read_csv_record(f)
+        if (offset is not None):
+            f.seek(offset)
+
+        index = start_index
+        while True:
+            records = []
+            offsets = []
+            while (len(records) < chunk_size):
+                record = read_csv_record(f)
+                if (not record):
+                    break
+                if (record.strip()): # blank lines are not rows
+                    records.append(record)
+                    offsets.append(f.tell())
+            if (len(records) == 0):
+                break
+
+            chunk = pandas.read_csv(
+                io.BytesIO(header + b"".join(records)), dtype = PARCEL_SCHEMA
+            )
+            chunk.index = range(index, index + len(chunk))
+            index += len(chunk)
+            yield (chunk, offsets)
+
+# Stream the parcels CSV file one row at a time, yielding (index,
+# next_offset, row) tuples, where row is a ParcelRecord and next_offset is the
+# byte offset to resume at after this row
+def stream_parcels(*args, **kwargs):
+    for (chunk, offsets) in stream_parcel_chunks(*args, **kwargs):
+        for ((index, row), next_offset) in zip(parcel_records(chunk), offsets):
+            yield (index, next_offset, row)
+
+# Load the bot's position from the status file, returning a tuple of the index
+# of the last row processed and the byte offset of the row after it. The offset
+# is None for status files written before offsets were recorded, and both are
+# None if there is no status file.
+def load_status(path = STATUS_FILE):
+    if ((path is None) or (not os.path.isfile(path))):
+        return (None, None)
+    with open(path, "r") as f:
+        fields = f.read().split()
+    if (len(fields) == 1):
+        return (int(fields[0]), None)
+    return (int(fields[0]), int(fields[1]))
+
+def save_status(index, next_offset, path = STATUS_FILE):
+    with open(path, "w") as f:
+        f.write("%d %d" % (index, next_offset))
+
+# Return the (index, next_offset) of the last row the bot posted, from the
+# journal if it has any records and otherwise from the status file
+def load_position(status_path = STATUS_FILE, journal_path = None):
+    if (journal_path is not None):
+        (last_index, next_offset) = journal.position(journal_path)
+        if (last_index is not None):
+            return (last_index, next_offset)
+    return load_status(status_path)
+
+# Return an array holding, for each row of the parcels CSV file, the byte
+# offset of the row following it
+def parcel_offsets(path = INPUT_PARCELS):
+    offsets = []
+    with open(path, "rb") as f:
+        read_csv_record(f) # header
+        while True:
+            record = read_csv_record(f)
+            if (not record):
+                break
+            if (record.strip()):
+                offsets.append(f.tell())
+    return numpy.array(offsets, dtype = numpy.int64)
+
+# Parse the whole parcels CSV file for the binary cache, along with the byte
+# offset of each following row so that the status file stays interchangeable
+# between cached and streamed runs
+def read_parcels_for_cache(path):
+    df = pandas.read_csv(path, dtype = PARCEL_SCHEMA)
+    df[NEXT_OFFSET_COLUMN] = parcel_offsets(path)
+    return df
+
+# Load every parcel through the binary cache, returning a tuple of the
+# memory-mapped DataFrame and the array of next-row byte offsets
+def load_cached_parcels(path = INPUT_PARCELS, cache_dir = CACHE_DIR):
+    df = columnar_cache.load(
+        path, cache_dir, build = read_parcels_for_cache,
+        build_key = sorted(PARCEL_SCHEMA.items())
+    )
+    offsets = df[NEXT_OFFSET_COLUMN].to_numpy()
+    return (df.drop(columns = [NEXT_OFFSET_COLUMN]), offsets)
+
+# Return the number of rows in the parcels CSV file
+def count_parcels(path = INPUT_PARCELS, cache_dir = None):
+    if (cache_dir is not None):
+        return len(load_cached_parcels(path, cache_dir)[1])
+    return len(parcel_offsets(path))
+
+# Compare the memory used by the parcels when loaded with PARCEL_SCHEMA to
+# the memory used when pandas infers the types of every column. Returns a
+# DataFrame with one row per column plus a total, holding the dtype and the
+# number of bytes used under each.
+def parcel_memory_report(path = INPUT_PARCELS):
+    inferred = pandas.read_csv(path)
+    typed = pandas.read_csv(path, dtype = PARCEL_SCHEMA)
+    report = pandas.DataFrame({
+        "inferred_dtype": inferred.dtypes.astype(str),
+        "inferred_bytes": inferred.memory_usage(index = False, deep = True),
+        "schema_dtype": typed.dtypes.astype(str),
+        "schema_bytes": typed.memory_usage(index = False, deep = True),
+    })
+    report.loc["total"] = [
+        "", report["inferred_bytes"].sum(), "", report["schema_bytes"].sum()
+    ]
+    report["ratio"] = (report["schema_bytes"] / report["inferred_bytes"]).round(3)
+    return report
+
+# Return the index of the row to resume at, given the contents of the status
+# file. Old status files only hold a row index, for which the previous
+# behaviour of resuming two rows after the saved index is kept.
+def resume_index(last_index, next_offset):
+    if (last_index is None):
+        return 0
+    elif (next_offset is not None):
+        return last_index + 1
+    else:
+        return last_index + 2
+
+# Yield (chunk, offsets) pairs in the same way as stream_parcel_chunks for the
+# rows from start up to stop, or the end of the file if stop is None. With a
+# cache_dir, chunks are slices of the memory-mapped parcels from the binary
+# cache. Otherwise the CSV file is streamed from offset, the byte offset of
+# row start, or if offset is None from the first row, discarding the rows
+# before start. Nearest stops are recomputed from the stops file, if there is
+# one, for all of the cached rows at once or for each streamed chunk. The
+# bot and export.py both read the parcels through this, so that their tweets
+# agree.
+def parcel_chunks(path = INPUT_PARCELS, cache_dir = None, start = 0, stop = None,
+                  offset = None, chunk_size = PARCEL_CHUNK_SIZE):
+    if (cache_dir is not None):
+        (df, offsets) = load_cached_parcels(path, cache_dir)
+        # only the rows asked for are refreshed, so that reading a shard costs
+        # as much as the shard rather than the whole city
+        (df, offsets) = (df.iloc[start:stop], offsets[start:stop])
+        df = DATA.refresh_transit_columns(df)
+        PHRASES.build(df)
+        for chunk_start in range(0, len(df), chunk_size):
+            chunk_end = chunk_start + chunk_size
+            yield (df.iloc[chunk_start:chunk_end], offsets[chunk_start:chunk_end])
+        return
+
+    if (offset is not None):
+        chunks = stream_parcel_chunks(path, offset, start, chunk_size = chunk_size)
+    else:
+        chunks = stream_parcel_chunks(path, chunk_size = chunk_size)
+    for (chunk, offsets) in chunks:
+        keep = (chunk.index >= start)
+        if (stop is not None):
+            keep &= (chunk.index < stop)
+        if (keep.any()):
+            first = keep.argmax()
+            last = len(keep) - keep[::-1].argmax()
+            yield (DATA.refresh_transit_columns(chunk.iloc[first:last]), offsets[first:last])
+        if ((stop is not None) and (chunk.index[-1] >= stop - 1)):
+            break
+
+# Yield (chunk, offsets) pairs from parcel_chunks, resuming after the position
+# recorded in the journal at journal_path, if given, or the status file (see
+# load_position), and only covering the rows from first_index up to
+# stop_index, if given (a shard; see shards.py). With a cache_dir, resuming is
+# a matter of slicing. Otherwise the CSV file is streamed from the saved byte
+# offset; for old status files without one, the rows before the saved index
+# are read and discarded once.
+def resume_parcel_chunks(path = INPUT_PARCELS, status_path = STATUS_FILE,
+                         chunk_size = PARCEL_CHUNK_SIZE, cache_dir = None,
+                         journal_path = None, first_index = 0, stop_index = None):
+    (last_index, next_offset) = load_position(status_path, journal_path)
+    start_index = max(first_index, resume_index(last_index, next_offset))
+    if (start_index > resume_index(last_index, next_offset)):
+        next_offset = None # the saved offset is for an earlier row
+
+    return parcel_chunks(
+        path, cache_dir, start_index, stop_index, next_offset, chunk_size = chunk_size
+    )
+
+# Yield (index, next_offset, row) tuples for the parcels, resuming after the
+# position recorded in the status file, and report parcels whose replies would
+# fail to find their attributes
+def resume_parcels(path = INPUT_PARCELS, status_path = STATUS_FILE, cache_dir = None,
+                   journal_path = None, first_index = 0, stop_index = None):
+    for (chunk, offsets) in resume_parcel_chunks(
+            path, status_path, cache_dir = cache_dir, journal_path = journal_path,
+            first_index = first_index, stop_index = stop_index):
+        for problem in check_attribute_keys(chunk):
+            print(problem)
+        for ((index, row), next_offset) in zip(parcel_records(chunk), offsets):
+            yield (index, next_offset, row)
+
 # determine whether or not to skip a row in the data
 def skip_row(row):
     if (pandas.isnull(row["ST_NUM"])):
         return "no ST_NUM"
     return False
 
+# Filter (index, next_offset, row) tuples down to the rows that will be tweeted
+def eligible_parcels(parcels):
+    for (index, next_offset, row) in parcels:
+        skip = skip_row(row)
+        if (skip):
+            if (type(skip) is str):
+                print("Skipping row, reason: %s" % skip)
+        else:
+            yield (index, next_offset, row)
+
 def human_readable_distance(distance_meters):
     distance_miles = distance_meters / METERS_IN_MILE
     if (distance_miles < MILES_FEET_CUTOFF):
@@ -200,20 +899,64 @@ def contains_digits(str_):
             if (digit in str_):
                 return True
 
-# Given an address and lon-lat pair, download the address's Google Street View
-# image, falling back to the lon-lat pair if the address has no street number
-def pull_picture(address, lon, lat, api_key):
+# The Street View image cache, created by streetview_cache on first use with
+# the Google Street View backend. Assign an image_cache.StreetViewCache with
+# another backend to this before the first tweet to use that backend instead.
+STREETVIEW_CACHE = None
+
+def streetview_cache(api_key):
+    global STREETVIEW_CACHE
+    if (STREETVIEW_CACHE is None):
+        STREETVIEW_CACHE = image_cache.StreetViewCache(
+            STREETVIEW_CACHE_DIR, STREETVIEW_CACHE_BYTES,
+            image_cache.GoogleStreetViewBackend(api_key)
+        )
+    return STREETVIEW_CACHE
+
+# Given an address and lon-lat pair, fetch the address's Google Street View
+# image through the cache, falling back to the lon-lat pair if the address has
+# no street number. Returns the path to the cached image, or None if there is
+# no image for the location.
+def fetch_picture(address, lon, lat, api_key):
     if (address[0] in DIGITS):
         address = "%s, Boston" % address
     else:
         address = "%d,%d" % (lat, lon)
-    results = google_streetview.api\
-        .results([{
-            "size": "1200x675",
-            "location": address,
-            "key": api_key
-        }])\
-        .download_links(IMAGES_DIR)
+    return streetview_cache(api_key).get(address, STREETVIEW_IMAGE_SIZE)
+
+# Same as fetch_picture, but places the image at DEFAULT_IMAGE_PATH, which is
+# returned, or None if there is no image for the location
+def pull_picture(address, lon, lat, api_key):
+    cached_path = fetch_picture(address, lon, lat, api_key)
+
+    try:
+        os.remove(DEFAULT_IMAGE_PATH)
+    except FileNotFoundError:
+        pass
+    if (cached_path is None):
+        return None
+
+    # DEFAULT_IMAGE_PATH is removed after it is posted, so link the cached
+    # image there rather than moving it
+    try:
+        os.link(cached_path, DEFAULT_IMAGE_PATH)
+    except OSError:
+        shutil.copyfile(cached_path, DEFAULT_IMAGE_PATH)
+    return DEFAULT_IMAGE_PATH
+
+# Index of the pregenerated images (see assets.py), scanned on first use
+ASSETS = assets.AssetManifest({
+    "neighborhood_map": NEIGHBORHOOD_IMAGES,
+    "parcel_composite": PARCEL_IMAGES,
+    "tract_rent_map": TRACT_RENT_MAPS,
+    "tract_eth_het_map": TRACT_ETH_HET_MAPS,
+    "tract_age_graph": TRACT_AGE_GRAPHS,
+}, rescan_seconds = ASSET_RESCAN_SECONDS)
+
+# Convert a neighbourhood into the name of its map in NEIGHBORHOOD_IMAGES,
+# without the extension
+def neighborhood_slug(neighborhood_name):
+    return neighborhood_name.lower().replace(" ", "_")
 
 # Given a string of words, individually capitalize each word
 def capitalize_all_words(str_):
@@ -223,18 +966,26 @@ def capitalize_all_words(str_):
     ])
 
 # Given a row of data from the parcels CSV file, generate a tweet describing
-# its attributes, download an image from Google Street View, and return the
-# content of that tweet.
+# its attributes, download an image from Google Street View to
+# DEFAULT_IMAGE_PATH, and return the content of that tweet.
 def generate_parcel_tweet(row, googlemaps_api_key):
-
-    ### Address string: "This parcel on Waymount St." or "72 Day St."
-
-    if (pandas.isnull(row["ST_NUM"])):
-        street_num = "This parcel on"
+    (message, picture_address) = render_parcel_tweet(row)
+    pull_picture(picture_address, row["x"], row["y"], googlemaps_api_key)
+    return message
+
+# The pieces of a parcel tweet. Each of these depends on only one or two
+# columns of a parcel row, so that render_parcel_tweets can compute each piece
+# once per distinct value rather than once per row.
+
+### Address string: "This parcel on Waymount St." or "72 Day St."
+def street_number_phrase(street_num):
+    if (pandas.isnull(street_num)):
+        return "This parcel on"
     else:
-        street_num = str(row["ST_NUM"])
+        return str(street_num)
 
-    suffix_raw = row["ST_NAME_SUF"]
+# " St." or "", to append to the street name
+def street_suffix_phrase(suffix_raw):
     if (suffix_raw in ST_NAME_SUF_MAPPING):
         suffix = ST_NAME_SUF_MAPPING[suffix_raw]
     else:
@@ -244,36 +995,35 @@ def generate_parcel_tweet(row, googlemaps_api_key):
             suffix = None
 
     if (suffix):
-        address = " ".join([
-            street_num, capitalize_all_words(row["ST_NAME"]), suffix
-        ])
+        return " %s" % suffix
     else:
-        address = " ".join([
-            street_num, capitalize_all_words(row["ST_NAME"])
-        ])
+        return ""
 
-    ### Building style: "residential brownstone"
-    if (row["LU"] in LU_MAPPING):
-        building_style = LU_MAPPING[row["LU"]]
+### Building style: "residential brownstone"
+def building_style_phrase(land_use, building_style_code):
+    if (land_use in LU_MAPPING):
+        return LU_MAPPING[land_use]
     else:
-        building_style = R_BLDG_STYL_MAPPING[row["R_BLDG_STYL"]]
+        return R_BLDG_STYL_MAPPING[building_style_code]
 
-    ### Year built
-    year = row["YR_BUILT"]
+### Year built
+def built_in_year_phrase(year):
     if (pandas.isnull(year)):
-        built_in_year = ""
+        return ""
     else:
-        built_in_year = " built in %d" % year
+        return " built in %d" % year
 
-    ### Neighbourhood / section: x section of y
+### Neighbourhood / section: x section of y
+# Returns a tuple of the neighbourhood as it appears in the tweet, e.g. "the
+# #southend", and the "in the x section of y" phrase
+def neighbourhood_phrases(neighbourhood, section):
     # We manipulate a list here instead of using string manipulations because
     # several synonyms for a neighbourhood are separated by slashes, and it's
     # easier to do comparisons and modifications on a list of these synonyms
-    neighbourhood = row["neighborhood"]
-    if (row["section"] == "Cleveland Circle (/Brighton)"):
+    if (section == "Cleveland Circle (/Brighton)"):
         sections = ["Cleveland Circle", "Brighton"] # Special case
     else:
-        sections = row["section"].split("/")
+        sections = section.split("/")
 
     # "South End" -> "the South End"
     if (neighbourhood in NEIGHBOURHOOD_PREPEND_THE):
@@ -295,30 +1045,184 @@ def generate_parcel_tweet(row, googlemaps_api_key):
             "/".join(sections), neighbourhood_fixed
         )
 
-    ### Assessed value
-    assessed_value = "{:,}".format(row["AV_TOTAL"])
+    return (neighbourhood_fixed, neighbourhood_str)
 
-    ### Renovations
-    year_renovated = row["ISSUED_DATE"]
+### Assessed value
+def assessed_value_phrase(assessed_value):
+    return "{:,}".format(assessed_value)
+
+### Renovations
+def renovated_phrase(year_renovated, permit_type):
     if (pandas.isnull(year_renovated)):
-        renovated_str = "No building permits were issued for this address since 2006"
+        return "No building permits were issued for this address since 2006"
     else:
-        renovated_str = "A %s was last issued in %d" % (
-            PERMIT_TYPE_MAPPING[row["permittypedescr"]], year_renovated
+        return "A %s was last issued in %d" % (
+            PERMIT_TYPE_MAPPING[permit_type], year_renovated
         )
 
-    ### Download picture
-    pull_picture(
-        "%s, %s" % (address, neighbourhood_fixed),
-        row["x"], row["y"],
-        googlemaps_api_key
+### Street: "Waymount St." (with a leading space before the suffix)
+def street_phrase(street_name, suffix_raw):
+    return capitalize_all_words(street_name) + street_suffix_phrase(suffix_raw)
+
+# Missing values are looked up as None, since NaN never equals itself
+def phrase_key(value):
+    return None if pandas.isnull(value) else value
+
+# Memoised street and neighbourhood phrases, which depend only on a street
+# name and suffix, or a neighbourhood and section, of which there are a few
+# thousand combinations across every parcel. build() fills the table for a
+# whole dataset at once; any combination not in it is computed on first use.
+# Hits and misses are counted per table, and the table can be dumped to a CSV
+# file for reviewing the copy.
+class PhraseTable(object):
+
+    TABLES = {
+        "street": (("ST_NAME", "ST_NAME_SUF"), street_phrase),
+        "neighbourhood": (("neighborhood", "section"), neighbourhood_phrases),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.phrases = {name: {} for name in self.TABLES}
+            self.stats = {
+                name: collections.Counter(hits = 0, misses = 0) for name in self.TABLES
+            }
+
+    # Precompute the phrases for every distinct combination of values in a
+    # DataFrame of parcels, replacing the table's contents. The parcels include
+    # rows that skip_row drops, whose values may have no phrase (e.g. a
+    # missing street name); those combinations are left out, so that they
+    # only fail if a row that is tweeted has them, as they would per row.
+    def build(self, df):
+        self.clear()
+        for (name, (columns, func)) in self.TABLES.items():
+            phrases = self.phrases[name]
+            for values in df[list(columns)].drop_duplicates().itertuples(index = False):
+                try:
+                    phrase = func(*values)
+                except Exception:
+                    continue
+                phrases[tuple(phrase_key(value) for value in values)] = phrase
+        return self
+
+    def lookup(self, name, *values):
+        key = tuple(phrase_key(value) for value in values)
+        phrases = self.phrases[name]
+        if (key in phrases):
+            with self.lock:
+                self.stats[name]["hits"] += 1
+            return phrases[key]
+        phrase = self.TABLES[name][1](*values)
+        with self.lock:
+            self.stats[name]["misses"] += 1
+            phrases[key] = phrase
+        return phrase
+
+    def street(self, street_name, suffix_raw):
+        return self.lookup("street", street_name, suffix_raw)
+
+    def neighbourhood(self, neighbourhood, section):
+        return self.lookup("neighbourhood", neighbourhood, section)
+
+    # Write every phrase in the table to a CSV file for review, one row per
+    # combination of values; for neighbourhoods, the phrase is the "in the x
+    # section of y" phrase, which includes the hashtag
+    def dump(self, path_or_buffer):
+        rows = []
+        for name in self.TABLES:
+            for (key, phrase) in self.phrases[name].items():
+                if (type(phrase) is tuple):
+                    phrase = phrase[-1]
+                rows.append((name,) + key + (phrase,))
+        rows.sort(key = lambda row: [str(value) for value in row])
+        pandas.DataFrame(
+            rows, columns = ["table", "value_1", "value_2", "phrase"]
+        ).to_csv(path_or_buffer, index = False)
+
+PHRASES = PhraseTable()
+
+# Given a row of data from the parcels CSV file, return a tuple of the content
+# of a tweet describing its attributes and the address to pass to
+# pull_picture or fetch_picture for its Street View image
+def render_parcel_tweet(row):
+    address = "%s %s" % (
+        street_number_phrase(row["ST_NUM"]),
+        PHRASES.street(row["ST_NAME"], row["ST_NAME_SUF"])
     )
+    building_style = building_style_phrase(row["LU"], row["R_BLDG_STYL"])
+    built_in_year = built_in_year_phrase(row["YR_BUILT"])
+    (neighbourhood_fixed, neighbourhood_str) = PHRASES.neighbourhood(
+        row["neighborhood"], row["section"]
+    )
+    assessed_value = assessed_value_phrase(row["AV_TOTAL"])
+    renovated_str = renovated_phrase(row["ISSUED_DATE"], row["permittypedescr"])
 
     return (
-        f"{address} is {article_for(building_style)} {building_style}{built_in_year} {neighbourhood_str}."
-        f" The current value in the Boston tax assessment database is ${assessed_value}."
-        f" {renovated_str}."
+        (
+            f"{address} is {article_for(building_style)} {building_style}{built_in_year} {neighbourhood_str}."
+            f" The current value in the Boston tax assessment database is ${assessed_value}."
+            f" {renovated_str}."
+        ),
+        "%s, %s" % (address, neighbourhood_fixed)
+    )
+
+# Apply func to each distinct combination of values in the given Series, which
+# share an index, and return a Series of the results aligned with them. func is
+# called with the values as they appear in the first row with each
+# combination, so it sees exactly what a per-row caller would see, including
+# missing values.
+def map_distinct(func, *columns):
+    factorized = [
+        pandas.factorize(column, use_na_sentinel = False)[0]
+        for column in columns
+    ]
+    if (len(factorized) == 1):
+        combined = factorized[0]
+    else:
+        combined = numpy.ravel_multi_index(
+            factorized, [codes.max() + 1 if (len(codes) > 0) else 1 for codes in factorized]
+        )
+    (codes, _) = pandas.factorize(combined)
+    (_, first_rows) = numpy.unique(codes, return_index = True)
+
+    results = numpy.empty(len(first_rows), dtype = object)
+    # values are read through iteration, which yields the same Python
+    # scalars as ParcelRecord.from_frame
+    for (code, values) in enumerate(zip(*(column.iloc[first_rows] for column in columns))):
+        results[code] = func(*values)
+    return pandas.Series(results[codes], index = columns[0].index, dtype = object)
+
+# Batch version of render_parcel_tweet: given a DataFrame of rows from the
+# parcels CSV file, return a tuple of a Series with the content of each row's
+# tweet and a Series with the address to fetch each row's Street View image
+# with. Each piece of the tweet is computed once per distinct value of the
+# columns it depends on and the pieces are concatenated column-wise, so the
+# whole city renders in seconds; the text is identical to render_parcel_tweet.
+def render_parcel_tweets(df):
+    address = (
+        map_distinct(street_number_phrase, df["ST_NUM"])
+        + " " + map_distinct(PHRASES.street, df["ST_NAME"], df["ST_NAME_SUF"])
     )
+    building_style = map_distinct(building_style_phrase, df["LU"], df["R_BLDG_STYL"])
+    neighbourhood = map_distinct(PHRASES.neighbourhood, df["neighborhood"], df["section"])
+
+    messages = (
+        address
+        + " is " + map_distinct(article_for, building_style)
+        + " " + building_style
+        + map_distinct(built_in_year_phrase, df["YR_BUILT"])
+        + " " + neighbourhood.str[1]
+        + ". The current value in the Boston tax assessment database is $"
+        + map_distinct(assessed_value_phrase, df["AV_TOTAL"])
+        + ". " + map_distinct(renovated_phrase, df["ISSUED_DATE"], df["permittypedescr"])
+        + "."
+    )
+    picture_addresses = address + ", " + neighbourhood.str[0]
+    return (messages, picture_addresses)
 
 # Given a row of data from the parcels CSV file, generate a tweet describing
 # the attributes of the neighbourhood and return relevant images
@@ -326,40 +1230,42 @@ def generate_neighborhood_tweet(row):
     neighborhood_name = row["neighborhood"]
 
     # neighborhood attributes are stored in a separate file
-    neighborhood_attributes = NEIGHBORHOOD_ATTRIBUTES[
-        NEIGHBORHOOD_ATTRIBUTES["Name"] == neighborhood_name
-    ].iloc[0]
-    n_transit_lines = neighborhood_attributes["n_bus_lines"] + neighborhood_attributes["n_subway_lines"]
+    neighborhood_attributes = DATA.neighborhood_store[neighborhood_name]
+    n_transit_lines = neighborhood_attributes.n_bus_lines + neighborhood_attributes.n_subway_lines
 
     # also block group attributes
-    blockgroup_attributes = BLOCKGROUP_ATTRIBUTES[
-        BLOCKGROUP_ATTRIBUTES["BG_ID_10"] == row["BG_ID_10"]
-    ].iloc[0]
-    distance = human_readable_distance(blockgroup_attributes["MEDIAN_TRANSIT_METERS"])
+    blockgroup_attributes = DATA.blockgroup_store[row["BG_ID_10"]]
+    distance = human_readable_distance(blockgroup_attributes.MEDIAN_TRANSIT_METERS)
 
     # closest stop info
     stop_type = row["STOP_TYPE"].lower()
     stop_name = row["STOP_NAME"]
     time = "%0.2f" % (row["NEAREST_TRANSIT_SECONDS"] / 60)
+    # walking times recomputed from the stops file are estimated from the
+    # distance to the stop, rather than routed along the streets
+    if (DATA.transit_recomputed(row)):
+        walk = f"This is about a {time} minute walk."
+    else:
+        walk = f"This is a {time} minute walk, according to OpenStreetMap."
 
     # neighborhood image always exists
     neighborhood_image = "%s/%s.png" % (
-        NEIGHBORHOOD_IMAGES, neighborhood_name.lower().replace(" ", "_")
+        NEIGHBORHOOD_IMAGES, neighborhood_slug(neighborhood_name)
     )
 
-    # parcel image always may not
+    # parcel image may not
     parcel_image = "%s/%d.jpg" % (
         PARCEL_IMAGES, row["Land_Parcel_ID"]
     )
-    if (os.path.isfile(parcel_image)):
+    if (ASSETS.exists(parcel_image)):
         images = [neighborhood_image, parcel_image]
     else:
-        images = [neighborhood_image, parcel_image]
+        images = [neighborhood_image]
 
     return {
         "message": (
             f"The closest MBTA {stop_type} stop is {stop_name}."
-            f" This is a {time} minute walk, according to OpenStreetMap."
+            f" {walk}"
             f" The average walking distance to a transit stop in this census block group is {distance}."
             f" {n_transit_lines} different transit lines serve {neighborhood_name}."
         ),
@@ -370,26 +1276,19 @@ def generate_neighborhood_tweet(row):
 # Chloropleth ofmedian rent, red outline of the tract in question, white to green colormap
 def generate_tract_housing_characteristics_tweet(row):
     tract_id = int(row["CT_ID_10"])
-    tract_attributes = TRACT_ATTRIBUTES[
-        TRACT_ATTRIBUTES["CT_ID_10"] == row["CT_ID_10"]
-    ].iloc[0]
+    tract_attributes = DATA.tract_store[row["CT_ID_10"]]
 
-    population_density = locale.format("%d", int(tract_attributes["PopDen"]), grouping = True)
-    population_density_pctile = int(tract_attributes["PopDenPctile"] * 100)
+    set_locale()
+    population_density = locale.format("%d", int(tract_attributes.PopDen), grouping = True)
+    population_density_pctile = int(DATA.percentile("tract", "PopDen", tract_id) * 100)
 
-    percent_renters = int(tract_attributes["RentersPer"] * 100)
+    percent_renters = int(tract_attributes.RentersPer * 100)
 
-    median_rent = locale.format("%d", int(tract_attributes["MedGrossRent"]), grouping = True)
-    median_rent_pctile = tract_attributes["MedGrossRentPctile"]
+    median_rent = locale.format("%d", int(tract_attributes.MedGrossRent), grouping = True)
+    median_rent_pctile = DATA.percentile("tract", "MedGrossRent", tract_id)
 
     print(median_rent_pctile)
-    if (median_rent_pctile > 0.5):
-        more_less = "more"
-        median_rent_ratio = median_rent_pctile - 0.5
-    else:
-        more_less = "less"
-        median_rent_ratio = 0.5 - median_rent_pctile
-    median_rent_ratio = int(median_rent_ratio * 100)
+    (median_rent_ratio, more_less) = percentiles.more_or_less(median_rent_pctile)
 
     tract_rent_map = "%s/%d.png" % (TRACT_RENT_MAPS, tract_id)
 
@@ -401,44 +1300,56 @@ def generate_tract_housing_characteristics_tweet(row):
         "images": [tract_rent_map]
     }
 
+# Return a reply generator for a tweet comparing the value of a column in the
+# parcel's tract or block group with the rest of the city, by its citywide
+# percentile rank. message and image are format strings for the tweet's text
+# and the path of its image, filled in with:
+#   id: the tract or block group ID
+#   value: the value of the column
+#   pctile: its percentile rank, from 0 to 100
+#   ratio: the number of percentage points between its rank and the median
+#   more_less: "more" or "less", for which side of the median it is on
+def comparison_tweet_generator(name, dataset, column, message, image):
+    key_column = DataContext.DATASETS[dataset][1]
+
+    def generate_comparison_tweet(row):
+        key = int(row[key_column])
+        rank = DATA.percentile(dataset, column, key)
+        (ratio, more_less) = percentiles.more_or_less(rank)
+        fields = {
+            "id": key,
+            "value": getattr(DATA.store(dataset)[key], column, None),
+            "pctile": int(rank * 100),
+            "ratio": ratio,
+            "more_less": more_less,
+        }
+        return {
+            "message": message.format(**fields),
+            "images": [image.format(**fields)]
+        }
+
+    generate_comparison_tweet.__name__ = name
+    return generate_comparison_tweet
+
 # This census tract (*123) is 19% more racially/ethnically diverse than the city average.
 # Chloropleth of ethnic heterogeneity, red outline of the tract in question, viridis colormap
-def generate_tract_ethnic_heterogeneity_tweet(row):
-    tract_id = int(row["CT_ID_10"])
-    tract_attributes = TRACT_ATTRIBUTES[
-        TRACT_ATTRIBUTES["CT_ID_10"] == row["CT_ID_10"]
-    ].iloc[0]
-
-    eth_het_pctile = tract_attributes["EthHetPctile"]
-
-    if (eth_het_pctile > 0.5):
-        more_less = "more"
-        eth_het_ratio = eth_het_pctile - 0.5
-    else:
-        more_less = "less"
-        eth_het_ratio = 0.5 - eth_het_pctile
-    eth_het_ratio = int(eth_het_ratio * 100)
-
-    tract_eth_het_map = "%s/%d.png" % (TRACT_ETH_HET_MAPS, tract_id)
-
-    return {
-        "message": (
-            f"This census tract ({tract_id}) is {eth_het_ratio}% {more_less} racially/ethnically diverse than the city average."
-        ),
-        "images": [tract_eth_het_map]
-    }
+generate_tract_ethnic_heterogeneity_tweet = comparison_tweet_generator(
+    name = "generate_tract_ethnic_heterogeneity_tweet",
+    dataset = "tract",
+    column = "EthHet",
+    message = "This census tract ({id}) is {ratio}% {more_less} racially/ethnically diverse than the city average.",
+    image = TRACT_ETH_HET_MAPS + "/{id}.png"
+)
 
 # In this census tract ($123), 20% of residents have a high school degree or less, 20% have completed some college or a bachelor’s degree, and 20% have a graduate degree.
 # Image: bar graph of ages
 def generate_tract_education_age_tweet(row):
     tract_id = int(row["CT_ID_10"])
-    tract_attributes = TRACT_ATTRIBUTES[
-        TRACT_ATTRIBUTES["CT_ID_10"] == row["CT_ID_10"]
-    ].iloc[0]
+    tract_attributes = DATA.tract_store[row["CT_ID_10"]]
 
-    percent_hs = int(tract_attributes["highSchoolDegreeOrless"])
-    percent_coll = int(tract_attributes["completedCollegeOrBachelorDegree"])
-    percent_grad = int(tract_attributes["graduateDegree"])
+    percent_hs = int(tract_attributes.highSchoolDegreeOrless)
+    percent_coll = int(tract_attributes.completedCollegeOrBachelorDegree)
+    percent_grad = int(tract_attributes.graduateDegree)
 
     tract_age_graph = "%s/%d.png" % (TRACT_AGE_GRAPHS, tract_id)
 
@@ -452,18 +1363,139 @@ def generate_tract_education_age_tweet(row):
         "images": [tract_age_graph]
     }
 
+# Each item in this list is a function that takes a row of input and returns a
+# dict with the keys "message" and "images", containing the tweet text and the
+# paths to images to use, respectively. One is chosen at random for the reply
+# to each parcel's tweet.
+REPLY_GENERATORS = [
+    generate_neighborhood_tweet,
+    generate_tract_housing_characteristics_tweet,
+    generate_tract_ethnic_heterogeneity_tweet,
+    generate_tract_education_age_tweet,
+]
+
+# Given a row of data from the parcels CSV file, prepare the whole thread for
+# it: the main tweet, with its Street View image fetched through the cache, and
+# a reply from a randomly chosen generator. Returns a dict with the keys "main"
+# and "reply", each holding the "message" and "images" of a tweet (without the
+# "(1/2)" counters), "generator", the name of the reply generator,
+# "missing_images", the reply images that were dropped because they don't
+# exist, and "timings", the seconds spent rendering the main tweet, fetching
+# the Street View image and running the reply generator, measured with timer.
+# Failing to fetch the Street View image is not an error; the main tweet says
+# that there is no image instead.
+def prepare_thread(row, googlemaps_api_key, timer = time.perf_counter):
+    timings = {}
+
+    started = timer()
+    (main_message, picture_address) = render_parcel_tweet(row)
+    timings["render_parcel_tweet"] = timer() - started
+
+    started = timer()
+    try:
+        picture = fetch_picture(picture_address, row["x"], row["y"], googlemaps_api_key)
+    except Exception:
+        traceback.print_exc()
+        picture = None
+    timings["pull_picture"] = timer() - started
+    if (picture is not None):
+        main_images = [picture]
+    else:
+        main_images = []
+        main_message = "%s There is no image available for this parcel." % main_message
+
+    started = timer()
+    tweet_generator = random.choice(REPLY_GENERATORS)
+    reply = tweet_generator(row)
+    reply_images = [path for path in reply["images"] if ASSETS.exists(path)]
+    timings["reply_generator"] = timer() - started
+
+    return {
+        "main": {"message": main_message, "images": main_images},
+        "reply": {"message": reply["message"], "images": reply_images},
+        "generator": tweet_generator.__name__,
+        "missing_images": [path for path in reply["images"] if path not in reply_images],
+        "timings": timings,
+    }
+
+# Seconds spent importing this module, reported by --cold-start
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
 if (__name__ == "__main__"):
     import argparse
     import json
-    import slack
-    import traceback
-    import tweepy
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-n", "--dry-run", dest = "dry_run", action = "store_true", default = False)
+    parser.add_argument(
+        "--no-cache", dest = "no_cache", action = "store_true", default = False,
+        help = "parse the CSV files instead of using the binary cache in %s" % CACHE_DIR
+    )
+    parser.add_argument(
+        "--prefetch", dest = "prefetch", type = int, default = 3,
+        help = "number of upcoming threads to prepare in the background (0 to prepare each one when it is posted)"
+    )
+    parser.add_argument(
+        "--memory-report", dest = "memory_report", action = "store_true", default = False,
+        help = "compare the memory used by the parcels with and without PARCEL_SCHEMA, then exit"
+    )
+    parser.add_argument(
+        "--dump-phrases", dest = "dump_phrases", default = None, metavar = "FILE",
+        help = "write the street and neighbourhood phrases of every parcel to a CSV file for review, then exit"
+    )
+    parser.add_argument(
+        "--cold-start", dest = "cold_start", action = "store_true", default = False,
+        help = "report how long the import and each dataset load take, then exit"
+    )
+    parser.add_argument(
+        "--shards", dest = "shards", default = None, metavar = "DIR",
+        help = "share out the parcels with other bots through leases on shards of rows kept in DIR"
+    )
+    parser.add_argument(
+        "--worker", dest = "worker", default = None, metavar = "NAME",
+        help = "name of this bot in the names and labels of its metrics with --shards (defaults to its lease owner ID)"
+    )
     args = parser.parse_args()
 
+    cache_dir = None if (args.no_cache) else CACHE_DIR
+    DATA.cache_dir = cache_dir
+
+    if (args.memory_report):
+        print(parcel_memory_report().to_string())
+        raise SystemExit(0)
+
+    if (args.dump_phrases):
+        if (cache_dir is not None):
+            (df, _) = load_cached_parcels(cache_dir = cache_dir)
+        else:
+            df = read_parcels_for_cache(INPUT_PARCELS)
+        PHRASES.build(df).dump(args.dump_phrases)
+        raise SystemExit(0)
+
+    if (args.cold_start):
+        print("import: %0.3f seconds" % IMPORT_SECONDS)
+        DATA.preload()
+        for (name, seconds) in DATA.load_times.items():
+            print("load %s: %0.3f seconds" % (name, seconds))
+        if (cache_dir is not None):
+            started = time.perf_counter()
+            load_cached_parcels(cache_dir = cache_dir)
+            print("load parcels: %0.3f seconds" % (time.perf_counter() - started))
+        raise SystemExit(0)
+
+    import slack
+    import tweepy
+
+    import media
+    import crash_reports
+    import metrics
+    import posting
+    import runner
+    import shards
+
     print("loading")
+    set_locale()
+    DATA.preload()
 
     with open(CREDENTIALS_FILE, "r") as f:
         credentials = json.load(f)
@@ -476,116 +1508,71 @@ if (__name__ == "__main__"):
         credentials["twitter"]["access_token"],
         credentials["twitter"]["access_token_secret"]
     )
-    api = tweepy.API(auth)
+    api = tweepy.API(auth, retry_count = 0)
 
     slack_client = slack.WebClient(token = credentials["slack"]["token"])
 
-    # wrapper around tweet functionality
-    def tweet(message, image_paths = [], reply_to_status = None):
-        tweet_kwargs = {}
-
-        print("")
-
-        # upload images
-        if (len(image_paths) > 0):
-            media_ids = []
-            for image_path in image_paths:
-                if (args.dry_run):
-                    print("Not uploading: %s" % image_path)
-                else:
-                    print("Uploading: %s" % image_path)
-                    media_ids.append(api.media_upload(image_path).media_id)
-            tweet_kwargs["media_ids"] = media_ids
-
-        # reply
-        if (reply_to_status):
-            tweet_kwargs["in_reply_to_status_id"] = reply_to_status.id
-            message = "@bariexplorer %s" % message
-            print("Set in_reply_to_status_id to %d" % reply_to_status.id)
-
-        if (args.dry_run):
-            print("Not tweeting: %s" % message)
-        else:
-            print("Tweeting: %s" % message)
-            return api.update_status(message, **tweet_kwargs)
-
-    df = pandas.read_csv(INPUT_PARCELS)
-    start_at = 0
-
-    # Load the previous position of the bot
-    if (os.path.isfile(STATUS_FILE)):
-        with open(STATUS_FILE, "r") as f:
-            start_at = int(f.read())
-
-    # Loop over rows
-    for (index, row) in df[start_at + 2:].iterrows():
-        try:
-            skip = skip_row(row)
-            if (skip):
-                if (type(skip) is str):
-                    print("Skipping row, reason: %s" % skip)
-            else:
-                print("Gathering information for row: %d" % index)
-                main_status = None
-
-                # Save position
-                with open(STATUS_FILE, "w") as f:
-                    f.write(str(index))
-
-                ################################################################
-                # Main tweet ###################################################
-
-                main_message = generate_parcel_tweet(row, credentials["googlemaps"])
-
-                if (os.path.isfile(DEFAULT_IMAGE_PATH)):
-                    main_tweet_images = [DEFAULT_IMAGE_PATH]
-                else:
-                    main_tweet_images = None
-                    main_message = "%s There is no image available for this parcel." % main_message
-
-                main_status = tweet(
-                    message = "%s (1/2)" % main_message,
-                    image_paths = main_tweet_images
-                )
+    clock = runner.SystemClock()
+    twitter = posting.PostingClient(
+        api, clock, limits = TWITTER_RATE_LIMITS,
+        max_retries = POSTING_MAX_RETRIES, backoff = POSTING_BACKOFF
+    )
 
-                try:
-                    os.remove(DEFAULT_IMAGE_PATH)
-                except:
-                    pass
-
-                ################################################################
-                # Reply tweet (randomly chosen) ################################
-
-                # each item in this list is a function that takes a row of input
-                # and returns a dict with the keys "message" and "images",
-                # containing the tweet text and the paths to images to use,
-                # respectively.
-                tweet_generators = [
-                    generate_neighborhood_tweet,
-                    generate_tract_housing_characteristics_tweet,
-                    generate_tract_ethnic_heterogeneity_tweet,
-                    generate_tract_education_age_tweet,
-                ]
-
-                tweet_generator = random.choice(tweet_generators)
-                print("\nCreating reply tweet using tweet generator:")
-                print(tweet_generator)
-                reply = tweet_generator(row)
-
-                tweet(
-                    message = "%s (2/2)" % reply["message"],
-                    image_paths = reply["images"],
-                    reply_to_status = main_status
-                )
+    # each run, one per shard with --shards, has its own journal, which is
+    # closed when the run ends
+    def run(parcels, journal_path, lease = None):
+        with journal.Journal(journal_path, JOURNAL_COMPACT_EVERY) as posting_journal:
+            return runner.Runner(
+                eligible_parcels(parcels),
+                lambda row: prepare_thread(row, credentials["googlemaps"]),
+                twitter = twitter,
+                slack = slack_client,
+                slack_channel = credentials["slack"]["channel"],
+                clock = clock,
+                journal = posting_journal,
+                streetview = streetview_cache(credentials["googlemaps"]),
+                dry_run = args.dry_run,
+                prefetch_depth = args.prefetch,
+                sleep_time = SLEEP_TIME,
+                reboot_time = REBOOT_TIME,
+                uploader = uploader,
+                metrics = metrics_log,
+                slow_stage_seconds = SLOW_STAGE_SECONDS,
+                thread_attempts = THREAD_ATTEMPTS,
+                lease = lease,
+                crash_reporter = crash_reporter
+            ).run()
+
+    uploader = media.MediaUploader(
+        twitter.media_upload, ttl = MEDIA_ID_TTL, workers = MEDIA_UPLOAD_WORKERS
+    )
+    if (args.shards is None):
+        metrics_log = metrics.MetricsLog(METRICS_LOG, METRICS_PROM)
+    else:
+        table = shards.ShardTable(
+            args.shards, shard_rows = SHARD_ROWS, lease_seconds = SHARD_LEASE_SECONDS
+        )
+        # a stable name keeps a restarted bot writing to the same files
+        worker = args.worker if (args.worker is not None) else table.owner
+        metrics_log = metrics.MetricsLog(
+            metrics.owner_path(METRICS_LOG, worker),
+            metrics.owner_path(METRICS_PROM, worker),
+            labels = {"worker": worker}
+        )
 
-                time.sleep(SLEEP_TIME)
-        except KeyboardInterrupt:
-            raise
-        except Exception as error:
-            traceback.print_exc()
-            slack_client.files_upload(
-                channels = credentials["slack"]["channel"],
-                initial_comment = "bariexplorer crashed! Stack trace attached. I will be restarting the bot in %d seconds 👍" % REBOOT_TIME,
-                content = traceback.format_exc()
-            )
-            time.sleep(REBOOT_TIME)
+    # grouped crashes are sent when the bot stops, and its metrics are no
+    # longer published
+    with metrics_log, crash_reports.CrashReporter(
+            slack_client, credentials["slack"]["channel"],
+            digest_seconds = CRASH_DIGEST_SECONDS, quiet_seconds = CRASH_QUIET_SECONDS,
+            max_uploads = CRASH_UPLOADS_PER_HOUR, rate_seconds = 60 * 60) as crash_reporter:
+        if (args.shards is None):
+            run(resume_parcels(cache_dir = cache_dir, journal_path = JOURNAL_FILE), JOURNAL_FILE)
+        else:
+            table.setup(count_parcels(cache_dir = cache_dir))
+            # each shard's journal is its checkpoint; the status file is shared
+            # by every shard, so it isn't used
+            table.work(lambda lease: run(resume_parcels(
+                status_path = None, cache_dir = cache_dir, journal_path = lease.journal_path,
+                first_index = lease.shard.start, stop_index = lease.shard.stop
+            ), lease.journal_path, lease), poll_seconds = SHARD_POLL_SECONDS)
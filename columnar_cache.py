@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# Build-once binary cache of the bot's CSV files. Each CSV file is parsed once
+# and stored column by column as NumPy arrays: numeric columns as-is, and text
+# columns as an array of category codes plus a table of the distinct strings,
+# and nullable (masked) numeric columns as an array of values plus a mask.
+# Later loads memory-map the arrays, so they take milliseconds and every
+# process on the host shares the same pages of the page cache. A cache entry
+# is rebuilt when the size or contents of its source file change. Each entry
+# has a lock file: loads hold a shared lock while they check and open the
+# entry, and builds hold an exclusive one, so that several processes starting
+# at once build an entry only once and never remove files another is opening.
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import uuid
+
+import numpy
+import pandas
+
+# Bump this whenever the layout of a cache entry changes
+CACHE_VERSION = 2
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "build.lock"
+
+# Number of bytes to read at a time while hashing a source file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Return the SHA-256 hex digest of a file's contents
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Return the directory that the cache entry for a source file is stored in.
+# The directory name includes a hash of the absolute path so that two source
+# files with the same name in different directories don't collide.
+def entry_dir(path, cache_dir):
+    path = os.path.abspath(path)
+    return os.path.join(cache_dir, "%s-%s" % (
+        os.path.basename(path),
+        hashlib.sha1(path.encode("utf-8")).hexdigest()[:8]
+    ))
+
+# Hold a POSIX lock on a cache entry, exclusive for building it or shared for
+# reading it, as shards.py does
+@contextlib.contextmanager
+def locked(directory, exclusive = True):
+    with open(os.path.join(directory, LOCK_FILE), "a+") as f:
+        fcntl.lockf(f, fcntl.LOCK_EX if (exclusive) else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Atomically replace the manifest, so that a reader never sees a partial one
+def write_manifest(directory, manifest):
+    temp_path = os.path.join(directory, "%s.%s.tmp" % (MANIFEST_FILE, uuid.uuid4().hex))
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(directory, MANIFEST_FILE))
+
+# Return True if the manifest describes the current contents of the source
+# file, built with the same build_key (see load). The size and mtime are
+# checked first; if only the mtime has changed (e.g. the file was touched or
+# copied), the contents are hashed and the manifest is updated with the new
+# mtime if they are unchanged.
+def is_fresh(directory, manifest, path, build_key = None):
+    if ((manifest is None) or (manifest.get("version") != CACHE_VERSION)):
+        return False
+    if (manifest.get("build_key") != build_key):
+        return False
+    stat = os.stat(path)
+    source = manifest["source"]
+    if (stat.st_size != source["size"]):
+        return False
+    if (stat.st_mtime_ns == source["mtime_ns"]):
+        return True
+    if (file_hash(path) != source["sha256"]):
+        return False
+    source["mtime_ns"] = stat.st_mtime_ns
+    write_manifest(directory, manifest)
+    return True
+
+# Nullable array type to rebuild a masked column with, by NumPy dtype kind
+MASKED_ARRAY_TYPES = {
+    "b": pandas.arrays.BooleanArray,
+    "i": pandas.arrays.IntegerArray,
+    "u": pandas.arrays.IntegerArray,
+    "f": pandas.arrays.FloatingArray,
+}
+
+# Write a DataFrame to the cache entry for a source file, replacing any
+# previous entry. Column files are named after a new build ID and the manifest
+# is replaced last, so processes that already opened the previous build are not
+# affected. Only call this while holding the entry's exclusive lock (see load).
+def write(df, path, cache_dir, build_key = None):
+    directory = entry_dir(path, cache_dir)
+    os.makedirs(directory, exist_ok = True)
+    stat = os.stat(path)
+    source_sha256 = file_hash(path)
+    build_id = uuid.uuid4().hex[:12]
+
+    columns = []
+    for (i, name) in enumerate(df.columns):
+        series = df[name]
+        column = {"name": name}
+        if (isinstance(series.dtype, pandas.CategoricalDtype)
+                or not pandas.api.types.is_numeric_dtype(series.dtype)):
+            categorical = pandas.Categorical(series)
+            values = categorical.codes
+            column["kind"] = "strings"
+            column["strings"] = [str(value) for value in categorical.categories]
+        elif (isinstance(series.array, tuple(MASKED_ARRAY_TYPES.values()))):
+            values = series.to_numpy(dtype = series.dtype.numpy_dtype, na_value = 0)
+            column["kind"] = "masked"
+            column["mask_file"] = "%s-%d.mask.npy" % (build_id, i)
+            numpy.save(
+                os.path.join(directory, column["mask_file"]),
+                series.isna().to_numpy()
+            )
+        else:
+            values = series.to_numpy()
+            column["kind"] = "numeric"
+        column["file"] = "%s-%d.npy" % (build_id, i)
+        numpy.save(os.path.join(directory, column["file"]), values)
+        columns.append(column)
+
+    write_manifest(directory, {
+        "version": CACHE_VERSION,
+        "source": {
+            "path": os.path.abspath(path),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": source_sha256,
+        },
+        "build_id": build_id,
+        "build_key": build_key,
+        "n_rows": len(df),
+        "columns": columns,
+    })
+
+    # Remove the column files of previous builds: those that the new manifest
+    # doesn't refer to and that were written before it
+    manifest_mtime = os.stat(os.path.join(directory, MANIFEST_FILE)).st_mtime_ns
+    referenced = set()
+    for column in columns:
+        referenced.add(column["file"])
+        if ("mask_file" in column):
+            referenced.add(column["mask_file"])
+    for filename in os.listdir(directory):
+        if ((not filename.endswith(".npy")) or (filename in referenced)):
+            continue
+        file_path = os.path.join(directory, filename)
+        try:
+            if (os.stat(file_path).st_mtime_ns < manifest_mtime):
+                os.remove(file_path)
+        except OSError:
+            pass
+
+# Load a cache entry as a DataFrame whose columns are memory-mapped arrays
+def read(directory, manifest):
+    columns = {}
+    for column in manifest["columns"]:
+        values = numpy.load(os.path.join(directory, column["file"]), mmap_mode = "r")
+        if (column["kind"] == "strings"):
+            values = pandas.Categorical.from_codes(values, categories = column["strings"])
+        elif (column["kind"] == "masked"):
+            values = MASKED_ARRAY_TYPES[values.dtype.kind](
+                values,
+                numpy.load(os.path.join(directory, column["mask_file"]), mmap_mode = "r")
+            )
+        columns[column["name"]] = values
+    return pandas.DataFrame(columns, copy = False)
+
+# Load a CSV file through the cache, building or rebuilding the cache entry
+# with build(path) if it is missing or stale. build_key is any JSON value that
+# describes how build parses the file (e.g. its dtypes); entries built with a
+# different build_key are rebuilt. The returned columns are memory-mapped, so
+# they stay readable if the entry is rebuilt afterwards.
+def load(path, cache_dir, build = pandas.read_csv, build_key = None):
+    # compare build keys as they will read back from the manifest, e.g. with
+    # tuples turned into lists
+    build_key = json.loads(json.dumps(build_key))
+    directory = entry_dir(path, cache_dir)
+    os.makedirs(directory, exist_ok = True)
+    with locked(directory, exclusive = False):
+        manifest = read_manifest(directory)
+        if (is_fresh(directory, manifest, path, build_key)):
+            return read(directory, manifest)
+
+    # another process may have built the entry while this one waited for the
+    # lock, so check again before building it
+    with locked(directory):
+        manifest = read_manifest(directory)
+        if (not is_fresh(directory, manifest, path, build_key)):
+            write(build(path), path, cache_dir, build_key)
+            manifest = read_manifest(directory)
+        return read(directory, manifest)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+# Crash reports for the posting loop, sent to Slack without holding it up.
+# Reports are put on a queue and uploaded by a background thread, so a slow or
+# unavailable Slack doesn't delay the bot's recovery. Each report is
+# fingerprinted by its stack trace (the exception type and the file, function
+# and line of each frame, but not the message, which often holds a parcel's
+# details). The first crash with a fingerprint is uploaded as it happens;
+# further crashes with the same fingerprint, and any crash that would go over
+# the upload rate limit, are grouped into a digest that is uploaded every so
+# often, with a count and the latest stack trace for each fingerprint. Run on
+# its own, this sends a burst of crashes to a slow stand-in for Slack and
+# reports how long the reporting took and what was uploaded.
+#
+# usage: ./crash_reports.py [-n CRASHES] [--latency SECONDS]
+
+import argparse
+import collections
+import hashlib
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+# Return the fingerprint of an exception's stack trace, from sys.exc_info() by
+# default
+def trace_fingerprint(exc_type = None, tb = None):
+    if (exc_type is None):
+        (exc_type, _, tb) = sys.exc_info()
+    digest = hashlib.sha1(("%s.%s" % (exc_type.__module__, exc_type.__qualname__)).encode("utf-8"))
+    for frame in traceback.extract_tb(tb):
+        digest.update(("\n%s:%s:%d" % (
+            os.path.basename(frame.filename), frame.name, frame.lineno
+        )).encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+# Return a time as a short UTC string for a digest
+def format_time(seconds):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))
+
+# A report waiting to be uploaded
+Report = collections.namedtuple("Report", ["time", "fingerprint", "comment", "content"])
+
+# Crashes with one fingerprint waiting to go in a digest
+class Group(object):
+
+    def __init__(self, report):
+        self.count = 0
+        self.first = report.time
+        self.add(report)
+
+    def add(self, report):
+        self.count += 1
+        self.last = report.time
+        self.latest = report
+
+class CrashReporter(object):
+
+    # slack: object with slack.WebClient's files_upload
+    # channel: Slack channel to upload to
+    # digest_seconds: seconds to hold grouped crashes for before uploading
+    #   them in a digest
+    # quiet_seconds: seconds after a fingerprint was last uploaded on its own
+    #   before a crash with it is uploaded on its own again
+    # max_uploads: most uploads to make in any rate_seconds
+    # queue_size: most reports to hold on the queue; reports made while it is
+    #   full are counted and dropped
+    # background: upload from a background thread; otherwise, each report is
+    #   handled as it is made, so that a replay on a virtual clock is the same
+    #   every time
+    # clock: function returning the current time in seconds
+    def __init__(self, slack, channel, digest_seconds = 60 * 60, quiet_seconds = 24 * 60 * 60,
+                 max_uploads = 6, rate_seconds = 60 * 60, queue_size = 1000,
+                 background = True, clock = time.time, log = print):
+        self.slack = slack
+        self.channel = channel
+        self.digest_seconds = digest_seconds
+        self.quiet_seconds = quiet_seconds
+        self.max_uploads = max_uploads
+        self.rate_seconds = rate_seconds
+        self.clock = clock
+        self.log = log
+        self.stats = collections.Counter(
+            reports = 0, uploads = 0, digests = 0, grouped = 0, dropped = 0, errors = 0
+        )
+        # fingerprint -> time a crash with it was last uploaded on its own
+        self.uploaded = {}
+        # fingerprint -> Group, in the order they were first seen
+        self.pending = collections.OrderedDict()
+        # number of the dropped reports that were counted in a digest
+        self.dropped = 0
+        # times of the uploads in the last rate_seconds
+        self.upload_times = collections.deque()
+
+        self.queue = queue.Queue(maxsize = queue_size)
+        self.thread = None
+        if (background):
+            self.thread = threading.Thread(target = self.work, name = "crash-reports", daemon = True)
+            self.thread.start()
+
+    # Report a crash, returning at once. fingerprint defaults to that of the
+    # exception being handled.
+    def report(self, comment, content, fingerprint = None):
+        if (fingerprint is None):
+            fingerprint = trace_fingerprint()
+        report = Report(self.clock(), fingerprint, comment, content)
+        self.stats["reports"] += 1
+        if (self.thread is None):
+            self.handle(report)
+            return
+        try:
+            self.queue.put_nowait(report)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def work(self):
+        while (True):
+            try:
+                report = self.queue.get(timeout = 1.0)
+            except queue.Empty:
+                self.send_digest(self.clock())
+                continue
+            if (report is None):
+                return
+            self.handle(report)
+
+    def handle(self, report):
+        last_uploaded = self.uploaded.get(report.fingerprint)
+        repeat = (last_uploaded is not None) and (report.time - last_uploaded < self.quiet_seconds)
+        if ((not repeat) and (report.fingerprint not in self.pending) and self.can_upload(report.time)):
+            comment = "%s (crash %s; repeats will be grouped into a digest)" % (
+                report.comment, report.fingerprint
+            )
+            if (self.upload(report.time, comment, report.content)):
+                self.uploaded[report.fingerprint] = report.time
+                self.send_digest(report.time)
+                return
+        if (report.fingerprint in self.pending):
+            self.pending[report.fingerprint].add(report)
+        else:
+            self.pending[report.fingerprint] = Group(report)
+        self.stats["grouped"] += 1
+        self.send_digest(report.time)
+
+    # True if an upload at now would stay within the rate limit
+    def can_upload(self, now):
+        while ((len(self.upload_times) > 0) and (now - self.upload_times[0] >= self.rate_seconds)):
+            self.upload_times.popleft()
+        return len(self.upload_times) < self.max_uploads
+
+    # Upload a report to Slack, returning True if it was uploaded
+    def upload(self, now, comment, content):
+        self.upload_times.append(now)
+        try:
+            self.slack.files_upload(
+                channels = self.channel,
+                initial_comment = comment,
+                content = content
+            )
+        except Exception:
+            self.stats["errors"] += 1
+            self.log("Failed to send a crash report to Slack:\n%s" % traceback.format_exc())
+            return False
+        self.stats["uploads"] += 1
+        return True
+
+    # Upload the grouped crashes as one digest once the oldest has been held
+    # for digest_seconds, or regardless if force
+    def send_digest(self, now, force = False):
+        dropped = self.stats["dropped"] - self.dropped
+        if (force):
+            if ((len(self.pending) == 0) and (dropped == 0)):
+                return
+        else:
+            if (len(self.pending) == 0):
+                return
+            first = min(group.first for group in self.pending.values())
+            if ((now - first < self.digest_seconds) or (not self.can_upload(now))):
+                return
+
+        groups = list(self.pending.items())
+        if (len(groups) > 0):
+            comment = "bariexplorer crash digest: %d crashes with %d different stack traces since %s" % (
+                sum(group.count for (_, group) in groups), len(groups),
+                format_time(min(group.first for (_, group) in groups))
+            )
+        else:
+            comment = "bariexplorer crash digest"
+        if (dropped > 0):
+            comment = "%s, and %d crash reports dropped while the queue was full" % (comment, dropped)
+        sections = []
+        for (fingerprint, group) in groups:
+            sections.append("crash %s: %d times from %s to %s\n%s\n\n%s" % (
+                fingerprint, group.count, format_time(group.first), format_time(group.last),
+                group.latest.comment, group.latest.content
+            ))
+        if (self.upload(now, comment, "\n\n".join(sections))):
+            self.stats["digests"] += 1
+            self.pending.clear()
+            self.dropped += dropped
+
+    # Upload any reports still queued and any grouped crashes, waiting up to
+    # timeout seconds for the background thread, then stop it
+    def close(self, timeout = 30):
+        if (self.thread is not None):
+            try:
+                self.queue.put(None, timeout = timeout)
+            except queue.Full:
+                pass
+            self.thread.join(timeout)
+            if (self.thread.is_alive()):
+                return
+            self.thread = None
+        self.send_digest(self.clock(), force = True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+if (__name__ == "__main__"):
+    import synthetic
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--crashes", type = int, default = 100)
+    parser.add_argument("--latency", type = float, default = 0.5,
+                        help = "seconds the stand-in for Slack takes to upload a file")
+    args = parser.parse_args()
+
+    slack = synthetic.StubSlackClient(latency = args.latency)
+    reporter = CrashReporter(slack, "#crashes", log = lambda message: None)
+    started = time.perf_counter()
+    for i in range(args.crashes):
+        try:
+            if (i % 3 == 0):
+                raise FileNotFoundError("./tract_rent_maps/%d.png" % i)
+            else:
+                int(None)
+        except Exception:
+            reporter.report("bariexplorer crashed! Stack trace attached.", traceback.format_exc())
+    reported = time.perf_counter() - started
+    reporter.close()
+    closed = time.perf_counter() - started
+
+    print("%d crashes reported in %0.4f seconds (%0.1f microseconds each); all uploaded after %0.2f seconds" % (
+        args.crashes, reported, reported / args.crashes * 1e6, closed
+    ))
+    print(", ".join("%s: %d" % item for item in sorted(reporter.stats.items())))
+    for upload in slack.uploads:
+        print("  %s" % upload["initial_comment"])
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# Render the complete thread for every parcel, without tweeting anything, so
+# that a whole data release can be reviewed before it goes live. Each record
+# holds the main tweet and every reply variant. The parcels are split into
+# contiguous shards that are rendered on a process pool and concatenated in
+# order, so the output is the same from run to run.
+#
+# usage: ./export.py [-o threads.jsonl] [-s SHARDS] [-p PROCESSES]
+
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+import pandas
+
+import bot
+
+# Number of rows each worker renders between progress reports
+EXPORT_CHUNK_SIZE = 1000
+
+# Render the thread for every row of a chunk of parcels, returning a list of
+# dicts. The main tweets are rendered with the batch renderer where possible;
+# if that fails (e.g. because of one malformed row), each row is rendered on
+# its own so that the error is recorded against that row only.
+def render_chunk(chunk):
+    try:
+        (messages, picture_addresses) = bot.render_parcel_tweets(chunk)
+        mains = [
+            {"message": message, "picture_address": picture_address}
+            for (message, picture_address) in zip(messages, picture_addresses)
+        ]
+    except Exception:
+        mains = []
+        for (_, row) in bot.parcel_records(chunk):
+            try:
+                (message, picture_address) = bot.render_parcel_tweet(row)
+                mains.append({"message": message, "picture_address": picture_address})
+            except Exception as error:
+                mains.append({"error": repr(error)})
+
+    records = []
+    for ((index, row), main) in zip(bot.parcel_records(chunk), mains):
+        replies = {}
+        for tweet_generator in bot.REPLY_GENERATORS:
+            try:
+                replies[tweet_generator.__name__] = tweet_generator(row)
+            except Exception as error:
+                replies[tweet_generator.__name__] = {"error": repr(error)}
+        records.append({
+            "index": int(index),
+            "Land_Parcel_ID": int(row["Land_Parcel_ID"]),
+            "skip": bot.skip_row(row) or None,
+            "main": main,
+            "replies": replies,
+        })
+    return records
+
+# Yield the rows [start, stop) of the parcels in chunks, read the same way as
+# the bot reads them (see bot.parcel_chunks): from the binary cache if
+# cache_dir is set and otherwise by streaming the CSV file from offset, the
+# byte offset of row start
+def shard_chunks(parcels_path, cache_dir, start, stop, offset):
+    for (chunk, _) in bot.parcel_chunks(
+            parcels_path, cache_dir, start, stop, offset, chunk_size = EXPORT_CHUNK_SIZE):
+        yield chunk
+
+# Render one shard of the parcels to a JSON lines file, reporting progress as
+# (shard, rows done, rows in shard) tuples on the progress queue. Runs in a
+# worker process; the generators' diagnostic output is discarded.
+def export_shard(shard, parcels_path, cache_dir, start, stop, offset, output_path, progress):
+    bot.DATA.cache_dir = cache_dir
+    bot.DATA.parcels_path = parcels_path
+    done = 0
+    with open(output_path, "w") as f, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            for chunk in shard_chunks(parcels_path, cache_dir, start, stop, offset):
+                for record in render_chunk(chunk):
+                    f.write(json.dumps(record) + "\n")
+                done += len(chunk)
+                progress.put((shard, done, stop - start))
+    return output_path
+
+# Flatten export records into a DataFrame with one column per field, for
+# writing to Parquet
+def records_to_frame(records):
+    return pandas.json_normalize(records)
+
+def export(output_path, parcels_path = bot.INPUT_PARCELS, cache_dir = bot.CACHE_DIR,
+           shards = None, processes = None):
+    processes = processes if (processes is not None) else os.cpu_count()
+    shards = shards if (shards is not None) else processes
+
+    # Row offsets are needed to stream shards from the CSV file; with the cache,
+    # building it here means the workers only ever read it
+    if (cache_dir is not None):
+        (df, offsets) = bot.load_cached_parcels(parcels_path, cache_dir)
+        del df
+        bot.DATA.cache_dir = cache_dir
+        bot.DATA.parcels_path = parcels_path
+        bot.DATA.preload()
+    else:
+        offsets = bot.parcel_offsets(parcels_path)
+    n_rows = len(offsets)
+    with open(parcels_path, "rb") as f:
+        bot.read_csv_record(f)
+        first_offset = f.tell()
+
+    bounds = [n_rows * shard // shards for shard in range(shards + 1)]
+    parts = [
+        "%s.shard-%05d.jsonl" % (output_path, shard)
+        for shard in range(shards)
+    ]
+
+    started = time.perf_counter()
+    with multiprocessing.Manager() as manager:
+        progress = manager.Queue()
+        with concurrent.futures.ProcessPoolExecutor(max_workers = processes) as executor:
+            futures = [
+                executor.submit(
+                    export_shard, shard, parcels_path, cache_dir,
+                    bounds[shard], bounds[shard + 1],
+                    offsets[bounds[shard] - 1] if (bounds[shard] > 0) else first_offset,
+                    parts[shard], progress
+                )
+                for shard in range(shards)
+            ]
+            while (not all(future.done() for future in futures)):
+                try:
+                    (shard, done, total) = progress.get(timeout = 0.5)
+                    print("shard %d: %d/%d rows" % (shard, done, total), file = sys.stderr)
+                except queue.Empty:
+                    pass
+            for future in futures:
+                future.result() # re-raise any worker errors
+
+    # Concatenate the shards in order
+    if (output_path.endswith(".parquet")):
+        records = []
+        for part in parts:
+            with open(part, "r") as f:
+                records.extend(json.loads(line) for line in f)
+        records_to_frame(records).to_parquet(output_path, index = False)
+    else:
+        with open(output_path, "w") as output:
+            for part in parts:
+                with open(part, "r") as f:
+                    for line in f:
+                        output.write(line)
+    for part in parts:
+        os.remove(part)
+
+    print("exported %d parcels in %0.1f seconds" % (
+        n_rows, time.perf_counter() - started
+    ), file = sys.stderr)
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-o", "--output", default = "threads.jsonl",
+        help = "file to write to: JSON lines, or Parquet if it ends in .parquet (requires pyarrow)"
+    )
+    parser.add_argument("-i", "--parcels", default = bot.INPUT_PARCELS)
+    parser.add_argument("-s", "--shards", type = int, default = None)
+    parser.add_argument("-p", "--processes", type = int, default = None)
+    parser.add_argument("--no-cache", dest = "no_cache", action = "store_true", default = False)
+    args = parser.parse_args()
+
+    export(
+        args.output, args.parcels,
+        cache_dir = None if (args.no_cache) else bot.CACHE_DIR,
+        shards = args.shards, processes = args.processes
+    )
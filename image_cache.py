@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+# On-disk cache of Google Street View images. Images are stored under a hash of
+# the normalised location string and the requested image size, so parcels that
+# share an address or centroid (e.g. condos in the same building) reuse the
+# same download. The cache is capped at a total size in bytes, evicting the
+# least recently used images first, and images are fetched through a backend
+# so that the Google API can be swapped out for a local directory or server.
+# Several processes can share a cache directory: an image any of them
+# downloaded is a hit for the others, and the total size of the images is kept
+# in a file in the directory that is only updated under an exclusive POSIX
+# lock. Images are only evicted under the same lock, by rescanning the
+# directory, so every process evicts by the same total and the same order.
+
+import collections
+import contextlib
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+IMAGE_EXTENSION = ".jpg"
+LOCK_FILE = "cache.lock"
+SIZE_FILE = "cache.size"
+
+# Normalise a location string so that trivially different spellings of the
+# same address share a cache entry
+def normalize_location(location):
+    return re.sub(r"\s+", " ", location).strip().lower()
+
+# Return the cache key for a location and image size, e.g. "1200x675"
+def cache_key(location, size):
+    return hashlib.sha256(
+        ("%s|%s" % (normalize_location(location), size)).encode("utf-8")
+    ).hexdigest()
+
+# Fetches images from the Google Street View API through google_streetview.
+# The library only downloads an image when the metadata reports that one
+# exists for the location.
+class GoogleStreetViewBackend(object):
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def fetch(self, location, size):
+        import google_streetview.api
+
+        download_dir = tempfile.mkdtemp(prefix = "gsv_")
+        try:
+            google_streetview.api\
+                .results([{
+                    "size": size,
+                    "location": location,
+                    "key": self.api_key
+                }])\
+                .download_links(download_dir)
+            image_path = os.path.join(download_dir, "gsv_0.jpg")
+            if (not os.path.isfile(image_path)):
+                return None
+            with open(image_path, "rb") as f:
+                return f.read()
+        finally:
+            shutil.rmtree(download_dir, ignore_errors = True)
+
+# Fetches images from a directory, for tests and offline runs. The image for a
+# location is the file named after the URL-quoted normalised location, e.g.
+# "72%20day%20st.%2C%20boston.jpg"; locations with no such file have no image.
+class DirectoryBackend(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path_for(self, location):
+        return os.path.join(
+            self.directory,
+            urllib.parse.quote(normalize_location(location), safe = "") + IMAGE_EXTENSION
+        )
+
+    def fetch(self, location, size):
+        try:
+            with open(self.path_for(location), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+# Fetches images over HTTP from a server that takes the same "location" and
+# "size" query parameters as the Street View Static API, such as a local
+# stand-in server. A 404 response means there is no image for the location.
+class HTTPBackend(object):
+
+    def __init__(self, url, params = None, timeout = 30):
+        self.url = url
+        self.params = params if (params is not None) else {}
+        self.timeout = timeout
+
+    def fetch(self, location, size):
+        query = dict(self.params, location = location, size = size)
+        url = "%s?%s" % (self.url, urllib.parse.urlencode(query))
+        try:
+            with urllib.request.urlopen(url, timeout = self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as error:
+            if (error.code == 404):
+                return None
+            raise
+
+class StreetViewCache(object):
+
+    def __init__(self, directory, max_bytes, backend):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.stats = collections.Counter(hits = 0, misses = 0, evictions = 0)
+        self.lock = threading.Lock() # guards entries, total_bytes and stats
+        os.makedirs(directory, exist_ok = True)
+
+        # cache key -> size in bytes, from least to most recently used, as of
+        # the last scan of the directory; the order is recovered from the
+        # files' modification times, which are updated on every hit
+        self.entries = collections.OrderedDict()
+        # total size of the images, as of the last addition by any process
+        self.total_bytes = 0
+        with self.lock, self.directory_locked():
+            self.evict()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + IMAGE_EXTENSION)
+
+    # Hold the exclusive lock on the directory, which is shared with other
+    # processes, while reading or changing its images or its size file
+    @contextlib.contextmanager
+    def directory_locked(self):
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as f:
+            fcntl.lockf(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+
+    # Return the total size of the images recorded in the size file, or None
+    # if there isn't one. Called with the directory lock held, as is
+    # write_total.
+    def read_total(self):
+        try:
+            with open(os.path.join(self.directory, SIZE_FILE), "r") as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def write_total(self, total):
+        path = os.path.join(self.directory, SIZE_FILE)
+        temp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        with open(temp_path, "w") as f:
+            f.write("%d" % total)
+        os.replace(temp_path, path)
+        self.total_bytes = total
+
+    # Rebuild entries from the images in the directory, returning their total
+    # size. Called with both locks held.
+    def scan(self):
+        images = []
+        for filename in os.listdir(self.directory):
+            if (filename.endswith(IMAGE_EXTENSION)):
+                try:
+                    stat = os.stat(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    continue
+                images.append((stat.st_mtime, filename[:-len(IMAGE_EXTENSION)], stat.st_size))
+        self.entries = collections.OrderedDict(
+            (key, size) for (_, key, size) in sorted(images)
+        )
+        return sum(self.entries.values())
+
+    # Return the path to the cached image for a location, fetching it from the
+    # backend if it isn't cached. Returns None if the backend has no image for
+    # the location.
+    def get(self, location, size):
+        key = cache_key(location, size)
+        path = self.path_for(key)
+
+        # the image may have been downloaded, or removed, by another process
+        # sharing the directory, so the file is checked rather than entries
+        with self.lock:
+            try:
+                os.utime(path)
+                self.stats["hits"] += 1
+                if (key in self.entries):
+                    self.entries.move_to_end(key)
+                return path
+            except FileNotFoundError:
+                pass
+            self.stats["misses"] += 1
+
+        # the download happens outside of the locks, so that other threads and
+        # processes can use the cache in the meantime
+        image = self.backend.fetch(location, size)
+        if (not image):
+            return None
+
+        # write to a temporary file and rename, so that a crash mid-write
+        # never leaves a truncated image in the cache
+        temp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        with open(temp_path, "wb") as f:
+            f.write(image)
+
+        with self.lock, self.directory_locked():
+            added = not os.path.isfile(path) # another process may have added it
+            os.replace(temp_path, path)
+            total = self.read_total()
+            if (total is None):
+                total = self.scan()
+            elif (added):
+                total += len(image)
+            self.entries[key] = len(image)
+            self.entries.move_to_end(key)
+            if (total > self.max_bytes):
+                self.evict(keep = key)
+            else:
+                self.write_total(total)
+        return path
+
+    # Remove least recently used images until the cache fits in max_bytes,
+    # never removing the image with the given key, and record the new total
+    # size. The images are counted from the directory, so that images added
+    # or removed by other processes sharing it are accounted for. Called with
+    # both locks held.
+    def evict(self, keep = None):
+        total = self.scan()
+        for key in list(self.entries):
+            if (total <= self.max_bytes):
+                break
+            if (key == keep):
+                continue
+            total -= self.entries.pop(key)
+            self.stats["evictions"] += 1
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+        self.write_total(total)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+# Append-only journal of the posting loop's progress. Each stage of posting a
+# parcel's thread is appended as a JSON line and fsync'd before the loop moves
+# on: "rendered" (with the thread's text and the paths of its images),
+# "main_posted" and "reply_posted" (with the IDs of the statuses), or
+# "abandoned" if the loop gave up on the thread. Because a thread's records
+# are contiguous and at the end of the file, the bot's position and any
+# half-posted thread are read back from the last few kilobytes of the
+# journal, however long it is. A write torn by a crash only ever damages the
+# last line, which is dropped. The journal is compacted down to the last
+# thread's records every so often.
+
+import collections
+import json
+import os
+import time
+
+# Bytes read from the end of the journal to find the last thread's records
+TAIL_BYTES = 64 * 1024
+
+# Stages after which a thread needs nothing more posting
+FINISHED_STAGES = set(["reply_posted", "abandoned"])
+
+# Stand-in for a posted status, for replying to a main tweet posted before the
+# bot restarted
+PostedStatus = collections.namedtuple("PostedStatus", ["id"])
+
+# Return the (offset, bytes) of the end of a file, starting at a line boundary
+# unless the tail starts at the beginning of the file
+def read_tail(f, size = TAIL_BYTES):
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    start = max(0, end - size)
+    f.seek(start)
+    data = f.read()
+    if (start > 0):
+        newline = data.find(b"\n")
+        data = data[newline + 1:] if (newline >= 0) else b""
+        start = end - len(data)
+    return (start, data)
+
+# Parse the complete, well-formed records in the tail of a journal, returning
+# them along with the length of the tail up to the end of the last complete
+# line
+def parse_tail(data):
+    complete = data.rfind(b"\n") + 1
+    records = []
+    for line in data[:complete].splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            records = [] # a torn line can only be the last; start again after it
+    return (records, complete)
+
+# Return the records of the last thread in the journal at path, oldest first,
+# or an empty list if there is no journal
+def last_thread_records(path):
+    if (not os.path.isfile(path)):
+        return []
+    with open(path, "rb") as f:
+        (_, data) = read_tail(f)
+    (records, _) = parse_tail(data)
+    if (len(records) == 0):
+        return []
+    index = records[-1]["index"]
+    first = len(records)
+    while ((first > 0) and (records[first - 1]["index"] == index)):
+        first -= 1
+    return records[first:]
+
+# Return the (index, next_offset) of the last row in the journal at path, in
+# the same format as the bot's status file, or (None, None) if there isn't one
+def position(path):
+    records = last_thread_records(path)
+    if (len(records) == 0):
+        return (None, None)
+    return (records[-1]["index"], records[-1]["next_offset"])
+
+class Journal(object):
+
+    # path: the journal file, created if it doesn't exist
+    # compact_every: number of records to append between compactions
+    # clock: function returning the time to record with each stage
+    def __init__(self, path, compact_every = 1000, clock = time.time):
+        self.path = path
+        self.compact_every = compact_every
+        self.clock = clock
+        self.appended = 0
+        self.fd = None
+        self.open()
+
+    # Open the journal for appending, first cutting off a torn last line
+    def open(self):
+        if (os.path.isfile(self.path)):
+            with open(self.path, "r+b") as f:
+                (start, data) = read_tail(f)
+                (_, complete) = parse_tail(data)
+                if (complete < len(data)):
+                    f.truncate(start + complete)
+                    f.flush()
+                    os.fsync(f.fileno())
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def close(self):
+        if (self.fd is not None):
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Append a record of a thread reaching a stage, returning once it is on
+    # disk
+    def record(self, index, next_offset, land_parcel_id, stage, **fields):
+        record = {
+            "index": int(index),
+            "next_offset": int(next_offset) if (next_offset is not None) else None,
+            "Land_Parcel_ID": int(land_parcel_id),
+            "stage": stage,
+            "time": self.clock(),
+        }
+        record.update(fields)
+        os.write(self.fd, (json.dumps(record) + "\n").encode("utf-8"))
+        os.fsync(self.fd)
+
+        self.appended += 1
+        if (self.appended >= self.compact_every):
+            self.compact()
+
+    # Rewrite the journal with only the last thread's records
+    def compact(self):
+        records = last_thread_records(self.path)
+        tmp_path = "%s.tmp" % self.path
+        with open(tmp_path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()
+        os.replace(tmp_path, self.path)
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self.open()
+        self.appended = 0
+
+    # Return the last thread in the journal if it was rendered but not
+    # finished, as a dict with the keys "index", "next_offset",
+    # "Land_Parcel_ID", "thread", the thread as recorded at the "rendered"
+    # stage, and "posted", holding a PostedStatus under "main" if the main
+    # tweet was posted. Returns None if there is no such thread.
+    def pending_thread(self):
+        records = last_thread_records(self.path)
+        stages = {record["stage"]: record for record in records}
+        if ((len(FINISHED_STAGES & set(stages)) > 0) or ("rendered" not in stages)):
+            return None
+        posted = {"rendered": True}
+        if ("main_posted" in stages):
+            status_id = stages["main_posted"].get("status_id")
+            posted["main"] = PostedStatus(status_id) if (status_id is not None) else None
+        return {
+            "index": records[-1]["index"],
+            "next_offset": records[-1]["next_offset"],
+            "Land_Parcel_ID": records[-1]["Land_Parcel_ID"],
+            "thread": stages["rendered"]["thread"],
+            "posted": posted,
+        }
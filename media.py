@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Media uploads for the posting loop. The images of a status are uploaded in
+# parallel, and the media ID of each upload is cached by the SHA-256 hash of
+# the file's contents until shortly before Twitter expires it, so that the
+# neighborhood and tract maps, which a handful of files cover the whole city
+# with, are only uploaded once a day rather than with every reply.
+
+import collections
+import concurrent.futures
+import hashlib
+import os
+import threading
+import time
+
+class MediaUploader(object):
+
+    # upload: function taking a file path and returning an object with a
+    #   media_id, such as tweepy.API.media_upload
+    # ttl: seconds to reuse a media ID for after uploading it
+    # workers: maximum number of uploads to run at once
+    # clock: function returning the current time in seconds
+    def __init__(self, upload, ttl = 23 * 60 * 60, workers = 4, clock = time.time):
+        self.upload_file = upload
+        self.ttl = ttl
+        self.workers = workers
+        self.clock = clock
+        self.lock = threading.Lock()
+        # content hash -> (media_id, time uploaded)
+        self.media_ids = {}
+        # path -> ((size, mtime), content hash), so unchanged files aren't
+        # hashed again
+        self.hashes = {}
+        self.stats = collections.Counter(hits = 0, misses = 0, expired = 0)
+        self.executor = None
+
+    def content_hash(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = self.hashes.get(path)
+        if ((cached is not None) and (cached[0] == signature)):
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        self.hashes[path] = (signature, digest.hexdigest())
+        return self.hashes[path][1]
+
+    # Return the cached media ID for a content hash, or None if there isn't
+    # one or it has expired
+    def cached_media_id(self, content_hash, now):
+        with self.lock:
+            entry = self.media_ids.get(content_hash)
+            if (entry is None):
+                self.stats["misses"] += 1
+                return None
+            (media_id, uploaded) = entry
+            if (now - uploaded >= self.ttl):
+                del self.media_ids[content_hash]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return media_id
+
+    # Upload the files at paths, returning a list of (media_id, reused) tuples
+    # in the same order, where reused is True if the file had already been
+    # uploaded and its media ID was taken from the cache
+    def upload(self, paths):
+        self.prune()
+        now = self.clock()
+        hashes = [self.content_hash(path) for path in paths]
+        results = {}
+        pending = {}
+        for (path, content_hash) in zip(paths, hashes):
+            if ((content_hash in results) or (content_hash in pending)):
+                continue
+            media_id = self.cached_media_id(content_hash, now)
+            if (media_id is not None):
+                results[content_hash] = (media_id, True)
+            else:
+                pending[content_hash] = path
+
+        # Uploads that succeed are cached even if another one fails, so that
+        # retrying the status doesn't upload them again
+        uploaded = {}
+        error = None
+        if ((len(pending) <= 1) or (self.workers <= 1)):
+            for (content_hash, path) in pending.items():
+                try:
+                    uploaded[content_hash] = self.upload_file(path).media_id
+                except Exception as upload_error:
+                    error = error or upload_error
+                    break
+        else:
+            if (self.executor is None):
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers = self.workers, thread_name_prefix = "media_upload"
+                )
+            futures = {
+                content_hash: self.executor.submit(self.upload_file, path)
+                for (content_hash, path) in pending.items()
+            }
+            for (content_hash, future) in futures.items():
+                try:
+                    uploaded[content_hash] = future.result().media_id
+                except Exception as upload_error:
+                    error = error or upload_error
+
+        uploaded_at = self.clock()
+        with self.lock:
+            for (content_hash, media_id) in uploaded.items():
+                self.media_ids[content_hash] = (media_id, uploaded_at)
+                results[content_hash] = (media_id, False)
+        if (error is not None):
+            raise error
+        return [results[content_hash] for content_hash in hashes]
+
+    # Forget media IDs that have expired
+    def prune(self):
+        now = self.clock()
+        with self.lock:
+            for (content_hash, (_, uploaded)) in list(self.media_ids.items()):
+                if (now - uploaded >= self.ttl):
+                    del self.media_ids[content_hash]
+                    self.stats["expired"] += 1
+
+    def close(self):
+        if (self.executor is not None):
+            self.executor.shutdown(wait = True)
+            self.executor = None
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# Structured timings for the posting loop. Each posting cycle produces one
+# record holding the row index, Land_Parcel_ID, reply generator, outcome and
+# the seconds spent in each stage of the cycle (see runner.py). Records are
+# appended to a JSON lines file, and running totals across all cycles are
+# rewritten to a Prometheus text format file after each cycle, for
+# node_exporter's textfile collector to scrape.
+
+import collections
+import json
+import os
+import re
+import uuid
+
+# Upper bounds, in seconds, of the buckets of the stage duration histograms
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Prefix of every metric name
+NAMESPACE = "bariexplorer"
+
+# Return a list of (stage, seconds, threshold) tuples for the stages that took
+# longer than their threshold, slowest first
+def slow_stages(stages, thresholds):
+    slow = [
+        (name, seconds, thresholds[name])
+        for (name, seconds) in stages.items()
+        if ((name in thresholds) and (seconds > thresholds[name]))
+    ]
+    return sorted(slow, key = lambda stage: -stage[1])
+
+# Format a cycle's stage timings for a crash report, one line per stage, with
+# the slow ones marked
+def format_stages(cycle, thresholds):
+    lines = ["Stage timings for row %d (Land_Parcel_ID %d):" % (
+        cycle["index"], cycle["Land_Parcel_ID"]
+    )]
+    for (name, seconds) in cycle["stages"].items():
+        line = "  %s: %0.3f seconds" % (name, seconds)
+        if ((name in thresholds) and (seconds > thresholds[name])):
+            line = "%s (SLOW, threshold %0.3f seconds)" % (line, thresholds[name])
+        lines.append(line)
+    return "\n".join(lines)
+
+# Return path with an ID inserted before its extension, for each of several
+# processes on a host (e.g. shard workers; see shards.py) to write its own
+# metrics, e.g. "./bariexplorer.prom" -> "./bariexplorer.worker_1.prom"
+def owner_path(path, owner):
+    (stem, extension) = os.path.splitext(path)
+    return "%s.%s%s" % (stem, re.sub(r"[^A-Za-z0-9_-]", "_", owner), extension)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class MetricsLog(object):
+
+    # jsonl_path: file to append one JSON record per cycle to, or None
+    # prom_path: Prometheus text file to rewrite after each cycle, or None
+    # labels: dict of labels to add to every Prometheus series, e.g. a
+    #   "worker" label telling apart several bots on a host
+    def __init__(self, jsonl_path = None, prom_path = None, labels = None):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.labels = dict(labels) if (labels is not None) else {}
+        self.cycles = collections.Counter()
+        # stage name -> [bucket counts, sum, count]
+        self.histograms = {}
+        self.last_stages = {}
+        self.gauges = {}
+        self.last_cycle_time = None
+
+    # Record a cycle: a dict with the keys "time", "index", "Land_Parcel_ID",
+    # "generator", "outcome" and "stages", the latter mapping stage names to
+    # seconds, and optionally "gauges", mapping metric names to their current
+    # values
+    def record(self, cycle):
+        self.cycles[cycle["outcome"]] += 1
+        self.gauges.update(cycle.get("gauges", {}))
+        self.last_cycle_time = cycle["time"]
+        self.last_stages = dict(cycle["stages"])
+        for (name, seconds) in cycle["stages"].items():
+            if (name not in self.histograms):
+                self.histograms[name] = [[0] * len(BUCKETS), 0.0, 0]
+            histogram = self.histograms[name]
+            for (i, bound) in enumerate(BUCKETS):
+                if (seconds <= bound):
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+        if (self.jsonl_path is not None):
+            with open(self.jsonl_path, "a") as f:
+                f.write(json.dumps(cycle) + "\n")
+        if (self.prom_path is not None):
+            self.write_prometheus(self.prom_path)
+
+    # Return the {...} label set of a series: the log's labels followed by
+    # the given (name, value) pairs, or "" if there are none
+    def labels_text(self, *pairs):
+        pairs = list(self.labels.items()) + list(pairs)
+        if (len(pairs) == 0):
+            return ""
+        return "{%s}" % ",".join(
+            "%s=\"%s\"" % (name, escape_label(value)) for (name, value) in pairs
+        )
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP %s_cycles_total Posting cycles by outcome." % NAMESPACE,
+            "# TYPE %s_cycles_total counter" % NAMESPACE,
+        ]
+        for (outcome, count) in sorted(self.cycles.items()):
+            lines.append("%s_cycles_total%s %d" % (
+                NAMESPACE, self.labels_text(("outcome", outcome)), count
+            ))
+
+        lines += [
+            "# HELP %s_stage_seconds Seconds spent in each stage of a posting cycle." % NAMESPACE,
+            "# TYPE %s_stage_seconds histogram" % NAMESPACE,
+        ]
+        for (name, (buckets, total, count)) in sorted(self.histograms.items()):
+            for (bound, bucket_count) in zip(BUCKETS, buckets):
+                lines.append("%s_stage_seconds_bucket%s %d" % (
+                    NAMESPACE, self.labels_text(("stage", name), ("le", bound)), bucket_count
+                ))
+            lines.append("%s_stage_seconds_bucket%s %d" % (
+                NAMESPACE, self.labels_text(("stage", name), ("le", "+Inf")), count
+            ))
+            lines.append("%s_stage_seconds_sum%s %f" % (
+                NAMESPACE, self.labels_text(("stage", name)), total
+            ))
+            lines.append("%s_stage_seconds_count%s %d" % (
+                NAMESPACE, self.labels_text(("stage", name)), count
+            ))
+
+        lines += [
+            "# HELP %s_last_stage_seconds Seconds spent in each stage of the last posting cycle." % NAMESPACE,
+            "# TYPE %s_last_stage_seconds gauge" % NAMESPACE,
+        ]
+        for (name, seconds) in sorted(self.last_stages.items()):
+            lines.append("%s_last_stage_seconds%s %f" % (
+                NAMESPACE, self.labels_text(("stage", name)), seconds
+            ))
+
+        for (name, value) in sorted(self.gauges.items()):
+            lines += [
+                "# TYPE %s_%s gauge" % (NAMESPACE, name),
+                "%s_%s%s %f" % (NAMESPACE, name, self.labels_text(), value),
+            ]
+
+        if (self.last_cycle_time is not None):
+            lines += [
+                "# HELP %s_last_cycle_timestamp_seconds Time the last posting cycle started." % NAMESPACE,
+                "# TYPE %s_last_cycle_timestamp_seconds gauge" % NAMESPACE,
+                "%s_last_cycle_timestamp_seconds%s %f" % (
+                    NAMESPACE, self.labels_text(), self.last_cycle_time
+                ),
+            ]
+        return "\n".join(lines) + "\n"
+
+    # node_exporter may read the file at any time, so write it to a temporary
+    # file, unique to this write, and move that into place
+    def write_prometheus(self, path):
+        tmp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    # Remove the Prometheus file, so that node_exporter stops publishing the
+    # metrics of a bot that has stopped
+    def close(self):
+        if (self.prom_path is not None):
+            try:
+                os.remove(self.prom_path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
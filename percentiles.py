@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Citywide percentile ranks of the tract and block group attributes, for the
+# reply tweets that compare a tract or block group with the rest of Boston.
+# Each column is ranked in one pass: its values are sorted once and the rank of
+# every row is found by binary search into the sorted values. A dataset's
+# ranks are computed on first use and kept for as long as the files it was
+# loaded from are unchanged, so the percentile columns no longer have to be
+# computed ahead of time.
+#
+# usage: ./percentiles.py DATASET COLUMN [COLUMN ...]
+
+import argparse
+import sys
+import threading
+
+import numpy
+import pandas
+
+# Suffix of the precomputed percentile columns of older attribute files, which
+# are used for columns whose values aren't in the file
+PRECOMPUTED_SUFFIX = "Pctile"
+
+# Number of versions of each dataset to keep ranks for
+VERSIONS_KEPT = 2
+
+# Return the percentile rank of each of values among the values of among (by
+# default, values themselves), from 0 to 1, with tied values given their
+# average rank like pandas' rank(pct = True) and missing values given NaN
+def percentile_ranks(values, among = None):
+    values = numpy.asarray(values, dtype = float)
+    among = values if (among is None) else numpy.asarray(among, dtype = float)
+    ordered = numpy.sort(among[~numpy.isnan(among)])
+    if (len(ordered) == 0):
+        return numpy.full(len(values), numpy.nan)
+    below = numpy.searchsorted(ordered, values, side = "left")
+    through = numpy.searchsorted(ordered, values, side = "right")
+    ranks = (below + through + 1) / (2 * len(ordered))
+    ranks[numpy.isnan(values)] = numpy.nan
+    return ranks
+
+# Return (ratio, more_less) for a percentile rank: the number of percentage
+# points between it and the median, and "more" or "less" for which side of the
+# median it is on
+def more_or_less(rank):
+    if (rank > 0.5):
+        return (int((rank - 0.5) * 100), "more")
+    else:
+        return (int((0.5 - rank) * 100), "less")
+
+# The percentile ranks of the columns of one version of a dataset, each
+# column ranked the first time one of its ranks is asked for
+class PercentileTable(object):
+
+    # frame: the dataset
+    # keys: the key of each row of frame, in order; where keys repeat, the
+    #   first row is used
+    def __init__(self, frame, keys):
+        self.frame = frame
+        self.positions = {}
+        for (position, key) in enumerate(keys):
+            self.positions.setdefault(key, position)
+        self.lock = threading.Lock()
+        # column -> array of the rank of each row
+        self.columns = {}
+
+    # Return the rank of every row in a column
+    def ranks(self, column):
+        with self.lock:
+            if (column not in self.columns):
+                if (column in self.frame.columns):
+                    values = pandas.to_numeric(self.frame[column], errors = "coerce")
+                    self.columns[column] = percentile_ranks(values.to_numpy(dtype = float, na_value = numpy.nan))
+                elif ((column + PRECOMPUTED_SUFFIX) in self.frame.columns):
+                    self.columns[column] = self.frame[column + PRECOMPUTED_SUFFIX].to_numpy(dtype = float)
+                else:
+                    raise KeyError("no column %r to rank" % column)
+            return self.columns[column]
+
+    # Return the rank of a column's value in the row with a key
+    def rank(self, column, key):
+        return self.ranks(column)[self.positions[key]]
+
+# (dataset name, version) -> PercentileTable, for the VERSIONS_KEPT most
+# recently built versions of each dataset
+TABLES = {}
+TABLES_LOCK = threading.Lock()
+
+# Return the PercentileTable for a version of a dataset, calling build to make
+# it if there isn't one. version is anything hashable that changes when the
+# dataset does.
+def table(name, version, build):
+    with TABLES_LOCK:
+        if ((name, version) not in TABLES):
+            TABLES[(name, version)] = build()
+            versions = [key for key in TABLES if (key[0] == name)]
+            for key in versions[:-VERSIONS_KEPT]:
+                del TABLES[key]
+        return TABLES[(name, version)]
+
+if (__name__ == "__main__"):
+    import bot
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset", choices = sorted(bot.DataContext.DATASETS))
+    parser.add_argument("columns", nargs = "+")
+    args = parser.parse_args()
+
+    frame = bot.DATA.frame(args.dataset)
+    ranks = bot.DATA.percentiles(args.dataset)
+    key_column = bot.DataContext.DATASETS[args.dataset][1]
+    output = pandas.DataFrame({key_column: frame[key_column]})
+    for column in args.columns:
+        output[column + PRECOMPUTED_SUFFIX] = ranks.ranks(column).round(4)
+    output.to_csv(sys.stdout, index = False)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+# A rate-limit-aware wrapper around tweepy.API for the posting loop. Each
+# rate-limited endpoint has a token bucket, refilled at the endpoint's
+# documented rate and corrected from the x-rate-limit-* headers of Twitter's
+# responses when there are any, so that calls wait for quota instead of being
+# rejected. Calls rejected with a 429 or 503 are retried after an exponential
+# backoff with full jitter. A status that turns out to have been posted
+# already (because an earlier attempt's response was lost) is looked up
+# rather than reported as an error, so a thread can be retried safely.
+
+import collections
+import html
+import random
+import re
+import threading
+
+# HTTP status codes to back off and retry on
+RETRY_STATUS_CODES = set([
+    429, # too many requests
+    503, # over capacity
+])
+
+# Twitter API error code for a status identical to a recent one
+DUPLICATE_STATUS_CODE = 187
+
+# t.co links that Twitter appends to the text of a status for its media
+MEDIA_LINKS = re.compile(r"(\s+https://t\.co/\w+)+$")
+
+# Return the text of a posted status as it was sent, without the t.co links
+# to its media, which Twitter appends to the text
+def posted_text(status):
+    text = getattr(status, "full_text", None) or status.text
+    entities = getattr(status, "entities", None) or {}
+    for media in entities.get("media", []):
+        text = text.replace(" %s" % media["url"], "")
+    return html.unescape(MEDIA_LINKS.sub("", text))
+
+# Return the HTTP status code of an error raised by tweepy (or a stand-in for
+# it), or None if it isn't an HTTP error
+def status_code(error):
+    response = getattr(error, "response", None)
+    if (getattr(response, "status_code", None) is not None):
+        return response.status_code
+    return getattr(error, "status_code", None)
+
+# Return the Twitter API error code of an error raised by tweepy, or None
+def api_code(error):
+    return getattr(error, "api_code", None)
+
+class TokenBucket(object):
+
+    # capacity: the number of calls allowed per period
+    # period: seconds over which the bucket refills completely
+    # clock: object with now() and sleep(seconds) methods
+    def __init__(self, capacity, period, clock):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock.now()
+        self.lock = threading.Lock()
+        self.waiting = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Take a token, sleeping until one is available
+    def acquire(self):
+        with self.lock:
+            self.waiting += 1
+        try:
+            while (True):
+                with self.lock:
+                    self.refill(self.clock.now())
+                    if (self.tokens >= 1):
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                self.clock.sleep(wait)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    # Correct the bucket from a response's remaining quota, and the time (in
+    # the clock's seconds) at which the quota resets
+    def update(self, remaining, reset = None):
+        with self.lock:
+            now = self.clock.now()
+            self.refill(now)
+            self.tokens = min(self.tokens, float(remaining))
+            if ((remaining <= 0) and (reset is not None) and (reset > now)):
+                # no more calls until the reset; refill from then on
+                self.tokens = 0.0
+                self.updated = reset
+
+class PostingClient(object):
+
+    # twitter: tweepy.API, or a stand-in with media_upload and update_status
+    # clock: object with now() and sleep(seconds) methods
+    # limits: endpoint name -> (calls, period in seconds) for the endpoints to
+    #   rate limit
+    # max_retries: times to retry a call rejected with a 429 or 503
+    # backoff: (base, maximum) seconds of the exponential backoff
+    def __init__(self, twitter, clock, limits = {}, max_retries = 5,
+                 backoff = (5, 15 * 60), seed = None):
+        self.twitter = twitter
+        self.clock = clock
+        self.buckets = {
+            endpoint: TokenBucket(calls, period, clock)
+            for (endpoint, (calls, period)) in limits.items()
+        }
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.random = random.Random(seed)
+        self.stats = collections.Counter(calls = 0, retries = 0, duplicates = 0)
+
+    # Number of calls waiting for quota
+    @property
+    def queue_depth(self):
+        return sum(bucket.waiting for bucket in self.buckets.values())
+
+    # Tokens left in each endpoint's bucket
+    def quota(self):
+        tokens = {}
+        for (endpoint, bucket) in self.buckets.items():
+            with bucket.lock:
+                bucket.refill(self.clock.now())
+                tokens[endpoint] = bucket.tokens
+        return tokens
+
+    # Seconds to wait before retry number attempt (starting from 0)
+    def backoff_seconds(self, attempt):
+        (base, maximum) = self.backoff
+        return self.random.uniform(0, min(maximum, base * 2 ** attempt))
+
+    # Update an endpoint's bucket from the rate limit headers of the last
+    # response, if it has any
+    def read_headers(self, endpoint, response):
+        bucket = self.buckets.get(endpoint)
+        headers = getattr(response, "headers", None)
+        if ((bucket is None) or (headers is None)):
+            return
+        remaining = headers.get("x-rate-limit-remaining")
+        if (remaining is not None):
+            reset = headers.get("x-rate-limit-reset")
+            bucket.update(int(remaining), float(reset) if (reset is not None) else None)
+
+    def call(self, endpoint, *args, **kwargs):
+        attempt = 0
+        while (True):
+            if (endpoint in self.buckets):
+                self.buckets[endpoint].acquire()
+            self.stats["calls"] += 1
+            try:
+                result = getattr(self.twitter, endpoint)(*args, **kwargs)
+                self.read_headers(endpoint, getattr(self.twitter, "last_response", None))
+                return result
+            except Exception as error:
+                self.read_headers(endpoint, getattr(error, "response", None))
+                if ((status_code(error) not in RETRY_STATUS_CODES) or (attempt >= self.max_retries)):
+                    raise
+                self.stats["retries"] += 1
+                self.clock.sleep(self.backoff_seconds(attempt))
+                attempt += 1
+
+    def media_upload(self, filename, **kwargs):
+        return self.call("media_upload", filename, **kwargs)
+
+    # Post a status. If Twitter rejects it as a duplicate, it was already
+    # posted by an earlier attempt whose response never arrived, so that
+    # status is returned instead.
+    def update_status(self, status, **kwargs):
+        try:
+            return self.call("update_status", status, **kwargs)
+        except Exception as error:
+            if (api_code(error) != DUPLICATE_STATUS_CODE):
+                raise
+            posted = self.find_recent_status(
+                status, kwargs.get("in_reply_to_status_id")
+            )
+            if (posted is None):
+                raise
+            self.stats["duplicates"] += 1
+            return posted
+
+    # Return the bot's recent status with the given text, replying to the
+    # given status if any, or None
+    def find_recent_status(self, text, in_reply_to_status_id = None, count = 20):
+        if (not hasattr(self.twitter, "user_timeline")):
+            return None
+        for status in self.twitter.user_timeline(count = count, tweet_mode = "extended"):
+            if ((posted_text(status) == text) and (
+                    getattr(status, "in_reply_to_status_id", None) == in_reply_to_status_id)):
+                return status
+        return None
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Look-ahead pipeline that prepares upcoming tweets in the background. While
+# the bot sleeps between posts, a thread pool renders the threads for the next
+# few rows (including the Street View download), so that posting a thread is
+# only a matter of taking the next prepared one off the queue.
+
+import collections
+import concurrent.futures
+
+class Prefetcher(object):
+
+    # items: iterable of tuples whose last element is the item to prepare,
+    # e.g. (index, next_offset, row); it is only advanced from the thread
+    # iterating over the Prefetcher.
+    # prepare: function called on a pool thread with the last element of each
+    # tuple, returning the prepared result.
+    # depth: number of items to prepare ahead of the one being posted; with a
+    # depth of 0, each item is prepared when it is taken off the queue.
+    def __init__(self, items, prepare, depth = 3, workers = None):
+        self.items = iter(items)
+        self.prepare = prepare
+        self.depth = depth
+        self.queue = collections.deque()
+        self.exhausted = False
+        self.executor = None
+        if (depth > 0):
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers = workers if (workers is not None) else depth,
+                thread_name_prefix = "prefetch"
+            )
+
+    def fill(self):
+        while ((not self.exhausted) and (len(self.queue) < max(self.depth, 1))):
+            try:
+                item = next(self.items)
+            except StopIteration:
+                self.exhausted = True
+                break
+            if (self.executor is None):
+                future = concurrent.futures.Future()
+                try:
+                    future.set_result(self.prepare(item[-1]))
+                except Exception as error:
+                    future.set_exception(error)
+            else:
+                future = self.executor.submit(self.prepare, item[-1])
+            self.queue.append((item, future))
+
+    def __iter__(self):
+        return self
+
+    # Return the next item, in order, as a tuple of the item's elements
+    # followed by the prepared result. If preparing the item raised an
+    # exception, the exception is returned in place of the result so that the
+    # caller can report it and move on.
+    def __next__(self):
+        self.fill()
+        if (len(self.queue) == 0):
+            self.close()
+            raise StopIteration
+        (item, future) = self.queue.popleft()
+
+        # top up the queue before waiting on the head, so the pool stays busy
+        if (self.executor is not None):
+            self.fill()
+        try:
+            result = future.result()
+        except Exception as error:
+            result = error
+        return tuple(item) + (result,)
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    def close(self):
+        if (self.executor is not None):
+            self.executor.shutdown(wait = False, cancel_futures = True)
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+
+# Renders the images that replies attach: the neighborhood maps, the parcel
+# composites, the tract rent and ethnic heterogeneity maps and the tract
+# graphs, into the directories and file names that the reply generators use.
+# Every image is described by a job holding the data it is drawn from, and the
+# SHA-256 hash of that data (plus STYLE_VERSION) is recorded in a manifest
+# when the image is written. Images whose hash is unchanged and which still
+# exist are skipped, so that a data release only redraws the images whose data
+# changed; the rest are drawn on a pool of processes. Images that exist but
+# are not in the manifest were made some other way (e.g. the hand-made maps
+# with satellite basemaps and routes) and are kept unless --force is given.
+# Each image is written to a temporary file and moved into place, so the bot
+# never attaches a partly written one.
+#
+# The tract and neighborhood outlines come from GeoJSON files whose features
+# have the tract or neighborhood key as a property. Parcel outlines are drawn
+# if there is a GeoJSON file of them, and the parcel's centroid is marked
+# otherwise. Stops come from the stops file (see transit.py), if there is one.
+# Drawing needs matplotlib, and Pillow for the composites' JPEGs.
+#
+# usage: ./render.py [-k KIND ...] [-j JOBS] [--force] [--dry-run]
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import time
+import traceback
+
+import numpy
+import pandas
+
+import bot
+
+# GeoJSON files of the outlines of the tracts, neighborhoods and parcels
+TRACT_SHAPES = "./tracts.geojson"
+NEIGHBORHOOD_SHAPES = "./neighborhoods.geojson"
+PARCEL_SHAPES = "./parcel_shapes.geojson"
+
+# Image path -> hash of the data it was last drawn from
+RENDER_MANIFEST = "./render_manifest.json"
+
+# Bump this whenever the drawing code changes, to redraw every image
+STYLE_VERSION = 1
+
+# Number of images drawn between saves of the manifest, so that an
+# interrupted run doesn't have to redraw them
+MANIFEST_SAVE_EVERY = 500
+
+# Size of every image, in inches at IMAGE_DPI
+FIGURE_SIZE = (12, 6.75)
+IMAGE_DPI = 100
+
+# Columns of the tract attributes shown in each tract's bar graph of ages,
+# with their labels: the percentage of residents in each age band. Tracts
+# files without any of these columns get no graphs.
+TRACT_GRAPH_COLUMNS = [
+    ("AgeU18", "Under 18"),
+    ("Age18to34", "18 to 34"),
+    ("Age35to64", "35 to 64"),
+    ("Age65Over", "65 and over"),
+]
+
+# Tract map kind -> (column coloured by its citywide percentile rank, colormap)
+TRACT_MAPS = {
+    "tract_rent_map": ("MedGrossRent", "Greens"),
+    "tract_eth_het_map": ("EthHet", "viridis"),
+}
+
+# STOP_TYPE -> (marker, face colour) of the stops on the maps
+STOP_MARKERS = {
+    "Bus": ("o", "#ffd200"),
+    "Subway": ("$T$", "white"),
+}
+
+# Metres of margin around a parcel and its nearest stop in a composite
+COMPOSITE_MARGIN = 150.0
+
+# Return the SHA-256 hex digest of data, which is anything json can encode
+def digest(data):
+    encoded = json.dumps([STYLE_VERSION, data], sort_keys = True, default = str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+# Return a dict mapping the key_property of each feature of a GeoJSON file to
+# its outline, as a list of rings of [longitude, latitude] pairs, or an empty
+# dict if there is no such file
+def read_shapes(path, key_property):
+    if ((path is None) or (not os.path.isfile(path))):
+        return {}
+    with open(path, "r") as f:
+        features = json.load(f)["features"]
+    shapes = {}
+    for feature in features:
+        geometry = feature.get("geometry") or {}
+        if (geometry.get("type") == "Polygon"):
+            polygons = [geometry["coordinates"]]
+        elif (geometry.get("type") == "MultiPolygon"):
+            polygons = geometry["coordinates"]
+        else:
+            continue
+        key = bot.normalize_key(feature["properties"].get(key_property))
+        if (isinstance(key, str) and key.isdigit()):
+            key = int(key)
+        shapes.setdefault(key, []).extend(
+            [[point[:2] for point in ring] for polygon in polygons for ring in polygon]
+        )
+    return shapes
+
+# Return the (min_lon, min_lat, max_lon, max_lat) bounds of a shape's rings
+def bounds(rings):
+    points = numpy.array([point for ring in rings for point in ring], dtype = float)
+    return (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+
+Job = collections.namedtuple("Job", ["kind", "path", "digest", "payload"])
+
+################################################################################
+# Planning #####################################################################
+
+# Return the jobs for every tract map of each kind in TRACT_MAPS. Every tract's
+# colour depends on every tract's rank, so all of a kind's maps are redrawn
+# when any rank changes.
+def tract_map_jobs(context):
+    jobs = []
+    tracts = bot.DATA.tract_attributes
+    keys = [bot.normalize_key(key) for key in tracts[bot.TRACT_KEY]]
+    shapes_digest = digest(context["tract_shapes"])
+    for (kind, (column, _)) in TRACT_MAPS.items():
+        ranks = bot.DATA.percentiles("tract").ranks(column)
+        context["tract_ranks"][kind] = dict(zip(keys, ranks.tolist()))
+        city_digest = digest([shapes_digest, sorted(context["tract_ranks"][kind].items(), key = str)])
+        for key in keys:
+            if ((key is None) or (key not in context["tract_shapes"])):
+                continue
+            path = os.path.join(bot.ASSETS.directories[kind], "%d.png" % key)
+            jobs.append(Job(kind, path, digest([kind, city_digest, key]), {"tract": key}))
+    return jobs
+
+# Return the jobs for every tract graph, each of which depends only on its own
+# tract's values
+def tract_graph_jobs(context):
+    jobs = []
+    tracts = bot.DATA.tract_attributes
+    columns = [(column, label) for (column, label) in TRACT_GRAPH_COLUMNS if (column in tracts.columns)]
+    if (len(columns) == 0):
+        return jobs
+    for values in tracts[[bot.TRACT_KEY] + [column for (column, _) in columns]].itertuples(
+            index = False, name = None):
+        key = bot.normalize_key(values[0])
+        if (key is None):
+            continue
+        payload = {
+            "tract": key,
+            "values": [
+                (label, float(value))
+                for ((_, label), value) in zip(columns, values[1:])
+            ],
+        }
+        path = os.path.join(bot.ASSETS.directories["tract_age_graph"], "%d.png" % key)
+        jobs.append(Job("tract_age_graph", path, digest(["tract_age_graph", payload]), payload))
+    return jobs
+
+# Return the stops within bounds, as sorted (longitude, latitude, STOP_TYPE)
+# tuples
+def stops_within(stops, bounds):
+    if (stops is None):
+        return []
+    (min_lon, min_lat, max_lon, max_lat) = bounds
+    inside = stops[
+        stops["stop_lon"].between(min_lon, max_lon) & stops["stop_lat"].between(min_lat, max_lat)
+    ]
+    return sorted(zip(
+        inside["stop_lon"].tolist(), inside["stop_lat"].tolist(), inside["STOP_TYPE"].tolist()
+    ))
+
+# Return the jobs for every neighborhood map, each of which depends on the
+# outlines of every neighborhood and the stops in its own
+def neighborhood_map_jobs(context):
+    jobs = []
+    outlines_digest = digest(context["neighborhood_shapes"])
+    stops = context["stops"]
+    for (name, rings) in context["neighborhood_shapes"].items():
+        payload = {
+            "neighborhood": name,
+            "stops": stops_within(stops, bounds(rings)),
+        }
+        path = os.path.join(
+            bot.ASSETS.directories["neighborhood_map"], "%s.png" % bot.neighborhood_slug(name)
+        )
+        jobs.append(Job(
+            "neighborhood_map", path,
+            digest(["neighborhood_map", outlines_digest, payload]), payload
+        ))
+    return jobs
+
+# Return the jobs for the composite of every parcel that could be tweeted,
+# each of which depends on its own outline or centroid and nearest stop
+def parcel_composite_jobs(context):
+    if (bot.CACHE_DIR is None):
+        parcels = pandas.read_csv(bot.INPUT_PARCELS, dtype = bot.PARCEL_SCHEMA)
+    else:
+        (parcels, _) = bot.load_cached_parcels(bot.INPUT_PARCELS, bot.CACHE_DIR)
+    parcels = parcels[parcels["ST_NUM"].notnull() & parcels["x"].notnull() & parcels["y"].notnull()]
+    parcel_shapes = read_shapes(PARCEL_SHAPES, "Land_Parcel_ID")
+
+    index = bot.DATA.transit()
+    if (index is not None):
+        (positions, _) = index.nearest(parcels["x"], parcels["y"])
+        stops = index.stops.iloc[positions]
+        nearest = zip(
+            stops["stop_lon"].tolist(), stops["stop_lat"].tolist(),
+            stops["STOP_TYPE"].tolist(), stops["stop_name"].tolist()
+        )
+    else:
+        nearest = [None] * len(parcels)
+
+    jobs = []
+    for ((land_parcel_id, x, y), stop) in zip(
+            parcels[["Land_Parcel_ID", "x", "y"]].itertuples(index = False, name = None), nearest):
+        payload = {
+            "parcel": [float(x), float(y)],
+            "outline": parcel_shapes.get(int(land_parcel_id)),
+            "stop": list(stop) if (stop is not None) else None,
+        }
+        path = os.path.join(bot.ASSETS.directories["parcel_composite"], "%d.jpg" % land_parcel_id)
+        jobs.append(Job("parcel_composite", path, digest(["parcel_composite", payload]), payload))
+    return jobs
+
+# Kind of image -> function returning the jobs for every image of that kind
+PLANNERS = collections.OrderedDict([
+    ("tract_rent_map", tract_map_jobs),
+    ("tract_eth_het_map", tract_map_jobs),
+    ("tract_age_graph", tract_graph_jobs),
+    ("neighborhood_map", neighborhood_map_jobs),
+    ("parcel_composite", parcel_composite_jobs),
+])
+
+# Return the data shared by every job, which each worker process is given once
+def load_context():
+    index = bot.DATA.transit()
+    return {
+        "tract_shapes": read_shapes(TRACT_SHAPES, bot.TRACT_KEY),
+        "neighborhood_shapes": read_shapes(NEIGHBORHOOD_SHAPES, bot.NEIGHBORHOOD_KEY),
+        "stops": index.stops.drop(columns = ["routes"]) if (index is not None) else None,
+        # tract map kind -> {tract: rank}, filled in by tract_map_jobs
+        "tract_ranks": {},
+    }
+
+# Return the jobs for the given kinds of images
+def plan(kinds, context):
+    jobs = []
+    for planner in collections.OrderedDict.fromkeys(PLANNERS[kind] for kind in kinds):
+        jobs += [job for job in planner(context) if (job.kind in kinds)]
+    return jobs
+
+################################################################################
+# Drawing ######################################################################
+
+# Data shared by every job, set in each worker process by start_worker
+CONTEXT = None
+
+def start_worker(context):
+    global CONTEXT
+    CONTEXT = context
+    import matplotlib
+    matplotlib.use("Agg")
+
+def new_figure():
+    import matplotlib.pyplot
+    figure = matplotlib.pyplot.figure(figsize = FIGURE_SIZE, dpi = IMAGE_DPI)
+    axes = figure.add_axes([0, 0, 1, 1])
+    axes.set_axis_off()
+    return (figure, axes)
+
+# Draw a shape's rings, returning nothing
+def draw_shape(axes, rings, **kwargs):
+    import matplotlib.patches
+    for ring in rings:
+        axes.add_patch(matplotlib.patches.Polygon(ring, closed = True, **kwargs))
+
+# Fit the axes to bounds, correcting the aspect ratio for the latitude
+def fit(axes, bounds, margin = 0.05):
+    (min_lon, min_lat, max_lon, max_lat) = bounds
+    (pad_lon, pad_lat) = ((max_lon - min_lon) * margin, (max_lat - min_lat) * margin)
+    axes.set_xlim(min_lon - pad_lon, max_lon + pad_lon)
+    axes.set_ylim(min_lat - pad_lat, max_lat + pad_lat)
+    axes.set_aspect(1 / numpy.cos(numpy.radians((min_lat + max_lat) / 2)))
+
+def draw_stops(axes, stops, size = 60):
+    for (stop_type, (marker, colour)) in STOP_MARKERS.items():
+        points = [(lon, lat) for (lon, lat, kind) in stops if (kind == stop_type)]
+        if (len(points) > 0):
+            axes.scatter(
+                [lon for (lon, _) in points], [lat for (_, lat) in points], marker = marker,
+                s = size, c = colour, edgecolors = "black", linewidths = 0.5, zorder = 3
+            )
+
+def draw_tract_map(axes, kind, payload):
+    import matplotlib
+    (_, colormap) = TRACT_MAPS[kind]
+    colormap = matplotlib.colormaps[colormap]
+    ranks = CONTEXT["tract_ranks"][kind]
+    shapes = CONTEXT["tract_shapes"]
+    for (key, rings) in shapes.items():
+        rank = ranks.get(key)
+        colour = "lightgrey" if ((rank is None) or numpy.isnan(rank)) else colormap(rank)
+        draw_shape(axes, rings, facecolor = colour, edgecolor = "white", linewidth = 0.3)
+    draw_shape(axes, shapes[payload["tract"]], fill = False, edgecolor = "red", linewidth = 2.5, zorder = 2)
+    all_bounds = numpy.array([bounds(rings) for rings in shapes.values()])
+    fit(axes, (all_bounds[:, 0].min(), all_bounds[:, 1].min(), all_bounds[:, 2].max(), all_bounds[:, 3].max()))
+
+def draw_tract_graph(axes, payload):
+    axes.set_axis_on()
+    axes.set_position([0.25, 0.1, 0.7, 0.8])
+    labels = [label for (label, _) in payload["values"]]
+    axes.barh(labels, [value for (_, value) in payload["values"]], color = "#3a7dbf")
+    axes.invert_yaxis()
+    axes.set_xlabel("% of residents")
+    axes.set_title("Ages of residents of census tract %d" % payload["tract"])
+
+def draw_neighborhood_map(axes, payload):
+    shapes = CONTEXT["neighborhood_shapes"]
+    for (name, rings) in shapes.items():
+        if (name != payload["neighborhood"]):
+            draw_shape(axes, rings, facecolor = "#eeeeee", edgecolor = "grey", linewidth = 0.5)
+    rings = shapes[payload["neighborhood"]]
+    draw_shape(axes, rings, facecolor = "#cfe3f7", edgecolor = "black", linewidth = 1.5)
+    draw_stops(axes, payload["stops"])
+    fit(axes, bounds(rings), margin = 0.15)
+
+def draw_parcel_composite(axes, payload):
+    (lon, lat) = payload["parcel"]
+    points = [(lon, lat)]
+    if (payload["outline"] is not None):
+        draw_shape(axes, payload["outline"], facecolor = "#f4a582", edgecolor = "red", linewidth = 2, zorder = 2)
+        points += [point for ring in payload["outline"] for point in ring]
+    else:
+        axes.scatter([lon], [lat], marker = "s", s = 120, c = "#f4a582", edgecolors = "red", zorder = 2)
+    if (payload["stop"] is not None):
+        (stop_lon, stop_lat, stop_type, stop_name) = payload["stop"]
+        axes.plot([lon, stop_lon], [lat, stop_lat], linestyle = "--", color = "black", zorder = 1)
+        draw_stops(axes, [(stop_lon, stop_lat, stop_type)], size = 200)
+        axes.annotate(stop_name, (stop_lon, stop_lat), xytext = (8, 8), textcoords = "offset points")
+        points.append((stop_lon, stop_lat))
+    points = numpy.array(points, dtype = float)
+    # pad by COMPOSITE_MARGIN metres on each side
+    pad_lat = COMPOSITE_MARGIN / 111320.0
+    pad_lon = pad_lat / numpy.cos(numpy.radians(lat))
+    fit(axes, (
+        points[:, 0].min() - pad_lon, points[:, 1].min() - pad_lat,
+        points[:, 0].max() + pad_lon, points[:, 1].max() + pad_lat,
+    ), margin = 0)
+
+# Draw a job's image and move it into place, returning (path, digest, error),
+# where error is None or the traceback of a failure
+def render_job(job):
+    import matplotlib.pyplot
+
+    (figure, axes) = new_figure()
+    (stem, extension) = os.path.splitext(job.path)
+    tmp_path = "%s.%d.tmp%s" % (stem, os.getpid(), extension)
+    try:
+        if (job.kind in TRACT_MAPS):
+            draw_tract_map(axes, job.kind, job.payload)
+        elif (job.kind == "tract_age_graph"):
+            draw_tract_graph(axes, job.payload)
+        elif (job.kind == "neighborhood_map"):
+            draw_neighborhood_map(axes, job.payload)
+        else:
+            draw_parcel_composite(axes, job.payload)
+        figure.savefig(tmp_path, dpi = IMAGE_DPI, format = extension[1:])
+        os.replace(tmp_path, job.path)
+        return (job.path, job.digest, None)
+    except Exception:
+        if (os.path.isfile(tmp_path)):
+            os.remove(tmp_path)
+        return (job.path, job.digest, traceback.format_exc())
+    finally:
+        matplotlib.pyplot.close(figure)
+
+################################################################################
+# Running ######################################################################
+
+def read_manifest(path = RENDER_MANIFEST):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(manifest, path = RENDER_MANIFEST):
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, sort_keys = True)
+    os.replace(tmp_path, path)
+
+# Return a tuple of the jobs whose images are missing or were drawn from
+# other data, and the jobs whose images exist but aren't in the manifest,
+# which weren't drawn by this script and are left alone
+def stale_jobs(jobs, manifest):
+    bot.ASSETS.scan()
+    (stale, kept) = ([], [])
+    for job in jobs:
+        drawn_from = manifest.get(os.path.normpath(job.path))
+        if (not bot.ASSETS.exists(job.path)):
+            stale.append(job)
+        elif (drawn_from is None):
+            kept.append(job)
+        elif (drawn_from != job.digest):
+            stale.append(job)
+    return (stale, kept)
+
+# Draw the images of the given kinds that are out of date on a pool of
+# processes, or all of them with force, including images that this script
+# didn't draw. Returns a Counter of the jobs planned, skipped, kept, drawn and
+# failed.
+def render(kinds = tuple(PLANNERS), processes = None, force = False, dry_run = False,
+           manifest_path = RENDER_MANIFEST, log = print):
+    counts = collections.Counter()
+    context = load_context()
+    jobs = plan(kinds, context)
+    manifest = read_manifest(manifest_path)
+    (stale, kept) = (jobs, []) if (force) else stale_jobs(jobs, manifest)
+    counts.update(planned = len(jobs), skipped = len(jobs) - len(stale) - len(kept), kept = len(kept))
+    log("%d images, %d up to date, %d not drawn by this script (kept; use --force to redraw them), %d to draw" % (
+        len(jobs), counts["skipped"], len(kept), len(stale)
+    ))
+    if (dry_run or (len(stale) == 0)):
+        return counts
+
+    for directory in set(os.path.dirname(job.path) for job in stale):
+        os.makedirs(directory, exist_ok = True)
+    started = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers = processes, initializer = start_worker, initargs = (context,)) as executor:
+        for (path, job_digest, error) in executor.map(render_job, stale, chunksize = 16):
+            if (error is None):
+                manifest[os.path.normpath(path)] = job_digest
+                counts["drawn"] += 1
+            else:
+                manifest.pop(os.path.normpath(path), None)
+                counts["failed"] += 1
+                log("Failed to draw %s:\n%s" % (path, error))
+            if ((counts["drawn"] + counts["failed"]) % MANIFEST_SAVE_EVERY == 0):
+                write_manifest(manifest, manifest_path)
+    write_manifest(manifest, manifest_path)
+    log("drew %d images in %0.1f seconds, %d failed" % (
+        counts["drawn"], time.perf_counter() - started, counts["failed"]
+    ))
+    return counts
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", "--kind", dest = "kinds", action = "append", choices = list(PLANNERS),
+                        help = "kind of image to draw (default: every kind)")
+    parser.add_argument("-j", "--jobs", type = int, default = None,
+                        help = "number of processes to draw with (default: one per CPU)")
+    parser.add_argument("--force", action = "store_true", default = False,
+                        help = "redraw every image, even those that are up to date or weren't drawn by this script")
+    parser.add_argument("--dry-run", dest = "dry_run", action = "store_true", default = False,
+                        help = "only report how many images are out of date")
+    args = parser.parse_args()
+
+    counts = render(
+        args.kinds or list(PLANNERS), args.jobs, force = args.force, dry_run = args.dry_run
+    )
+    raise SystemExit(1 if (counts["failed"] > 0) else 0)
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+# The bot's posting loop, with the clock and the Twitter and Slack clients
+# passed in, so that it can be run for real by bot.py or against stand-ins
+# on a virtual clock by simulate.py. Each cycle posts one parcel's thread
+# and then sleeps; if anything goes wrong, the stack trace is queued to be
+# sent to Slack (see crash_reports.py) and the loop sleeps for the reboot
+# time before trying the same parcel again, without reposting the tweets of
+# the thread that were already posted. A parcel is given up on after a few
+# attempts. With a journal (see journal.py), each stage of each thread is
+# recorded as it happens, and a thread left half-posted when the bot stopped
+# is finished when it starts again. With a lease on a shard of the parcels
+# (see shards.py), the loop stops as soon as the lease is lost, so that the
+# worker that takes the shard over doesn't post the same threads.
+
+import collections
+import contextlib
+import os
+import threading
+import time
+import traceback
+
+import crash_reports
+import media
+import metrics
+import prefetch
+
+# The real clock
+class SystemClock(object):
+
+    def now(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+# A clock that only moves when something sleeps on it, so that hours of
+# posting can be replayed in moments
+class VirtualClock(object):
+
+    def __init__(self, start = 0.0):
+        self.time = start
+        self.lock = threading.Lock()
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.time += seconds
+
+class Runner(object):
+
+    # parcels: iterable of (index, next_offset, row) tuples to tweet, in order
+    # prepare: function taking a row and returning a thread as returned by
+    #   bot.prepare_thread
+    # twitter: object with tweepy.API's media_upload and update_status, such
+    #   as a posting.PostingClient, whose queue depth and remaining quota are
+    #   recorded with each cycle
+    # slack: object with slack.WebClient's files_upload, which crash reports
+    #   are sent with unless crash_reporter is given
+    # save_status: function taking a row index and next offset, called before
+    #   each thread is posted
+    # journal: journal.Journal to record the progress of each thread in
+    # streetview: the image_cache.StreetViewCache that prepare uses, if any,
+    #   to report its statistics
+    # uploader: media.MediaUploader to upload images with; by default, one that
+    #   uploads with twitter.media_upload on self.clock
+    # metrics: metrics.MetricsLog to record the stage timings of each cycle in
+    # slow_stage_seconds: stage name -> seconds after which the stage is
+    #   pointed out as slow in crash reports
+    # thread_attempts: times to try posting a parcel's thread before moving on
+    # lease: shards.Lease on the shard that parcels come from, if any
+    # crash_reporter: crash_reports.CrashReporter to report crashes with; by
+    #   default, one that uploads to slack_channel in the background, which
+    #   is closed, sending any grouped crashes, when run returns
+    def __init__(self, parcels, prepare, twitter, slack, slack_channel,
+                 clock = None, save_status = None, journal = None, streetview = None,
+                 dry_run = False, prefetch_depth = 3, sleep_time = 60 * 60,
+                 reboot_time = 60, uploader = None, metrics = None, slow_stage_seconds = {},
+                 thread_attempts = 3, lease = None, crash_reporter = None, log = print):
+        self.parcels = parcels
+        self.prepare = prepare
+        self.twitter = twitter
+        self.slack = slack
+        self.slack_channel = slack_channel
+        self.clock = clock if (clock is not None) else SystemClock()
+        self.save_status = save_status
+        self.journal = journal
+        self.streetview = streetview
+        self.dry_run = dry_run
+        self.prefetch_depth = prefetch_depth
+        self.sleep_time = sleep_time
+        self.reboot_time = reboot_time
+        self.metrics = metrics
+        self.slow_stage_seconds = slow_stage_seconds
+        self.thread_attempts = thread_attempts
+        self.lease = lease
+        self.log = log
+        if (uploader is None):
+            uploader = media.MediaUploader(self.twitter.media_upload, clock = self.clock.now)
+        self.uploader = uploader
+        # a crash reporter passed in is closed by whoever made it
+        self.owns_crash_reporter = (crash_reporter is None)
+        if (crash_reporter is None):
+            crash_reporter = crash_reports.CrashReporter(
+                self.slack, self.slack_channel, clock = self.clock.now, log = self.log
+            )
+        self.crash_reporter = crash_reporter
+
+        # stage name -> list of durations in seconds, by self.clock
+        self.stage_durations = collections.defaultdict(list)
+        # seconds from each failure to the next thread posted successfully
+        self.recovery_times = []
+        self.counts = collections.Counter(cycles = 0, posted = 0, failed = 0, abandoned = 0)
+        self.failed_at = None
+
+        # the cycle being posted, as recorded by metrics.MetricsLog
+        self.cycle = None
+        # row index -> seconds spent reading it (and any skipped rows before
+        # it) from the parcels
+        self.read_times = {}
+
+    # Time the enclosed block by self.clock and record it under name
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = self.clock.now()
+        try:
+            yield
+        finally:
+            self.record_stage(name, self.clock.now() - started)
+
+    # Record seconds spent in a stage, adding them to the current cycle's
+    # total for the stage
+    def record_stage(self, name, seconds):
+        self.stage_durations[name].append(seconds)
+        if (self.cycle is not None):
+            stages = self.cycle["stages"]
+            stages[name] = stages.get(name, 0.0) + seconds
+
+    # Iterate over the parcels, timing how long each row takes to read
+    def timed_parcels(self):
+        parcels = iter(self.parcels)
+        while (True):
+            started = self.clock.now()
+            try:
+                item = next(parcels)
+            except StopIteration:
+                return
+            self.read_times[item[0]] = self.clock.now() - started
+            yield item
+
+    def start_cycle(self, index, row, thread, attempt):
+        self.cycle = {
+            "time": self.clock.now(),
+            "index": int(index),
+            "Land_Parcel_ID": int(row["Land_Parcel_ID"]),
+            "generator": None,
+            "attempt": attempt,
+            "outcome": None,
+            "stages": {},
+            "gauges": {},
+        }
+        if (hasattr(self.twitter, "queue_depth")):
+            self.cycle["gauges"]["posting_queue_depth"] = self.twitter.queue_depth
+            for (endpoint, tokens) in self.twitter.quota().items():
+                self.cycle["gauges"]["posting_tokens_%s" % endpoint] = tokens
+        if (index in self.read_times):
+            self.record_stage("read_parcel", self.read_times.pop(index))
+        if (not isinstance(thread, Exception)):
+            self.cycle["generator"] = thread["generator"]
+            # popped so that retries of the thread don't count them again
+            for (name, seconds) in thread.pop("timings", {}).items():
+                self.record_stage(name, seconds)
+
+    def finish_cycle(self, outcome):
+        (cycle, self.cycle) = (self.cycle, None)
+        cycle["outcome"] = outcome
+        if (self.metrics is not None):
+            self.metrics.record(cycle)
+
+    # wrapper around tweet functionality
+    def tweet(self, message, image_paths = [], reply_to_status = None):
+        tweet_kwargs = {}
+
+        self.log("")
+
+        # upload images, all at once, reusing the media IDs of images that were
+        # uploaded recently
+        if (len(image_paths) > 0):
+            media_ids = []
+            if (self.dry_run):
+                for image_path in image_paths:
+                    self.log("Not uploading: %s" % image_path)
+            else:
+                with self.stage("media_upload"):
+                    uploads = self.uploader.upload(image_paths)
+                for (image_path, (media_id, reused)) in zip(image_paths, uploads):
+                    if (reused):
+                        self.log("Reusing media ID %s for: %s" % (media_id, image_path))
+                    else:
+                        self.log("Uploaded: %s" % image_path)
+                    media_ids.append(media_id)
+            tweet_kwargs["media_ids"] = media_ids
+
+        # reply
+        if (reply_to_status):
+            tweet_kwargs["in_reply_to_status_id"] = reply_to_status.id
+            message = "@bariexplorer %s" % message
+            self.log("Set in_reply_to_status_id to %d" % reply_to_status.id)
+
+        if (self.dry_run):
+            self.log("Not tweeting: %s" % message)
+        else:
+            self.log("Tweeting: %s" % message)
+            with self.stage("update_status"):
+                return self.twitter.update_status(message, **tweet_kwargs)
+
+    # Runs on a prefetch thread, so the time is stored with the thread rather
+    # than in the current cycle
+    def prepare_timed(self, row):
+        started = self.clock.now()
+        thread = self.prepare(row)
+        thread.setdefault("timings", {})["prepare"] = self.clock.now() - started
+        return thread
+
+    # Post a parcel's thread. posted is a dict shared between attempts at the
+    # same thread, holding the statuses of the tweets that went out, which are
+    # not posted again.
+    def post_thread(self, index, next_offset, row, thread, posted):
+        self.log("Gathering information for row: %d" % index)
+        land_parcel_id = int(row["Land_Parcel_ID"])
+
+        # Save position
+        if (self.save_status is not None):
+            self.save_status(index, next_offset)
+
+        # preparing the thread failed; report it like any other error
+        if (isinstance(thread, Exception)):
+            raise thread
+
+        if ((self.journal is not None) and ("rendered" not in posted)):
+            self.journal.record(index, next_offset, land_parcel_id, "rendered", thread = {
+                "main": thread["main"],
+                "reply": thread["reply"],
+                "generator": thread["generator"],
+                "missing_images": thread["missing_images"],
+            })
+            posted["rendered"] = True
+
+        ########################################################################
+        # Main tweet ###########################################################
+
+        if ("main" in posted):
+            self.log("\nMain tweet already posted")
+        else:
+            with self.stage("main_tweet"):
+                posted["main"] = self.tweet(
+                    message = "%s (1/2)" % thread["main"]["message"],
+                    image_paths = thread["main"]["images"]
+                )
+            if (self.journal is not None):
+                self.journal.record(
+                    index, next_offset, land_parcel_id, "main_posted",
+                    status_id = getattr(posted["main"], "id", None)
+                )
+
+        if (self.streetview is not None):
+            cache_stats = self.streetview.stats
+            self.log("Street View cache: %d hits, %d misses, %d evictions" % (
+                cache_stats["hits"], cache_stats["misses"], cache_stats["evictions"]
+            ))
+
+        ########################################################################
+        # Reply tweet (randomly chosen) ########################################
+
+        self.log("\nCreating reply tweet using tweet generator:")
+        self.log(thread["generator"])
+        for path in thread["missing_images"]:
+            self.log("Missing image, not uploading: %s" % path)
+
+        with self.stage("reply_tweet"):
+            posted["reply"] = self.tweet(
+                message = "%s (2/2)" % thread["reply"]["message"],
+                image_paths = thread["reply"]["images"],
+                reply_to_status = posted["main"]
+            )
+        if (self.journal is not None):
+            self.journal.record(
+                index, next_offset, land_parcel_id, "reply_posted",
+                status_id = getattr(posted["reply"], "id", None)
+            )
+
+    # Report the stack trace of the exception being handled, along with the
+    # timings of the cycle that failed
+    def report_crash(self, attempt):
+        self.log(traceback.format_exc())
+        if (attempt < self.thread_attempts):
+            comment = "bariexplorer crashed! Stack trace attached. I will be retrying this parcel (attempt %d of %d) in %d seconds 👍" % (
+                attempt + 1, self.thread_attempts, self.reboot_time
+            )
+        else:
+            comment = "bariexplorer crashed! Stack trace attached. I will be restarting the bot with the next parcel in %d seconds 👍" % self.reboot_time
+        content = traceback.format_exc()
+        if (self.cycle is not None):
+            slow = metrics.slow_stages(self.cycle["stages"], self.slow_stage_seconds)
+            if (len(slow) > 0):
+                comment = "%s Slow stages: %s" % (comment, ", ".join(
+                    "%s (%0.1f seconds, threshold %0.1f)" % stage for stage in slow
+                ))
+            content = "%s\n%s\n" % (
+                content, metrics.format_stages(self.cycle, self.slow_stage_seconds)
+            )
+        with self.stage("crash_report"):
+            self.crash_reporter.report(comment, content)
+
+    # Post threads until the parcels run out, returning True, or until
+    # max_cycles threads have been attempted or the lease is lost, returning
+    # False
+    def run(self, max_cycles = None):
+        try:
+            return self.run_threads(max_cycles)
+        finally:
+            if (self.owns_crash_reporter):
+                self.crash_reporter.close()
+
+    def run_threads(self, max_cycles):
+        # Finish the thread that was being posted when the bot last stopped;
+        # the parcels carry on from the row after it
+        if (self.journal is not None):
+            pending = self.journal.pending_thread()
+            if (pending is not None):
+                self.log("Finishing the thread for row %d from the journal" % pending["index"])
+                thread = pending["thread"]
+                for part in ("main", "reply"):
+                    thread[part]["images"] = [
+                        path for path in thread[part]["images"] if os.path.isfile(path)
+                    ]
+                row = {"Land_Parcel_ID": pending["Land_Parcel_ID"]}
+                if (not self.post_with_attempts(
+                        pending["index"], pending["next_offset"], row, thread,
+                        pending["posted"], max_cycles)):
+                    return False
+
+        # Threads for the upcoming rows are prepared in the background while
+        # the bot sleeps, so posting doesn't wait on Street View downloads
+        prefetcher = prefetch.Prefetcher(
+            self.timed_parcels(), self.prepare_timed, depth = self.prefetch_depth
+        )
+        try:
+            for (index, next_offset, row, thread) in prefetcher:
+                if (not self.post_with_attempts(index, next_offset, row, thread, {}, max_cycles)):
+                    return False
+        finally:
+            prefetcher.close()
+        return True
+
+    # Try posting a parcel's thread up to thread_attempts times, returning
+    # False if max_cycles was reached or the lease was lost first
+    def post_with_attempts(self, index, next_offset, row, thread, posted, max_cycles):
+        for attempt in range(1, self.thread_attempts + 1):
+            if ((max_cycles is not None) and (self.counts["cycles"] >= max_cycles)):
+                return False
+            if ((self.lease is not None) and (not self.lease.held)):
+                self.log("Lost the lease on shard %d; stopping" % self.lease.shard.index)
+                return False
+            # preparing the thread failed last time; try again
+            if ((attempt > 1) and isinstance(thread, Exception)):
+                try:
+                    thread = self.prepare_timed(row)
+                except Exception as error:
+                    thread = error
+            if (self.run_cycle(index, next_offset, row, thread, posted, attempt)):
+                return True
+
+        self.counts["abandoned"] += 1
+        if (self.journal is not None):
+            self.journal.record(index, next_offset, row["Land_Parcel_ID"], "abandoned")
+        return True
+
+    # Make one attempt at posting a parcel's thread, returning True if it was
+    # posted
+    def run_cycle(self, index, next_offset, row, thread, posted, attempt):
+        self.counts["cycles"] += 1
+        try:
+            self.start_cycle(index, row, thread, attempt)
+            with self.stage("thread"):
+                self.post_thread(index, next_offset, row, thread, posted)
+            self.counts["posted"] += 1
+            if (self.failed_at is not None):
+                self.recovery_times.append(self.clock.now() - self.failed_at)
+                self.failed_at = None
+            self.finish_cycle("posted")
+            self.clock.sleep(self.sleep_time)
+            return True
+        except KeyboardInterrupt:
+            raise
+        except Exception:
+            self.counts["failed"] += 1
+            if (self.failed_at is None):
+                self.failed_at = self.clock.now()
+            self.report_crash(attempt)
+            if (self.cycle is not None):
+                self.finish_cycle("failed")
+            self.clock.sleep(self.reboot_time)
+            return False
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+# Leases on shards of the parcels file, so that several bot processes, on one
+# host or several sharing a filesystem, can work through the parcels in
+# parallel without posting the same ones. The rows are split into shards of a
+# fixed number of rows. A worker leases a shard, posts its rows, marks it done
+# and leases the next. The shard plan and the leases are kept in a JSON file
+# in a shared directory, which is only read and rewritten while holding an
+# exclusive POSIX lock on a lock file (which NFS supports through its lock
+# manager). A lease expires unless the worker holding it renews it, which a
+# heartbeat thread does every so often; the shard of an expired lease, such as
+# one held by a worker that died, is given to the next worker that asks. Each
+# shard has its own journal (see journal.py), which is its checkpoint: the
+# worker that takes a shard over finishes any half-posted thread and resumes
+# from the row after the last one posted.
+#
+# Lease times are wall-clock times, so the hosts' clocks need to be kept in
+# sync, to well within the lease length.
+#
+# usage: ./shards.py DIRECTORY
+
+import argparse
+import collections
+import contextlib
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import journal
+
+STATE_FILE = "shards.json"
+LOCK_FILE = "shards.lock"
+
+# A range of rows of the parcels file, from start up to (not including) stop
+Shard = collections.namedtuple("Shard", ["index", "start", "stop"])
+
+# Return the name of the journal of a shard
+def journal_name(shard_index):
+    return "shard-%05d.jsonl" % shard_index
+
+# Return an ID for this process that is unique across hosts
+def default_owner():
+    return "%s:%d:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+class Lease(object):
+
+    # table: the ShardTable the lease was taken from
+    # shard: the leased Shard
+    # token: ID of this lease, different every time a shard is leased
+    # expires: time at which the lease runs out unless it is renewed
+    def __init__(self, table, shard, token, expires):
+        self.table = table
+        self.shard = shard
+        self.token = token
+        self.expires = expires
+        self.lost = False
+        self.stopped = threading.Event()
+        self.heartbeat = None
+
+    @property
+    def journal_path(self):
+        return os.path.join(self.table.directory, journal_name(self.shard.index))
+
+    # True until the lease runs out or another worker has taken the shard
+    @property
+    def held(self):
+        return (not self.lost) and (self.table.clock() < self.expires)
+
+    # Renew the lease every heartbeat_seconds on a background thread until
+    # the lease is stopped or lost
+    def start(self):
+        def beat():
+            while (not self.stopped.wait(self.table.heartbeat_seconds)):
+                try:
+                    self.table.renew(self)
+                except OSError as error:
+                    # e.g. the shared filesystem is unavailable; the lease
+                    # runs out if this keeps happening
+                    self.table.log("Failed to renew the lease on shard %d: %s" % (
+                        self.shard.index, error
+                    ))
+                if (self.lost):
+                    return
+
+        self.heartbeat = threading.Thread(
+            target = beat, name = "lease-%d" % self.shard.index, daemon = True
+        )
+        self.heartbeat.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if (self.heartbeat is not None):
+            self.heartbeat.join()
+            self.heartbeat = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+class ShardTable(object):
+
+    # directory: directory shared by every worker, holding the leases and each
+    #   shard's journal
+    # shard_rows: number of rows in each shard, used when the directory is
+    #   first set up
+    # lease_seconds: seconds a lease lasts without being renewed
+    # heartbeat_seconds: seconds between renewals; by default, a third of
+    #   lease_seconds
+    # owner: ID of this worker in the leases it holds
+    # clock: function returning the current (wall-clock) time
+    def __init__(self, directory, shard_rows = 1000, lease_seconds = 10 * 60,
+                 heartbeat_seconds = None, owner = None, clock = time.time, log = print):
+        self.directory = directory
+        self.shard_rows = shard_rows
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds if (heartbeat_seconds is not None) \
+            else lease_seconds / 3
+        self.owner = owner if (owner is not None) else default_owner()
+        self.clock = clock
+        self.log = log
+        os.makedirs(directory, exist_ok = True)
+
+    @contextlib.contextmanager
+    def locked(self):
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as f:
+            fcntl.lockf(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(f, fcntl.LOCK_UN)
+
+    # Only call these while holding the lock
+    def read_state(self):
+        try:
+            with open(os.path.join(self.directory, STATE_FILE), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_state(self, state):
+        path = os.path.join(self.directory, STATE_FILE)
+        tmp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent = 1, sort_keys = True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    # Split n_rows rows into shards, unless the directory already has a plan,
+    # and return the number of shards. Every worker must be working through
+    # the same parcels file.
+    def setup(self, n_rows):
+        with self.locked():
+            state = self.read_state()
+            if (state is None):
+                state = {
+                    "rows": int(n_rows),
+                    "shard_rows": self.shard_rows,
+                    "done": [],
+                    "leases": {},
+                }
+                self.write_state(state)
+            elif (state["rows"] != n_rows):
+                raise ValueError("%s was set up for %d rows, not %d" % (
+                    self.directory, state["rows"], n_rows
+                ))
+            return self.n_shards(state)
+
+    def n_shards(self, state):
+        return -(-state["rows"] // state["shard_rows"])
+
+    def shard(self, state, index):
+        start = index * state["shard_rows"]
+        return Shard(index, start, min(start + state["shard_rows"], state["rows"]))
+
+    # Lease the first shard that isn't done and isn't leased by a live worker,
+    # returning a Lease (not yet started), or None if there is no such shard
+    def acquire(self):
+        with self.locked():
+            state = self.read_state()
+            now = self.clock()
+            done = set(state["done"])
+            for index in range(self.n_shards(state)):
+                lease = state["leases"].get(str(index))
+                if ((index in done) or ((lease is not None) and (lease["expires"] > now))):
+                    continue
+                if (lease is not None):
+                    self.log("Taking over shard %d from %s, whose lease expired %0.0f seconds ago" % (
+                        index, lease["owner"], now - lease["expires"]
+                    ))
+                token = uuid.uuid4().hex
+                expires = now + self.lease_seconds
+                state["leases"][str(index)] = {
+                    "owner": self.owner,
+                    "token": token,
+                    "expires": expires,
+                    "renewed": now,
+                }
+                self.write_state(state)
+                return Lease(self, self.shard(state, index), token, expires)
+        return None
+
+    # Extend a lease, or mark it lost if another worker has taken the shard
+    def renew(self, lease):
+        with self.locked():
+            state = self.read_state()
+            now = self.clock()
+            current = state["leases"].get(str(lease.shard.index))
+            if ((current is None) or (current["token"] != lease.token)):
+                lease.lost = True
+                return
+            current["expires"] = now + self.lease_seconds
+            current["renewed"] = now
+            self.write_state(state)
+            lease.expires = current["expires"]
+
+    # Give up a lease, marking its shard done if every row was posted
+    def release(self, lease, done = False):
+        lease.stop()
+        with self.locked():
+            state = self.read_state()
+            current = state["leases"].get(str(lease.shard.index))
+            if ((current is None) or (current["token"] != lease.token)):
+                return
+            del state["leases"][str(lease.shard.index)]
+            if (done):
+                state["done"] = sorted(set(state["done"]) | {lease.shard.index})
+            self.write_state(state)
+
+    # True if every shard is done
+    def finished(self):
+        with self.locked():
+            state = self.read_state()
+            return len(state["done"]) == self.n_shards(state)
+
+    # Return a list of (shard, state, owner, seconds left on the lease,
+    # (index, next_offset) of the last row in the shard's journal) tuples
+    def status(self):
+        with self.locked():
+            state = self.read_state()
+        now = self.clock()
+        rows = []
+        for index in range(self.n_shards(state)):
+            shard = self.shard(state, index)
+            lease = state["leases"].get(str(index))
+            if (index in state["done"]):
+                (status, owner, left) = ("done", None, None)
+            elif (lease is None):
+                (status, owner, left) = ("waiting", None, None)
+            else:
+                left = lease["expires"] - now
+                (status, owner) = ("leased" if (left > 0) else "expired", lease["owner"])
+            rows.append((shard, status, owner, left, journal.position(
+                os.path.join(self.directory, journal_name(index))
+            )))
+        return rows
+
+    # Lease shards one after another and call run_shard with each Lease,
+    # while its heartbeat is running, until every shard is done. run_shard
+    # returns True if it posted every row of the shard. When the only shards
+    # left are leased by other workers, wait poll_seconds and try again, in
+    # case one of them dies.
+    def work(self, run_shard, poll_seconds = 60, sleep = time.sleep):
+        while (True):
+            lease = self.acquire()
+            if (lease is None):
+                if (self.finished()):
+                    return
+                sleep(poll_seconds)
+                continue
+            self.log("Leased shard %d (rows %d to %d)" % (
+                lease.shard.index, lease.shard.start, lease.shard.stop - 1
+            ))
+            done = False
+            try:
+                with lease:
+                    done = run_shard(lease) and lease.held
+            finally:
+                self.release(lease, done = done)
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory")
+    args = parser.parse_args()
+
+    table = ShardTable(args.directory)
+    print("%6s %8s %8s %8s %10s %8s  %s" % (
+        "shard", "first", "last", "state", "lease left", "posted", "owner"
+    ))
+    for (shard, status, owner, left, (last_index, _)) in table.status():
+        print("%6d %8d %8d %8s %10s %8s  %s" % (
+            shard.index, shard.start, shard.stop - 1, status,
+            "" if (left is None) else "%0.0fs" % left,
+            "" if (last_index is None) else last_index,
+            owner or ""
+        ))
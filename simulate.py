@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# Load simulator for the posting loop. The real runner (see runner.py) is run
+# over a synthetic dataset (see synthetic.py) on a virtual clock, against
+# stand-ins for Twitter, Slack and Google Street View that add simulated
+# latency and fail at configurable rates, so that thousands of hourly posting
+# cycles, with their crashes and reboots, are replayed in seconds. Reports the
+# cycles simulated per second of real time, the simulated latency of each
+# stage of a cycle, and how long the bot took to recover from each failure.
+#
+# usage: ./simulate.py [-c CYCLES] [--seed SEED] [--error-rate RATE]
+#                      [--timeout-rate RATE] [--missing-image-rate RATE]
+
+import argparse
+import contextlib
+import os
+import random
+import tempfile
+import time
+
+import numpy
+
+import bot
+import crash_reports
+import image_cache
+import journal
+import metrics
+import posting
+import runner
+import synthetic
+
+# Simulated latencies, in seconds, as (mean, standard deviation)
+UPLOAD_LATENCY = (1.5, 0.5)
+UPDATE_STATUS_LATENCY = (0.4, 0.15)
+STREETVIEW_LATENCY = (0.8, 0.3)
+
+# Seconds a request hangs for before a simulated timeout
+TIMEOUT_SECONDS = 60
+
+# Decides, for each simulated request, how long it takes and whether it fails
+class FailureInjector(object):
+
+    def __init__(self, clock, seed = 0, error_rate = 0.0, timeout_rate = 0.0):
+        self.clock = clock
+        self.random = numpy.random.RandomState(seed)
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+
+    # Advance the clock by a request's latency, then raise if it failed. If
+    # request is given, it is made before a timeout half of the time, as if
+    # the request went through but the response was lost.
+    def request(self, latency, request = None):
+        draw = self.random.uniform()
+        if (draw < self.timeout_rate):
+            if ((request is not None) and (self.random.uniform() < 0.5)):
+                request()
+            self.clock.sleep(TIMEOUT_SECONDS)
+            raise TimeoutError("simulated timeout after %d seconds" % TIMEOUT_SECONDS)
+        (mean, deviation) = latency
+        self.clock.sleep(max(0.0, self.random.normal(mean, deviation)))
+        if (draw < self.timeout_rate + self.error_rate):
+            raise synthetic.StubHTTPError(503)
+        if (request is not None):
+            return request()
+
+# StubTwitterAPI with simulated latency, 503s and timeouts, which rejects
+# duplicate statuses
+class FlakyTwitterAPI(synthetic.StubTwitterAPI):
+
+    def __init__(self, injector):
+        super().__init__(reject_duplicates = True)
+        self.injector = injector
+
+    def media_upload(self, filename, **kwargs):
+        self.injector.request(UPLOAD_LATENCY)
+        return super().media_upload(filename, **kwargs)
+
+    def update_status(self, status, **kwargs):
+        parent = super()
+        return self.injector.request(
+            UPDATE_STATUS_LATENCY, lambda: parent.update_status(status, **kwargs)
+        )
+
+# StubStreetViewBackend with simulated latency and failures, that has no image
+# for a fraction of locations
+class FlakyStreetViewBackend(synthetic.StubStreetViewBackend):
+
+    def __init__(self, injector, missing_rate = 0.0):
+        super().__init__()
+        self.injector = injector
+        self.missing_rate = missing_rate
+
+    def fetch(self, location, size):
+        self.injector.request(STREETVIEW_LATENCY)
+        if (self.injector.random.uniform() < self.missing_rate):
+            return None
+        return super().fetch(location, size)
+
+# Summarize a list of durations in seconds
+def describe(durations):
+    durations = numpy.asarray(durations, dtype = float)
+    return {
+        "count": len(durations),
+        "mean": durations.mean(),
+        "p50": numpy.percentile(durations, 50),
+        "p95": numpy.percentile(durations, 95),
+        "max": durations.max(),
+    }
+
+# metrics_dir: directory to write the metrics log and Prometheus file of the
+# simulated cycles to, or None
+def simulate(cycles = 5000, seed = 0, error_rate = 0.02, timeout_rate = 0.005,
+             missing_image_rate = 0.05, parcels = None, metrics_dir = None):
+    parcels = parcels if (parcels is not None) else cycles + cycles // 5 + 100
+
+    with tempfile.TemporaryDirectory(prefix = "bariexplorer_sim_") as directory:
+        paths = synthetic.write(directory, n_parcels = parcels, seed = seed)
+        status_path = os.path.join(directory, "last_idx.txt")
+        journal_path = os.path.join(directory, bot.JOURNAL_FILE)
+        cache_dir = os.path.join(directory, "cache")
+
+        clock = runner.VirtualClock()
+        injector = FailureInjector(clock, seed, error_rate, timeout_rate)
+        twitter = FlakyTwitterAPI(injector)
+        posting_client = posting.PostingClient(
+            twitter, clock, limits = bot.TWITTER_RATE_LIMITS,
+            max_retries = bot.POSTING_MAX_RETRIES, backoff = bot.POSTING_BACKOFF,
+            seed = seed
+        )
+        slack_client = synthetic.StubSlackClient()
+        # crash reports are handled as they are made, on the virtual clock
+        crash_reporter = crash_reports.CrashReporter(
+            slack_client, "#simulated",
+            digest_seconds = bot.CRASH_DIGEST_SECONDS, quiet_seconds = bot.CRASH_QUIET_SECONDS,
+            max_uploads = bot.CRASH_UPLOADS_PER_HOUR, rate_seconds = 60 * 60,
+            background = False, clock = clock.now, log = lambda *args: None
+        )
+        streetview = image_cache.StreetViewCache(
+            os.path.join(directory, "streetview"), 1024 ** 3,
+            FlakyStreetViewBackend(injector, missing_image_rate)
+        )
+
+        metrics_log = None
+        if (metrics_dir is not None):
+            os.makedirs(metrics_dir, exist_ok = True)
+            metrics_log = metrics.MetricsLog(
+                os.path.abspath(os.path.join(metrics_dir, os.path.basename(bot.METRICS_LOG))),
+                os.path.abspath(os.path.join(metrics_dir, os.path.basename(bot.METRICS_PROM)))
+            )
+
+        bot.DATA = synthetic.data_context(paths, cache_dir).preload()
+        bot.STREETVIEW_CACHE = streetview
+        random.seed(seed)
+
+        # Threads are prepared inline (prefetch depth 0) so that every request
+        # is made from this thread, in the same order on every run
+        bot_runner = runner.Runner(
+            bot.eligible_parcels(bot.resume_parcels(
+                paths["parcels"], status_path, cache_dir, journal_path
+            )),
+            lambda row: bot.prepare_thread(row, "simulated", timer = clock.now),
+            twitter = posting_client,
+            slack = slack_client,
+            slack_channel = "#simulated",
+            clock = clock,
+            journal = journal.Journal(journal_path, bot.JOURNAL_COMPACT_EVERY, clock = clock.now),
+            streetview = streetview,
+            prefetch_depth = 0,
+            sleep_time = bot.SLEEP_TIME,
+            reboot_time = bot.REBOOT_TIME,
+            metrics = metrics_log,
+            slow_stage_seconds = bot.SLOW_STAGE_SECONDS,
+            thread_attempts = bot.THREAD_ATTEMPTS,
+            crash_reporter = crash_reporter,
+            log = lambda *args: None
+        )
+
+        # the loop's diagnostic output (skipped rows, Street View errors) is
+        # discarded
+        previous_dir = os.getcwd()
+        os.chdir(directory)
+        started = time.perf_counter()
+        try:
+            with open(os.devnull, "w") as devnull:
+                with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+                    bot_runner.run(max_cycles = cycles)
+            crash_reporter.close()
+            bot_runner.journal.close()
+        finally:
+            os.chdir(previous_dir)
+        elapsed = time.perf_counter() - started
+
+    counts = bot_runner.counts
+    print("%d cycles (%d posted, %d failed, %d parcels given up on) in %0.1f seconds: %0.0f cycles/second" % (
+        counts["cycles"], counts["posted"], counts["failed"], counts["abandoned"],
+        elapsed, counts["cycles"] / elapsed
+    ))
+    print("%d Twitter calls, %d retried after a 429 or 503, %d duplicates found already posted" % (
+        posting_client.stats["calls"], posting_client.stats["retries"],
+        posting_client.stats["duplicates"]
+    ))
+    print("simulated %0.1f days; %d tweets, %d uploads, %d Street View requests" % (
+        clock.now() / (24 * 60 * 60), len(twitter.statuses), len(twitter.uploads),
+        streetview.backend.requests
+    ))
+    print("%d crashes sent to Slack in %d uploads, %d of them digests" % (
+        crash_reporter.stats["reports"], len(slack_client.uploads), crash_reporter.stats["digests"]
+    ))
+    print("")
+    print("%-20s %7s %10s %10s %10s %10s" % ("stage (seconds)", "count", "mean", "p50", "p95", "max"))
+    rows = sorted(bot_runner.stage_durations.items())
+    if (len(bot_runner.recovery_times) > 0):
+        rows.append(("recovery", bot_runner.recovery_times))
+    for (name, durations) in rows:
+        stats = describe(durations)
+        print("%-20s %7d %10.2f %10.2f %10.2f %10.2f" % (
+            name, stats["count"], stats["mean"], stats["p50"], stats["p95"], stats["max"]
+        ))
+    return bot_runner
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--cycles", type = int, default = 5000)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--error-rate", dest = "error_rate", type = float, default = 0.02,
+                        help = "fraction of requests that fail with a 503")
+    parser.add_argument("--timeout-rate", dest = "timeout_rate", type = float, default = 0.005,
+                        help = "fraction of requests that time out")
+    parser.add_argument("--missing-image-rate", dest = "missing_image_rate", type = float, default = 0.05,
+                        help = "fraction of Street View locations with no image")
+    parser.add_argument("--metrics-dir", dest = "metrics_dir", default = None,
+                        help = "write the metrics of the simulated cycles to this directory")
+    args = parser.parse_args()
+
+    simulate(
+        args.cycles, args.seed, args.error_rate, args.timeout_rate,
+        args.missing_image_rate, metrics_dir = args.metrics_dir
+    )
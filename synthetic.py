@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+# Synthetic stand-ins for the bot's data and the services it talks to, for
+# benchmarks and simulations that can't use the real CSV files or live APIs.
+# The datasets are random but seeded, so the same seed always produces the
+# same files, and they have the same columns and value formats as the real
+# parcels, tracts, block groups, neighborhoods and stops files.
+#
+# usage: ./synthetic.py OUTPUT_DIR [-n PARCELS] [--seed SEED]
+
+import argparse
+import itertools
+import os
+import time
+
+import numpy
+import pandas
+
+import bot
+
+# Neighborhoods and some of their sections, in the slash-separated format of
+# the parcels file's "section" column
+NEIGHBORHOOD_SECTIONS = {
+    "Allston": ["Allston", "Lower Allston", "Unnamed"],
+    "Back Bay": ["Back Bay"],
+    "Beacon Hill": ["Beacon Hill"],
+    "Brighton": ["Brighton", "Cleveland Circle (/Brighton)", "Oak Square/Brighton"],
+    "Charlestown": ["Charlestown", "Unnamed"],
+    "Dorchester": ["Fields Corner", "Savin Hill/Dorchester", "Codman Square"],
+    "Downtown": ["Downtown Crossing", "Financial District"],
+    "East Boston": ["Eagle Hill", "Jeffries Point", "Orient Heights"],
+    "Fenway": ["Fenway/West Fens", "Audubon Circle"],
+    "Hyde Park": ["Hyde Park", "Readville"],
+    "Jamaica Plain": ["Jamaica Plain", "Forest Hills", "Hyde Square"],
+    "Leather District": ["Leather District"],
+    "Mattapan": ["Mattapan"],
+    "Mission Hill": ["Mission Hill"],
+    "North End": ["North End"],
+    "Roslindale": ["Roslindale Square", "Unnamed"],
+    "Roxbury": ["Dudley/Roxbury", "Fort Hill", "Grove Hall"],
+    "South Boston": ["City Point", "Andrew Square"],
+    "South Boston Waterfront": ["Seaport"],
+    "South End": ["South End", "Lower Roxbury/South End"],
+    "West End": ["West End"],
+    "West Roxbury": ["West Roxbury", "Unnamed"],
+}
+
+STREET_NAMES = [
+    "DAY", "WAYMOUNT", "CENTRE", "WASHINGTON", "BLUE HILL", "COMMONWEALTH",
+    "DORCHESTER", "HYDE PARK", "TREMONT", "MASSACHUSETTS", "BEACON", "BOYLSTON",
+    "SAINT JAMES", "MOUNT VERNON", "LAGRANGE", "SOUTH HUNTINGTON",
+]
+STREET_SUFFIXES = list(bot.ST_NAME_SUF_MAPPING) + ["ST", "RD", "SQ"]
+LAND_USES = ["R1", "R2", "R3", "R4", "CD", "CM", "A", "RL"] + list(bot.LU_MAPPING)
+BUILDING_STYLES = list(bot.R_BLDG_STYL_MAPPING) + ["CN", "CV", "OT"]
+PERMIT_TYPES = list(bot.PERMIT_TYPE_MAPPING)
+STOP_TYPES = ["Bus", "Subway"]
+SUBWAY_ROUTES = ["Red", "Orange", "Blue", "Green-B", "Green-C", "Green-D", "Green-E", "Mattapan"]
+
+# Fraction of rows with a missing value in each nullable column
+MISSING_FRACTIONS = {
+    "ST_NUM": 0.05,
+    "ST_NAME_SUF": 0.02,
+    "R_BLDG_STYL": 0.4,
+    "YR_BUILT": 0.1,
+    "ISSUED_DATE": 0.3,
+}
+
+# Return a dict of DataFrames with the keys "parcels", "tracts", "blockgroups",
+# "neighborhoods" and "stops", holding n_parcels synthetic parcels in n_tracts
+# tracts, and a stop for every ten parcels (up to 8,000, about as many as the
+# MBTA has)
+def generate(n_parcels = 100000, n_tracts = 180, seed = 0):
+    random = numpy.random.RandomState(seed)
+
+    neighborhoods = pandas.DataFrame({
+        "Name": list(NEIGHBORHOOD_SECTIONS),
+        "n_bus_lines": random.randint(2, 40, len(NEIGHBORHOOD_SECTIONS)),
+        "n_subway_lines": random.randint(0, 5, len(NEIGHBORHOOD_SECTIONS)),
+    })
+
+    tract_ids = 25025000000 + numpy.sort(random.choice(
+        numpy.arange(100, 180000), n_tracts, replace = False
+    ))
+    tracts = pandas.DataFrame({
+        "CT_ID_10": tract_ids,
+        "PopDen": random.uniform(500, 60000, n_tracts).round(2),
+        "RentersPer": random.uniform(0.05, 0.95, n_tracts).round(4),
+        "MedGrossRent": random.randint(700, 3500, n_tracts),
+        "highSchoolDegreeOrless": random.uniform(5, 60, n_tracts).round(1),
+        "completedCollegeOrBachelorDegree": random.uniform(10, 50, n_tracts).round(1),
+        "graduateDegree": random.uniform(2, 45, n_tracts).round(1),
+        "EthHet": random.uniform(0.05, 0.8, n_tracts).round(4),
+    })
+    ages = random.dirichlet([2, 3, 4, 1.5], n_tracts) * 100
+    for (i, column) in enumerate(["AgeU18", "Age18to34", "Age35to64", "Age65Over"]):
+        tracts[column] = ages[:, i].round(1)
+    for (column, pctile_column) in [
+        ("PopDen", "PopDenPctile"),
+        ("MedGrossRent", "MedGrossRentPctile"),
+        ("EthHet", "EthHetPctile"),
+    ]:
+        tracts[pctile_column] = tracts[column].rank(pct = True).round(4)
+
+    blockgroup_ids = numpy.array([
+        tract_id * 10 + group
+        for tract_id in tract_ids
+        for group in range(1, random.randint(2, 5))
+    ])
+    blockgroups = pandas.DataFrame({
+        "BG_ID_10": blockgroup_ids,
+        "MEDIAN_TRANSIT_METERS": random.uniform(40, 1500, len(blockgroup_ids)).round(1),
+    })
+
+    # each parcel is in a random block group, whose tract is its tract
+    parcel_blockgroups = blockgroup_ids[random.randint(0, len(blockgroup_ids), n_parcels)]
+    neighborhood_names = numpy.array(list(NEIGHBORHOOD_SECTIONS))
+    parcel_neighborhoods = neighborhood_names[random.randint(0, len(neighborhood_names), n_parcels)]
+    parcels = pandas.DataFrame({
+        "Land_Parcel_ID": 100000000 + random.choice(
+            numpy.arange(n_parcels * 10), n_parcels, replace = False
+        ),
+        "ST_NUM": random.randint(1, 400, n_parcels).astype(str),
+        "ST_NAME": random.choice(STREET_NAMES, n_parcels),
+        "ST_NAME_SUF": random.choice(STREET_SUFFIXES, n_parcels),
+        "LU": random.choice(LAND_USES, n_parcels),
+        "R_BLDG_STYL": random.choice(BUILDING_STYLES, n_parcels),
+        "YR_BUILT": random.randint(1750, 2019, n_parcels).astype(float),
+        "neighborhood": parcel_neighborhoods,
+        "section": [
+            NEIGHBORHOOD_SECTIONS[name][random.randint(len(NEIGHBORHOOD_SECTIONS[name]))]
+            for name in parcel_neighborhoods
+        ],
+        "AV_TOTAL": random.randint(1000, 20000000, n_parcels),
+        "ISSUED_DATE": random.randint(2006, 2020, n_parcels).astype(float),
+        "permittypedescr": random.choice(PERMIT_TYPES, n_parcels),
+        "x": random.uniform(-71.19, -70.99, n_parcels).round(6),
+        "y": random.uniform(42.23, 42.40, n_parcels).round(6),
+        "CT_ID_10": parcel_blockgroups // 10,
+        "BG_ID_10": parcel_blockgroups,
+        "STOP_TYPE": random.choice(STOP_TYPES, n_parcels),
+        "STOP_NAME": ["Stop %d" % stop for stop in random.randint(1, 8000, n_parcels)],
+        "NEAREST_TRANSIT_SECONDS": random.uniform(20, 1800, n_parcels).round(1),
+    })
+    for (column, fraction) in MISSING_FRACTIONS.items():
+        parcels[column] = parcels[column].where(random.uniform(size = n_parcels) >= fraction)
+    parcels.loc[parcels["ISSUED_DATE"].isnull(), "permittypedescr"] = numpy.nan
+
+    # stops are in GTFS stops.txt format, with the routes serving each stop
+    n_stops = max(20, min(8000, n_parcels // 10))
+    vehicle_types = numpy.where(random.uniform(size = n_stops) < 0.05, 1, 3)
+    stops = pandas.DataFrame({
+        "stop_id": numpy.arange(1, n_stops + 1).astype(str),
+        "stop_name": ["Stop %d" % stop for stop in range(1, n_stops + 1)],
+        "stop_lat": random.uniform(42.23, 42.40, n_stops).round(6),
+        "stop_lon": random.uniform(-71.19, -70.99, n_stops).round(6),
+        "location_type": 0,
+        "vehicle_type": vehicle_types,
+        "routes": [
+            ";".join(random.choice(SUBWAY_ROUTES, random.randint(1, 3), replace = False))
+            if (vehicle_type == 1) else
+            ";".join(str(route) for route in random.randint(1, 120, random.randint(1, 4)))
+            for vehicle_type in vehicle_types
+        ],
+    })
+
+    return {
+        "parcels": parcels,
+        "tracts": tracts,
+        "blockgroups": blockgroups,
+        "neighborhoods": neighborhoods,
+        "stops": stops,
+    }
+
+# Write a synthetic dataset to CSV files in directory, returning a dict of the
+# paths to each file, keyed like the DataFrames returned by generate
+def write(directory, **kwargs):
+    os.makedirs(directory, exist_ok = True)
+    paths = {}
+    for (name, df) in generate(**kwargs).items():
+        paths[name] = os.path.join(directory, "%s.csv" % name)
+        df.to_csv(paths[name], index = False)
+    return paths
+
+# Return a DataContext that loads the attribute files of a synthetic dataset
+# written by write
+def data_context(paths, cache_dir = None):
+    return bot.DataContext(
+        tracts_path = paths["tracts"],
+        neighborhoods_path = paths["neighborhoods"],
+        blockgroups_path = paths["blockgroups"],
+        cache_dir = cache_dir,
+        parcels_path = paths["parcels"],
+        stops_path = paths.get("stops")
+    )
+
+################################################################################
+# Stand-in services ############################################################
+
+# Street View backend for image_cache.StreetViewCache that makes up a small
+# image for every location, except for those listed in missing
+class StubStreetViewBackend(object):
+
+    def __init__(self, image_bytes = 4096, missing = ()):
+        self.image_bytes = image_bytes
+        self.missing = set(missing)
+        self.requests = 0
+
+    def fetch(self, location, size):
+        self.requests += 1
+        if (location in self.missing):
+            return None
+        header = ("%s|%s|" % (location, size)).encode("utf-8")
+        return (header * (self.image_bytes // len(header) + 1))[:self.image_bytes]
+
+# Posted status. Like Twitter, a t.co link to a status's media is appended to
+# its text, and listed in its entities.
+class StubStatus(object):
+
+    def __init__(self, id, text, **kwargs):
+        self.id = id
+        self.status = text
+        self.entities = {}
+        if (len(kwargs.get("media_ids") or []) > 0):
+            url = "https://t.co/media%d" % id
+            text = "%s %s" % (text, url)
+            self.entities["media"] = [{"url": url}]
+        self.text = text
+        self.full_text = text
+        self.in_reply_to_status_id = kwargs.get("in_reply_to_status_id")
+        self.kwargs = kwargs
+
+class StubMedia(object):
+
+    def __init__(self, media_id):
+        self.media_id = media_id
+
+# Raised by the stand-in services in place of an HTTP error response, with
+# the status code and Twitter API error code that tweepy's errors carry
+class StubHTTPError(Exception):
+
+    def __init__(self, status_code, api_code = None):
+        super().__init__("HTTP %d%s" % (
+            status_code, (" (error %d)" % api_code) if (api_code is not None) else ""
+        ))
+        self.status_code = status_code
+        self.api_code = api_code
+
+# Stand-in for tweepy.API that records what would have been posted. With
+# reject_duplicates, a status with the same text as one of the last 20 is
+# rejected like Twitter does.
+class StubTwitterAPI(object):
+
+    def __init__(self, reject_duplicates = False):
+        self.ids = itertools.count(1)
+        self.statuses = []
+        self.uploads = []
+        self.reject_duplicates = reject_duplicates
+
+    def media_upload(self, filename, **kwargs):
+        with open(filename, "rb"):
+            pass # fail like tweepy would if the file is missing
+        self.uploads.append(filename)
+        return StubMedia(next(self.ids))
+
+    def update_status(self, status, **kwargs):
+        if (self.reject_duplicates and any(
+                posted.status == status for posted in self.statuses[-20:])):
+            raise StubHTTPError(403, 187)
+        status = StubStatus(next(self.ids), status, **kwargs)
+        self.statuses.append(status)
+        return status
+
+    def user_timeline(self, count = 20, **kwargs):
+        return self.statuses[::-1][:count]
+
+# Stand-in for slack.WebClient that records the files it would have uploaded
+class StubSlackClient(object):
+
+    # latency: seconds each upload takes
+    # fail: if True, every upload raises an error, as when Slack is down
+    def __init__(self, latency = 0.0, fail = False, sleep = time.sleep):
+        self.latency = latency
+        self.fail = fail
+        self.sleep = sleep
+        self.uploads = []
+
+    def files_upload(self, **kwargs):
+        if (self.latency > 0):
+            self.sleep(self.latency)
+        if (self.fail):
+            raise ConnectionError("simulated Slack outage")
+        self.uploads.append(kwargs)
+        return {"ok": True}
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output_dir")
+    parser.add_argument("-n", "--parcels", type = int, default = 100000)
+    parser.add_argument("--tracts", type = int, default = 180)
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    for (name, path) in write(
+            args.output_dir, n_parcels = args.parcels,
+            n_tracts = args.tracts, seed = args.seed).items():
+        print("%s: %s" % (name, path))
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot
+import synthetic
+
+# Paths to a small synthetic dataset (see synthetic.py), with bot.DATA loading
+# its attribute files through a cache in the same temporary directory
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    paths = synthetic.write(str(tmp_path / "data"), n_parcels = 2000, n_tracts = 20)
+    monkeypatch.setattr(bot, "DATA", synthetic.data_context(paths, str(tmp_path / "cache")))
+    bot.PHRASES.clear()
+    return paths
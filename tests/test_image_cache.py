@@ -0,0 +1,33 @@
+import os
+
+import image_cache
+import synthetic
+
+def image_files(directory):
+    return sorted(name for name in os.listdir(directory) if (name.endswith(image_cache.IMAGE_EXTENSION)))
+
+def test_caches_sharing_a_directory_stay_within_max_bytes(tmp_path):
+    directory = str(tmp_path / "streetview")
+    backend = synthetic.StubStreetViewBackend(image_bytes = 1000)
+    caches = [image_cache.StreetViewCache(directory, 5000, backend) for _ in range(2)]
+
+    for i in range(20):
+        caches[i % 2].get("%d Day St., Boston" % i, "1200x675")
+        assert len(image_files(directory)) <= 5
+    assert caches[0].read_total() == 5000
+
+    # the latest images are kept, whichever cache downloaded them
+    for i in range(15, 20):
+        assert os.path.isfile(caches[0].get("%d Day St., Boston" % i, "1200x675"))
+    assert backend.requests == 20
+
+def test_image_from_another_cache_is_a_hit(tmp_path):
+    directory = str(tmp_path / "streetview")
+    backend = synthetic.StubStreetViewBackend()
+    first = image_cache.StreetViewCache(directory, 10 ** 6, backend)
+    second = image_cache.StreetViewCache(directory, 10 ** 6, backend)
+
+    path = first.get("72 Day St., Boston", "1200x675")
+    assert second.get("72 Day St., Boston", "1200x675") == path
+    assert second.stats["hits"] == 1
+    assert backend.requests == 1
@@ -0,0 +1,37 @@
+import metrics
+
+def test_owner_path_keeps_extension():
+    assert metrics.owner_path("./bariexplorer.prom", "host:123:ab12") == "./bariexplorer.host_123_ab12.prom"
+    assert metrics.owner_path("./metrics.jsonl", "host:123:ab12") == "./metrics.host_123_ab12.jsonl"
+
+def test_prometheus_file_is_replaced(tmp_path):
+    path = str(tmp_path / "bariexplorer.prom")
+    log = metrics.MetricsLog(prom_path = path)
+    for outcome in ["posted", "failed"]:
+        log.record({"time": 0.0, "outcome": outcome, "stages": {"thread": 1.5}})
+    with open(path, "r") as f:
+        text = f.read()
+    assert "bariexplorer_cycles_total{outcome=\"failed\"} 1" in text
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["bariexplorer.prom"]
+
+def test_every_series_has_the_worker_label(tmp_path):
+    log = metrics.MetricsLog(labels = {"worker": "bot-1"})
+    log.record({
+        "time": 0.0, "outcome": "posted", "stages": {"thread": 1.5},
+        "gauges": {"queue_depth": 2}
+    })
+    series = [
+        line for line in log.prometheus_text().splitlines()
+        if (not line.startswith("#"))
+    ]
+    assert len(series) > 0
+    for line in series:
+        assert "{worker=\"bot-1\"" in line
+    assert "bariexplorer_cycles_total{worker=\"bot-1\",outcome=\"posted\"} 1" in series
+
+def test_prometheus_file_is_removed_on_close(tmp_path):
+    path = str(tmp_path / "bariexplorer.prom")
+    with metrics.MetricsLog(prom_path = path) as log:
+        log.record({"time": 0.0, "outcome": "posted", "stages": {"thread": 1.5}})
+        assert (tmp_path / "bariexplorer.prom").exists()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,58 @@
+import posting
+import runner
+import synthetic
+
+# A StubTwitterAPI whose first update_status posts the status but times out
+# before the response arrives, as a lost response would
+class LostResponseTwitterAPI(synthetic.StubTwitterAPI):
+
+    def __init__(self):
+        super().__init__(reject_duplicates = True)
+        self.lost = False
+
+    def update_status(self, status, **kwargs):
+        posted = super().update_status(status, **kwargs)
+        if (not self.lost):
+            self.lost = True
+            raise TimeoutError("simulated timeout")
+        return posted
+
+def test_duplicate_with_image_returns_posted_status():
+    twitter = synthetic.StubTwitterAPI(reject_duplicates = True)
+    client = posting.PostingClient(twitter, runner.VirtualClock())
+    media_id = twitter.media_upload(__file__).media_id
+    posted = client.update_status("72 Day St. is a parcel. (1/2)", media_ids = [media_id])
+    assert posted.full_text.endswith(posted.entities["media"][0]["url"])
+
+    # the retry is rejected as a duplicate, and the status found by its text
+    # without the link to its image
+    assert client.update_status("72 Day St. is a parcel. (1/2)", media_ids = [media_id]) is posted
+    assert client.stats["duplicates"] == 1
+    assert len(twitter.statuses) == 1
+
+def test_posted_text_strips_trailing_media_links():
+    status = synthetic.StubStatus(1, "A &amp; B https://t.co/abc123 https://t.co/def456")
+    assert posting.posted_text(status) == "A & B"
+
+def test_thread_with_image_survives_lost_main_tweet_response(tmp_path):
+    image = tmp_path / "gsv.jpg"
+    image.write_bytes(b"jpeg")
+    thread = {
+        "main": {"message": "72 Day St. is a parcel.", "images": [str(image)]},
+        "reply": {"message": "The closest MBTA bus stop is Stop 1.", "images": []},
+        "generator": "generate_neighborhood_tweet",
+        "missing_images": [],
+    }
+    twitter = LostResponseTwitterAPI()
+    clock = runner.VirtualClock()
+    bot_runner = runner.Runner(
+        [(0, 100, {"Land_Parcel_ID": 1})], lambda row: dict(thread),
+        twitter = posting.PostingClient(twitter, clock), slack = synthetic.StubSlackClient(),
+        slack_channel = "#test", clock = clock, prefetch_depth = 0, log = lambda *args: None
+    )
+    assert bot_runner.run()
+
+    assert bot_runner.counts["posted"] == 1
+    assert bot_runner.counts["abandoned"] == 0
+    assert len(twitter.statuses) == 2
+    assert twitter.statuses[1].in_reply_to_status_id == twitter.statuses[0].id
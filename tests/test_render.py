@@ -0,0 +1,34 @@
+import os
+
+import bot
+import render
+
+def job(tmp_path, name, digest):
+    return render.Job("tract_age_graph", str(tmp_path / name), digest, {})
+
+def test_images_not_drawn_by_render_are_kept(tmp_path):
+    for name in ["handmade.png", "drawn.png", "outdated.png"]:
+        (tmp_path / name).write_bytes(b"png")
+    manifest = {
+        os.path.normpath(str(tmp_path / "drawn.png")): "current",
+        os.path.normpath(str(tmp_path / "outdated.png")): "old",
+    }
+    jobs = [
+        job(tmp_path, "handmade.png", "current"),
+        job(tmp_path, "drawn.png", "current"),
+        job(tmp_path, "outdated.png", "current"),
+        job(tmp_path, "missing.png", "current"),
+    ]
+
+    (stale, kept) = render.stale_jobs(jobs, manifest)
+    assert [os.path.basename(job.path) for job in stale] == ["outdated.png", "missing.png"]
+    assert [os.path.basename(job.path) for job in kept] == ["handmade.png"]
+
+def test_age_graphs_show_ages(dataset):
+    jobs = render.tract_graph_jobs({})
+    assert len(jobs) == 20
+    for graph in jobs:
+        assert os.path.dirname(os.path.normpath(graph.path)) == os.path.normpath(bot.TRACT_AGE_GRAPHS)
+        assert [label for (label, _) in graph.payload["values"]] == [
+            label for (_, label) in render.TRACT_GRAPH_COLUMNS
+        ]
@@ -0,0 +1,66 @@
+import pandas
+import pytest
+
+import bot
+
+def resumed_rows(paths, tmp_path, cache, status_path = None, **kwargs):
+    cache_dir = str(tmp_path / "cache") if (cache) else None
+    return [
+        (index, int(next_offset), row.Land_Parcel_ID, row.STOP_NAME)
+        for (index, next_offset, row) in bot.resume_parcels(
+            paths["parcels"], status_path, cache_dir = cache_dir, **kwargs
+        )
+    ]
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_reads_every_row(dataset, tmp_path, cache):
+    rows = resumed_rows(dataset, tmp_path, cache)
+    assert [index for (index, _, _, _) in rows] == list(range(2000))
+    assert [offset for (_, offset, _, _) in rows] == list(bot.parcel_offsets(dataset["parcels"]))
+
+def test_cached_and_streamed_agree(dataset, tmp_path):
+    assert resumed_rows(dataset, tmp_path, True) == resumed_rows(dataset, tmp_path, False)
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_resumes_after_status(dataset, tmp_path, cache):
+    offsets = bot.parcel_offsets(dataset["parcels"])
+    status_path = str(tmp_path / "last_idx.txt")
+    bot.save_status(1234, offsets[1234], status_path)
+
+    rows = resumed_rows(dataset, tmp_path, cache, status_path)
+    assert rows[0][0] == 1235
+    assert len(rows) == 2000 - 1235
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_reads_one_shard(dataset, tmp_path, cache):
+    rows = resumed_rows(dataset, tmp_path, cache, first_index = 500, stop_index = 1500)
+    assert [index for (index, _, _, _) in rows] == list(range(500, 1500))
+
+# Rows skipped for having no street number may have no street name either, for
+# which there is no street phrase; building the phrase table for the cached
+# parcels mustn't fail on them
+@pytest.mark.parametrize("cache", [False, True])
+def test_skipped_rows_without_street_name(dataset, tmp_path, cache):
+    parcels = pandas.read_csv(dataset["parcels"], dtype = str)
+    parcels.loc[parcels["ST_NUM"].isnull(), "ST_NAME"] = None
+    parcels.to_csv(dataset["parcels"], index = False)
+
+    cache_dir = str(tmp_path / "cache") if (cache) else None
+    eligible = list(bot.eligible_parcels(bot.resume_parcels(
+        dataset["parcels"], None, cache_dir = cache_dir
+    )))
+    assert len(eligible) == parcels["ST_NUM"].notnull().sum()
+    for (_, _, row) in eligible:
+        bot.render_parcel_tweet(row)
+
+def test_cached_shard_only_refreshes_its_rows(dataset, tmp_path, monkeypatch):
+    refreshed = []
+    refresh = bot.DATA.refresh_transit_columns
+    def counting_refresh(parcels):
+        refreshed.append(len(parcels))
+        return refresh(parcels)
+    monkeypatch.setattr(bot.DATA, "refresh_transit_columns", counting_refresh)
+
+    rows = resumed_rows(dataset, tmp_path, True, first_index = 500, stop_index = 1500)
+    assert [index for (index, _, _, _) in rows] == list(range(500, 1500))
+    assert refreshed == [1000]
@@ -0,0 +1,96 @@
+import crash_reports
+import journal
+import runner
+import synthetic
+
+def make_runner(journal_path, twitter, parcels = ()):
+    clock = runner.VirtualClock()
+    slack = synthetic.StubSlackClient()
+    return runner.Runner(
+        parcels, lambda row: None, twitter = twitter, slack = slack,
+        slack_channel = "#test", clock = clock,
+        journal = journal.Journal(journal_path, clock = clock.now),
+        prefetch_depth = 0,
+        crash_reporter = crash_reports.CrashReporter(
+            slack, "#test", background = False, clock = clock.now, log = lambda *args: None
+        ),
+        log = lambda *args: None
+    )
+
+THREAD = {
+    "main": {"message": "72 Day St. is a parcel.", "images": []},
+    "reply": {"message": "The closest MBTA bus stop is Stop 1.", "images": []},
+    "generator": "generate_neighborhood_tweet",
+    "missing_images": [],
+}
+
+def test_finishes_half_posted_thread(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    half_posted = journal.Journal(journal_path)
+    half_posted.record(41, 4100, 100000041, "reply_posted", status_id = 1)
+    half_posted.record(42, 4200, 100000042, "rendered", thread = THREAD)
+    half_posted.record(42, 4200, 100000042, "main_posted", status_id = 77)
+    half_posted.close()
+
+    twitter = synthetic.StubTwitterAPI()
+    bot_runner = make_runner(journal_path, twitter)
+    assert bot_runner.run()
+
+    # only the reply is posted, in reply to the main tweet from the journal
+    assert [status.text for status in twitter.statuses] == [
+        "@bariexplorer The closest MBTA bus stop is Stop 1. (2/2)"
+    ]
+    assert twitter.statuses[0].in_reply_to_status_id == 77
+    assert journal.Journal(journal_path).pending_thread() is None
+    assert journal.position(journal_path) == (42, 4200)
+
+def test_posts_whole_thread_if_main_tweet_was_not_posted(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    half_posted = journal.Journal(journal_path)
+    half_posted.record(42, 4200, 100000042, "rendered", thread = THREAD)
+    half_posted.close()
+
+    twitter = synthetic.StubTwitterAPI()
+    assert make_runner(journal_path, twitter).run()
+
+    assert [status.text for status in twitter.statuses] == [
+        "72 Day St. is a parcel. (1/2)",
+        "@bariexplorer The closest MBTA bus stop is Stop 1. (2/2)",
+    ]
+    assert twitter.statuses[1].in_reply_to_status_id == twitter.statuses[0].id
+
+def test_finished_thread_is_not_reposted(tmp_path):
+    journal_path = str(tmp_path / "journal.jsonl")
+    finished = journal.Journal(journal_path)
+    finished.record(42, 4200, 100000042, "rendered", thread = THREAD)
+    finished.record(42, 4200, 100000042, "main_posted", status_id = 77)
+    finished.record(42, 4200, 100000042, "reply_posted", status_id = 78)
+    finished.close()
+
+    twitter = synthetic.StubTwitterAPI()
+    assert make_runner(journal_path, twitter).run()
+    assert twitter.statuses == []
+
+def test_default_crash_reporter_sends_grouped_crashes_when_run_returns(tmp_path):
+    def prepare(row):
+        raise FileNotFoundError("./tract_rent_maps/1.png")
+
+    slack = synthetic.StubSlackClient()
+    parcels = [(index, index * 100, {"Land_Parcel_ID": index}) for index in range(2)]
+    bot_runner = runner.Runner(
+        parcels, prepare, twitter = synthetic.StubTwitterAPI(), slack = slack,
+        slack_channel = "#test", clock = runner.VirtualClock(), prefetch_depth = 0,
+        thread_attempts = 1, log = lambda *args: None
+    )
+    assert bot_runner.run()
+
+    # the first crash is sent as it happens, and the repeat in a digest
+    assert len(slack.uploads) == 2
+    assert "crash digest" in slack.uploads[1]["initial_comment"]
+
+def test_journal_is_closed_on_leaving_with(tmp_path):
+    with journal.Journal(str(tmp_path / "journal.jsonl")) as posting_journal:
+        posting_journal.record(1, 100, 100000001, "rendered", thread = THREAD)
+        assert posting_journal.fd is not None
+    assert posting_journal.fd is None
+    assert journal.position(str(tmp_path / "journal.jsonl")) == (1, 100)
@@ -0,0 +1,66 @@
+import numpy
+import pandas
+import pytest
+
+import bot
+import export
+import transit
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_export_reads_parcels_like_the_bot(dataset, tmp_path, cache):
+    cache_dir = str(tmp_path / "cache") if (cache) else None
+    offsets = bot.parcel_offsets(dataset["parcels"])
+    exported = pandas.concat(list(export.shard_chunks(
+        dataset["parcels"], cache_dir, 500, 1500, offsets[499]
+    )))
+    live = pandas.concat([
+        chunk for (chunk, _) in bot.resume_parcel_chunks(
+            dataset["parcels"], None, cache_dir = cache_dir, first_index = 500, stop_index = 1500
+        )
+    ])
+    original = pandas.read_csv(dataset["parcels"], dtype = bot.PARCEL_SCHEMA).iloc[500:1500]
+
+    assert list(exported.index) == list(range(500, 1500))
+    for column in ["STOP_NAME", "STOP_TYPE", "NEAREST_TRANSIT_SECONDS"]:
+        assert exported[column].astype(object).tolist() == live[column].astype(object).tolist()
+    # the stops file was used
+    assert (exported["STOP_NAME"].astype(object) != original["STOP_NAME"].astype(object)).any()
+
+def test_parcels_without_location_keep_their_stop(dataset):
+    parcels = pandas.read_csv(dataset["parcels"], dtype = bot.PARCEL_SCHEMA).iloc[:100]
+    parcels.loc[parcels.index[:10], ["x", "y"]] = numpy.nan
+
+    refreshed = bot.DATA.refresh_transit_columns(parcels)
+    for column in ["STOP_NAME", "STOP_TYPE", "NEAREST_TRANSIT_SECONDS"]:
+        assert refreshed[column].iloc[:10].tolist() == parcels[column].iloc[:10].tolist()
+    assert refreshed["STOP_TYPE"].notnull().all()
+
+def test_reply_only_credits_openstreetmap_for_original_times(dataset):
+    parcels = pandas.read_csv(dataset["parcels"], dtype = bot.PARCEL_SCHEMA).iloc[:2]
+    parcels.loc[parcels.index[0], ["x", "y"]] = numpy.nan
+    rows = [row for (_, row) in bot.parcel_records(bot.DATA.refresh_transit_columns(parcels))]
+
+    assert "OpenStreetMap" in bot.generate_neighborhood_tweet(rows[0])["message"]
+    assert "OpenStreetMap" not in bot.generate_neighborhood_tweet(rows[1])["message"]
+
+def test_unlocated_parcels_have_no_nearest_stop():
+    stops = pandas.DataFrame({
+        "stop_name": ["Stop 1", "Stop 2"],
+        "STOP_TYPE": ["Bus", "Subway"],
+        "stop_lat": [42.35, 42.36],
+        "stop_lon": [-71.06, -71.05],
+        "routes": [("1",), ("Red",)],
+    })
+    index = transit.TransitIndex(stops)
+    (positions, meters) = index.nearest([-71.06, numpy.nan, -71.05], [42.35, 42.35, numpy.nan])
+    assert positions.tolist() == [0, -1, -1]
+    assert meters[0] == 0
+    assert numpy.isnan(meters[1:]).all()
+
+    # unlocated parcels don't count towards their block group's median
+    medians = index.blockgroup_medians(pandas.DataFrame({
+        "x": [-71.06, numpy.nan, numpy.nan],
+        "y": [42.35, numpy.nan, numpy.nan],
+        "BG_ID_10": [250250001001] * 3,
+    }))
+    assert medians["MEDIAN_TRANSIT_METERS"].tolist() == [0.0]
@@ -0,0 +1,25 @@
+import pandas
+import pytest
+
+import bot
+
+def read_parcels(paths, tmp_path, source):
+    if (source == "cache"):
+        return bot.load_cached_parcels(paths["parcels"], str(tmp_path / "cache"))[0]
+    return pandas.read_csv(paths["parcels"], dtype = bot.PARCEL_SCHEMA)
+
+@pytest.mark.parametrize("source", ["csv", "cache"])
+def test_batch_render_matches_per_row(dataset, tmp_path, source):
+    df = read_parcels(dataset, tmp_path, source)
+    (messages, picture_addresses) = bot.render_parcel_tweets(df)
+
+    assert len(messages) == len(df)
+    for ((_, row), message, picture_address) in zip(
+            bot.parcel_records(df), messages, picture_addresses):
+        assert bot.render_parcel_tweet(row) == (message, picture_address)
+
+def test_batch_render_keeps_index(dataset, tmp_path):
+    df = read_parcels(dataset, tmp_path, "csv").iloc[100:200]
+    (messages, picture_addresses) = bot.render_parcel_tweets(df)
+    assert list(messages.index) == list(df.index)
+    assert list(picture_addresses.index) == list(df.index)
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+# Nearest-transit columns, computed from a stops file at load time instead of
+# being baked into the parcels file ahead of time. Stops are projected to
+# metres and bucketed into a uniform grid, and the nearest stop to every parcel
+# centroid is found in one vectorised batch by searching outwards from each
+# parcel's grid cell, a ring of cells at a time, until no unsearched cell can
+# hold a closer stop. Walking distances and times are the straight-line
+# distance scaled by a detour factor, and the block group medians and the
+# number of lines serving each neighborhood are recomputed from them with a
+# groupby.
+#
+# The stops file is GTFS stops.txt (stop_name, stop_lat, stop_lon), with the
+# type of each stop either in a STOP_TYPE column or as a GTFS vehicle_type,
+# and optionally the routes serving each stop as a semicolon-separated list in
+# a routes column, from which the line counts are computed.
+#
+# usage: ./transit.py [-s STOPS] [-i PARCELS] [-o OUTPUT_DIR]
+
+import argparse
+import os
+import time
+
+import numpy
+import pandas
+
+# Metres per degree of latitude
+METERS_PER_DEGREE = 111320.0
+
+# Walking speed in metres per second (about 3 miles per hour)
+WALKING_SPEED = 1.34
+
+# Ratio of the distance walked along streets to the straight-line distance
+DETOUR_FACTOR = 1.3
+
+# Stops further than this from every parcel aren't counted towards any
+# neighborhood's lines
+STOP_NEIGHBORHOOD_METERS = 500.0
+
+# GTFS vehicle types -> STOP_TYPE; stops of other types are ignored
+VEHICLE_STOP_TYPES = {
+    0: "Subway", # light rail (the Green Line and Mattapan trolley)
+    1: "Subway",
+    3: "Bus",
+}
+
+# STOP_TYPE -> the neighborhood attribute counting its lines
+LINE_COUNT_COLUMNS = {
+    "Bus": "n_bus_lines",
+    "Subway": "n_subway_lines",
+}
+
+# Number of query points far outside the grid to compare with every indexed
+# point at a time
+BRUTE_FORCE_CHUNK = 256
+
+# Return x and y arrays in metres for arrays of longitudes and latitudes, using
+# an equirectangular projection about origin_lat, which is accurate to well
+# under a percent across a city
+def project(lon, lat, origin_lat):
+    lon = numpy.asarray(lon, dtype = float)
+    lat = numpy.asarray(lat, dtype = float)
+    x = lon * METERS_PER_DEGREE * numpy.cos(numpy.radians(origin_lat))
+    y = lat * METERS_PER_DEGREE
+    return (x, y)
+
+# Return the (dx, dy) offsets of the cells at Chebyshev distance r from a
+# cell, as an array with one row per cell
+def ring_offsets(r):
+    if (r == 0):
+        return numpy.zeros((1, 2), dtype = numpy.int64)
+    side = numpy.arange(-r, r + 1)
+    inner = numpy.arange(-r + 1, r)
+    return numpy.concatenate([
+        numpy.column_stack([side, numpy.full(len(side), -r)]),
+        numpy.column_stack([side, numpy.full(len(side), r)]),
+        numpy.column_stack([numpy.full(len(inner), -r), inner]),
+        numpy.column_stack([numpy.full(len(inner), r), inner]),
+    ])
+
+# Uniform grid over a set of points, answering nearest-point queries for many
+# points at once
+class GridIndex(object):
+
+    # x, y: coordinates of the points, in metres
+    # cell_size: width of each cell in metres, or None to pick one that puts
+    #   a couple of points in each cell on average
+    def __init__(self, x, y, cell_size = None):
+        self.x = numpy.asarray(x, dtype = float)
+        self.y = numpy.asarray(y, dtype = float)
+        if (len(self.x) == 0):
+            raise ValueError("can't index an empty set of points")
+        (self.x0, self.y0) = (self.x.min(), self.y.min())
+        if (cell_size is None):
+            area = (self.x.max() - self.x0) * (self.y.max() - self.y0)
+            cell_size = max(100.0, numpy.sqrt(2 * area / len(self.x)))
+        self.cell_size = cell_size
+        self.nx = int((self.x.max() - self.x0) // cell_size) + 1
+        self.ny = int((self.y.max() - self.y0) // cell_size) + 1
+
+        # points sorted by cell, with the points of cell c at
+        # order[starts[c]:starts[c + 1]]
+        cells = self.cell_ids(*self.cell_coordinates(self.x, self.y))
+        self.order = numpy.argsort(cells, kind = "stable")
+        self.starts = numpy.searchsorted(
+            cells[self.order], numpy.arange(self.nx * self.ny + 1)
+        )
+
+    def cell_coordinates(self, x, y):
+        return (
+            numpy.floor((x - self.x0) / self.cell_size).astype(numpy.int64),
+            numpy.floor((y - self.y0) / self.cell_size).astype(numpy.int64),
+        )
+
+    def cell_ids(self, cx, cy):
+        return cy * self.nx + cx
+
+    # Return (positions, distances): for each query point, the position of the
+    # nearest indexed point and the distance to it in metres, or -1 and NaN if
+    # there is no point within max_distance or the query point is missing
+    def nearest(self, x, y, max_distance = numpy.inf):
+        x = numpy.asarray(x, dtype = float)
+        y = numpy.asarray(y, dtype = float)
+        best_squared = numpy.full(len(x), numpy.inf)
+        best = numpy.full(len(x), -1, dtype = numpy.int64)
+
+        active = numpy.flatnonzero(numpy.isfinite(x) & numpy.isfinite(y))
+        (cx, cy) = self.cell_coordinates(
+            numpy.where(numpy.isfinite(x), x, self.x0),
+            numpy.where(numpy.isfinite(y), y, self.y0)
+        )
+        # the ring past which a query's rings are entirely outside the grid
+        last_ring = numpy.maximum.reduce([
+            numpy.abs(cx), numpy.abs(self.nx - 1 - cx),
+            numpy.abs(cy), numpy.abs(self.ny - 1 - cy),
+        ])
+
+        # searching outwards from far outside the grid would mean many rings
+        # of empty cells, so points that far away are compared with every
+        # indexed point instead
+        far = active[last_ring[active] > 2 * max(self.nx, self.ny)]
+        active = active[last_ring[active] <= 2 * max(self.nx, self.ny)]
+        for start in range(0, len(far), BRUTE_FORCE_CHUNK):
+            queries = far[start:start + BRUTE_FORCE_CHUNK]
+            squared = (
+                (x[queries, None] - self.x) ** 2 + (y[queries, None] - self.y) ** 2
+            )
+            best[queries] = squared.argmin(axis = 1)
+            best_squared[queries] = squared.min(axis = 1)
+
+        r = 0
+        while (len(active) > 0):
+            offsets = ring_offsets(r)
+            ring_x = cx[active][:, None] + offsets[:, 0]
+            ring_y = cy[active][:, None] + offsets[:, 1]
+            inside = (ring_x >= 0) & (ring_x < self.nx) & (ring_y >= 0) & (ring_y < self.ny)
+            queries = numpy.repeat(active, len(offsets))[inside.ravel()]
+            cells = self.cell_ids(ring_x[inside], ring_y[inside])
+
+            # every (query, point) pair for the points in the ring's cells
+            counts = self.starts[cells + 1] - self.starts[cells]
+            queries = numpy.repeat(queries, counts)
+            group_starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+            points = self.order[
+                numpy.repeat(self.starts[cells], counts)
+                + numpy.arange(len(queries)) - group_starts
+            ]
+            squared = (x[queries] - self.x[points]) ** 2 + (y[queries] - self.y[points]) ** 2
+
+            # keep the closest point for each query, if it beats its best so
+            # far
+            numpy.minimum.at(best_squared, queries, squared)
+            closest = squared == best_squared[queries]
+            best[queries[closest]] = points[closest]
+
+            # points in later rings are at least r cells away
+            reach = r * self.cell_size
+            active = active[
+                (best_squared[active] > reach ** 2)
+                & (reach < max_distance)
+                & (r < last_ring[active])
+            ]
+            r += 1
+
+        distances = numpy.sqrt(best_squared)
+        # a missing query point is never searched, so its distance is still
+        # infinite
+        too_far = ~numpy.isfinite(distances) | (distances > max_distance)
+        best[too_far] = -1
+        distances[too_far] = numpy.nan
+        return (best, distances)
+
+# Read a stops file into a DataFrame with the columns stop_name, STOP_TYPE,
+# stop_lat, stop_lon and routes (a tuple of route IDs, empty if the file has
+# no routes), dropping stations and entrances and stops of other types
+def read_stops(path):
+    stops = pandas.read_csv(path, dtype = {"stop_id": str, "routes": str})
+    if ("location_type" in stops.columns):
+        stops = stops[stops["location_type"].fillna(0) == 0]
+    if ("STOP_TYPE" not in stops.columns):
+        stops = stops.assign(STOP_TYPE = stops["vehicle_type"].map(VEHICLE_STOP_TYPES))
+    stops = stops[stops["STOP_TYPE"].isin(list(LINE_COUNT_COLUMNS))]
+    stops = stops[stops["stop_lat"].notnull() & stops["stop_lon"].notnull()]
+    if ("routes" in stops.columns):
+        routes = stops["routes"].fillna("").map(
+            lambda routes: tuple(route for route in routes.split(";") if (route != ""))
+        )
+    else:
+        routes = pandas.Series([()] * len(stops), index = stops.index)
+    return pandas.DataFrame({
+        "stop_name": stops["stop_name"].astype(str),
+        "STOP_TYPE": stops["STOP_TYPE"],
+        "stop_lat": stops["stop_lat"].astype(float),
+        "stop_lon": stops["stop_lon"].astype(float),
+        "routes": routes,
+    }).reset_index(drop = True)
+
+class TransitIndex(object):
+
+    # stops: DataFrame as returned by read_stops
+    def __init__(self, stops, cell_size = None):
+        if (len(stops) == 0):
+            raise ValueError("no bus or subway stops to index")
+        self.stops = stops
+        self.origin_lat = stops["stop_lat"].mean()
+        self.grid = GridIndex(
+            *project(stops["stop_lon"], stops["stop_lat"], self.origin_lat),
+            cell_size = cell_size
+        )
+        (self.name_codes, self.names) = pandas.factorize(stops["stop_name"])
+        (self.type_codes, self.types) = pandas.factorize(stops["STOP_TYPE"])
+
+    # Return (positions, walking_meters) for arrays of longitudes and
+    # latitudes, where positions are rows of the stops, or -1 where the
+    # location is missing
+    def nearest(self, lon, lat):
+        (positions, straight) = self.grid.nearest(*project(lon, lat, self.origin_lat))
+        return (positions, straight * DETOUR_FACTOR)
+
+    # Return a copy of parcels with the STOP_NAME, STOP_TYPE and
+    # NEAREST_TRANSIT_SECONDS columns recomputed from the parcels' x and y.
+    # Parcels with no location keep the values they had, if they had any.
+    def refresh_parcels(self, parcels):
+        (positions, meters) = self.nearest(parcels["x"], parcels["y"])
+        found = positions >= 0
+
+        def refreshed(column, values):
+            values = pandas.Series(values, index = parcels.index)
+            if ((column in parcels.columns) and (not found.all())):
+                values = values.astype(object).where(found, parcels[column].astype(object))
+            return values
+
+        return parcels.assign(
+            STOP_TYPE = refreshed("STOP_TYPE", pandas.Categorical.from_codes(
+                numpy.where(found, self.type_codes[positions], -1), self.types
+            )).astype("category"),
+            STOP_NAME = refreshed("STOP_NAME", pandas.Categorical.from_codes(
+                numpy.where(found, self.name_codes[positions], -1), self.names
+            )).astype("category"),
+            NEAREST_TRANSIT_SECONDS = refreshed(
+                "NEAREST_TRANSIT_SECONDS", (meters / WALKING_SPEED).round(1)
+            ).astype(float),
+        )
+
+    # Return the median walking distance to the nearest stop of the parcels in
+    # each block group, as a DataFrame with the columns BG_ID_10 and
+    # MEDIAN_TRANSIT_METERS
+    def blockgroup_medians(self, parcels):
+        (_, meters) = self.nearest(parcels["x"], parcels["y"])
+        medians = pandas.DataFrame({
+            "BG_ID_10": parcels["BG_ID_10"].to_numpy(),
+            "MEDIAN_TRANSIT_METERS": meters,
+        }).dropna().groupby("BG_ID_10")["MEDIAN_TRANSIT_METERS"].median()
+        return medians.round(1).reset_index()
+
+    # Return the number of distinct lines of each type serving each
+    # neighborhood, as a DataFrame with the columns Name, n_bus_lines and
+    # n_subway_lines, or None if the stops have no routes. Each stop belongs
+    # to the neighborhood of the parcel closest to it.
+    def neighborhood_lines(self, parcels):
+        if (self.stops["routes"].map(len).sum() == 0):
+            return None
+        located = parcels[parcels["x"].notnull() & parcels["y"].notnull()]
+        parcel_grid = GridIndex(*project(located["x"], located["y"], self.origin_lat))
+        (closest, _) = parcel_grid.nearest(
+            self.grid.x, self.grid.y, max_distance = STOP_NEIGHBORHOOD_METERS
+        )
+        neighborhoods = located["neighborhood"].astype(object).to_numpy()
+        lines = pandas.DataFrame({
+            "Name": numpy.where(closest >= 0, neighborhoods[closest], None),
+            "STOP_TYPE": self.stops["STOP_TYPE"],
+            "route": self.stops["routes"],
+        }).explode("route").dropna()
+        counts = lines.groupby(["Name", "STOP_TYPE"])["route"].nunique().unstack(fill_value = 0)
+        counts = counts.reindex(columns = list(LINE_COUNT_COLUMNS), fill_value = 0)
+        return counts.rename(columns = LINE_COUNT_COLUMNS).rename_axis(columns = None).reset_index()
+
+# Return a copy of an attribute DataFrame with the columns of recomputed
+# replaced wherever its rows have the same key; other rows are left as they were
+def update_attributes(attributes, recomputed, key_column):
+    updated = attributes.copy()
+    recomputed = recomputed.set_index(key_column)
+    keys = updated[key_column]
+    for column in recomputed.columns:
+        values = keys.map(recomputed[column]).fillna(updated[column])
+        updated[column] = values.astype(updated[column].dtype)
+    return updated
+
+if (__name__ == "__main__"):
+    import bot
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--stops", default = bot.INPUT_STOPS)
+    parser.add_argument("-i", "--parcels", default = bot.INPUT_PARCELS)
+    parser.add_argument("-o", "--output-dir", dest = "output_dir", default = None,
+                        help = "directory to write the refreshed parcels, block groups and neighborhoods to")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = TransitIndex(read_stops(args.stops))
+    parcels = pandas.read_csv(args.parcels, dtype = bot.PARCEL_SCHEMA)
+    loaded = time.perf_counter()
+    refreshed = index.refresh_parcels(parcels)
+    medians = index.blockgroup_medians(parcels)
+    lines = index.neighborhood_lines(parcels)
+    finished = time.perf_counter()
+
+    print("%d stops, %d parcels read in %0.3f seconds" % (
+        len(index.stops), len(parcels), loaded - started
+    ))
+    print("nearest stops, %d block group medians and %s computed in %0.3f seconds" % (
+        len(medians),
+        "no line counts" if (lines is None) else "%d neighborhood line counts" % len(lines),
+        finished - loaded
+    ))
+    print("%d parcels have no stop within walking distance" % refreshed["STOP_NAME"].isnull().sum())
+    if (args.output_dir is not None):
+        os.makedirs(args.output_dir, exist_ok = True)
+        refreshed.to_csv(os.path.join(args.output_dir, os.path.basename(args.parcels)), index = False)
+        update_attributes(
+            pandas.read_csv(bot.INPUT_BLOCKGROUPS), medians, bot.BLOCKGROUP_KEY
+        ).to_csv(os.path.join(args.output_dir, os.path.basename(bot.INPUT_BLOCKGROUPS)), index = False)
+        if (lines is not None):
+            update_attributes(
+                pandas.read_csv(bot.INPUT_NEIGHBORHOODS), lines, bot.NEIGHBORHOOD_KEY
+            ).to_csv(os.path.join(args.output_dir, os.path.basename(bot.INPUT_NEIGHBORHOODS)), index = False)